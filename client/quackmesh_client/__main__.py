@@ -11,6 +11,7 @@ from eth_account import Account
 from pathlib import Path
 import uvicorn
 from .worker_server import create_app
+from .model_transport import fetch_model_info, post_update
 
 API_BASE = os.getenv("ORCHESTRATOR_API", "http://localhost:8000/api")
 API_KEY = os.getenv("API_KEY")
@@ -27,36 +28,40 @@ def get_specs_json() -> str:
     return json.dumps(specs)
 
 
-def random_init(shape_list: List[int]) -> List[List[float]]:
+def random_init(shape_list: List[int]) -> List[np.ndarray]:
     rs = np.random.RandomState(42)
-    weights: List[List[float]] = []
+    weights: List[np.ndarray] = []
     for n in shape_list:
-        weights.append((rs.randn(n) * 0.01).astype(np.float32).tolist())
+        weights.append((rs.randn(n) * 0.01).astype(np.float32))
     return weights
 
 
 def contributor(job_id: int, steps: int = 1):
     # fetch model
-    r = requests.get(f"{API_BASE}/job/{job_id}/model", timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    weights = data.get("weights") or random_init([128, 10])
+    base, info = fetch_model_info(API_BASE, job_id, timeout=10)
+    weights = base or random_init([128, 10])
 
     # train locally (dummy training on random data to keep lightweight)
     for _ in range(steps):
         # simulate small update: add small noise
-        weights = [(np.array(w) + np.random.randn(*np.array(w).shape) * 0.001).astype(np.float32).tolist() for w in weights]
+        weights = [(w + np.random.randn(*w.shape) * 0.001).astype(np.float32) for w in weights]
 
     # simple validation accuracy proxy
     val_acc = float(np.clip(70 + np.random.randn() * 5, 0, 100))
 
-    r = requests.post(
-        f"{API_BASE}/job/{job_id}/update",
-        json={"weights": weights, "val_accuracy": val_acc},
+    post_update(
+        API_BASE,
+        job_id,
+        weights,
+        val_acc,
         headers=api_headers(),
         timeout=10,
+        codec=info["update_codec"],
+        base=base or None,
+        base_digest=info["digest"] if base else None,
+        base_version=info["version"] if base else None,
+        num_examples=max(1, steps),
     )
-    r.raise_for_status()
     print("Submitted update, val_acc=", val_acc)
 
 
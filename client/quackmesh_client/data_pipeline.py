@@ -1,7 +1,21 @@
+"""Datasets for worker training.
+
+Datasets, DataLoaders and text splits are built once per worker process and reused
+by every round (a DataLoader reshuffles on each pass). Call ``invalidate`` when the
+underlying data changes, e.g. after replacing the files under DATA_DIR.
+
+MNIST is decoded once into uint8 ``.npy`` files under ``DATA_DIR/mnist-tensors``
+that later processes memory-map, and batches are sliced from those arrays by
+``BatchLoader`` (one fancy-index and one float conversion per batch) instead of
+going through PIL and ``ToTensor`` per sample. Fake MNIST is decoded into memory
+the same way. ``MNIST_TENSOR_CACHE=0`` restores the torchvision DataLoaders.
+"""
 import os
 import logging
-from typing import List, Tuple, Optional
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Sequence, Tuple, Optional
 
+import numpy as np
 import torch
 from torch.utils.data import DataLoader
 import torchvision
@@ -14,9 +28,132 @@ import csv
 logger = logging.getLogger("quackmesh.data")
 
 DATA_DIR = os.getenv("DATA_DIR", "/tmp/data")
+MNIST_TENSOR_CACHE = os.getenv("MNIST_TENSOR_CACHE", "1") != "0"
+MNIST_TENSOR_DIR = os.path.join(DATA_DIR, "mnist-tensors")
+
+_cache: Dict[Hashable, Any] = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(key: Hashable, build: Callable[[], Any]) -> Any:
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+        # Built under the lock: concurrent rounds wait for one load instead of racing
+        value = build()
+        _cache[key] = value
+        return value
+
+
+def invalidate(kind: Optional[str] = None) -> int:
+    """Drop cached datasets (all, or one kind: mnist, fake_mnist, text). Returns entries dropped."""
+    with _cache_lock:
+        keys = [k for k in _cache if kind is None or k[0] == kind]
+        for k in keys:
+            del _cache[k]
+        if kind in (None, "mnist"):
+            _remove_mnist_tensors()
+    if keys:
+        logger.info("data.cache.invalidate", extra={"kind": kind, "entries": len(keys)})
+    return len(keys)
+
+
+class BatchLoader:
+    """Batches of an in-memory (or memory-mapped) uint8 image array, like a DataLoader.
+
+    Yields ``(x, y)`` with ``x`` float32 in [0, 1] shaped ``(B, 1, H, W)`` and ``y``
+    int64, as ``ToTensor`` would. Each pass reshuffles when ``shuffle`` is set.
+    """
+
+    def __init__(self, images: np.ndarray, labels: np.ndarray, batch_size: int, shuffle: bool, seed: Optional[int] = None):
+        self.images = images
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels, dtype=np.int64))
+        self.batch_size = max(1, batch_size)
+        self.shuffle = shuffle
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return (len(self.images) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        n = len(self.images)
+        order = self._rng.permutation(n) if self.shuffle else None
+        for start in range(0, n, self.batch_size):
+            if order is None:
+                idx = slice(start, min(start + self.batch_size, n))
+            else:
+                # Sorted, so a memory-mapped array is read front to back within the batch
+                idx = np.sort(order[start:start + self.batch_size])
+            x = torch.from_numpy(self.images[idx].astype(np.float32)).div_(255.0)
+            yield x.unsqueeze(1), self.labels[idx]
+
+
+def get_mnist_loaders(batch_size: int = 128) -> Tuple[BatchLoader, BatchLoader]:
+    if not MNIST_TENSOR_CACHE:
+        return _cached(("mnist", batch_size, "torchvision"), lambda: _build_mnist_loaders(batch_size))
+    return _cached(("mnist", batch_size), lambda: _build_mnist_batch_loaders(batch_size))
+
+
+def get_fake_mnist_loaders(batch_size: int = 128) -> Tuple[BatchLoader, BatchLoader]:
+    if not MNIST_TENSOR_CACHE:
+        return _cached(("fake_mnist", batch_size, "torchvision"), lambda: _build_fake_mnist_loaders(batch_size))
+    return _cached(("fake_mnist", batch_size), lambda: _build_fake_mnist_batch_loaders(batch_size))
+
+
+def _build_mnist_batch_loaders(batch_size: int) -> Tuple[BatchLoader, BatchLoader]:
+    train_x, train_y = _mnist_tensors(train=True)
+    test_x, test_y = _mnist_tensors(train=False)
+    return BatchLoader(train_x, train_y, batch_size, shuffle=True), BatchLoader(test_x, test_y, batch_size, shuffle=False)
+
+
+def _build_fake_mnist_batch_loaders(batch_size: int) -> Tuple[BatchLoader, BatchLoader]:
+    train_x, train_y = _decode(torchvision.datasets.FakeData(size=10000, image_size=(1, 28, 28), num_classes=10))
+    test_x, test_y = _decode(torchvision.datasets.FakeData(size=2000, image_size=(1, 28, 28), num_classes=10))
+    return BatchLoader(train_x, train_y, batch_size, shuffle=True), BatchLoader(test_x, test_y, batch_size, shuffle=False)
+
+
+def _decode(ds) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode a PIL-image dataset once into (N, H, W) uint8 images and int64 labels."""
+    images: List[np.ndarray] = []
+    labels: List[int] = []
+    for img, y in ds:
+        images.append(np.asarray(img.convert("L"), dtype=np.uint8))
+        labels.append(int(y))
+    return np.stack(images), np.asarray(labels, dtype=np.int64)
+
+
+def _mnist_tensor_paths(train: bool) -> Tuple[str, str]:
+    split = "train" if train else "test"
+    return os.path.join(MNIST_TENSOR_DIR, f"{split}-images.npy"), os.path.join(MNIST_TENSOR_DIR, f"{split}-labels.npy")
+
 
+def _mnist_tensors(train: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Memory-mapped MNIST images and labels, converted from the torchvision files on first use."""
+    images_path, labels_path = _mnist_tensor_paths(train)
+    if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+        logger.info("mnist.tensors.build", extra={"train": train, "dir": MNIST_TENSOR_DIR})
+        # .data/.targets are the raw idx arrays: no per-sample PIL decode needed
+        ds = torchvision.datasets.MNIST(root=DATA_DIR, train=train, download=True)
+        os.makedirs(MNIST_TENSOR_DIR, exist_ok=True)
+        # Labels last: their presence marks a complete conversion; os.replace keeps readers off partial files
+        for path, arr in ((images_path, ds.data.numpy().astype(np.uint8)), (labels_path, ds.targets.numpy().astype(np.int64))):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+    return np.load(images_path, mmap_mode="r"), np.load(labels_path)
 
-def get_mnist_loaders(batch_size: int = 128) -> Tuple[DataLoader, DataLoader]:
+
+def _remove_mnist_tensors() -> None:
+    for train in (True, False):
+        for path in _mnist_tensor_paths(train):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _build_mnist_loaders(batch_size: int) -> Tuple[DataLoader, DataLoader]:
     tfm = transforms.Compose([transforms.ToTensor()])
     train_ds = torchvision.datasets.MNIST(root=DATA_DIR, train=True, download=True, transform=tfm)
     test_ds = torchvision.datasets.MNIST(root=DATA_DIR, train=False, download=True, transform=tfm)
@@ -25,7 +162,7 @@ def get_mnist_loaders(batch_size: int = 128) -> Tuple[DataLoader, DataLoader]:
     return train_loader, test_loader
 
 
-def get_fake_mnist_loaders(batch_size: int = 128) -> Tuple[DataLoader, DataLoader]:
+def _build_fake_mnist_loaders(batch_size: int) -> Tuple[DataLoader, DataLoader]:
     tfm = transforms.Compose([transforms.ToTensor()])
     train_ds = torchvision.datasets.FakeData(size=10000, image_size=(1, 28, 28), num_classes=10, transform=tfm)
     test_ds = torchvision.datasets.FakeData(size=2000, image_size=(1, 28, 28), num_classes=10, transform=tfm)
@@ -34,6 +171,10 @@ def get_fake_mnist_loaders(batch_size: int = 128) -> Tuple[DataLoader, DataLoade
     return train_loader, test_loader
 
 
+class _LoadFailed(Exception):
+    pass
+
+
 def get_text_classification_data(dataset_id: Optional[str], hf_token: Optional[str], max_examples: int = 128) -> Tuple[List[str], List[int]]:
     texts: List[str] = ["hello world", "quack mesh", "duck ai", "federated learning"]
     labels: List[int] = [0, 1, 0, 1]
@@ -43,39 +184,91 @@ def get_text_classification_data(dataset_id: Optional[str], hf_token: Optional[s
     lcol = os.getenv("LABEL_COL")
     if local_path and tcol and lcol:
         try:
-            return _load_local_text_data(local_path, tcol, lcol, max_examples)
+            return _cached(("text", local_path, tcol, lcol, max_examples), lambda: _load_local_text_data(local_path, tcol, lcol, max_examples))
         except Exception as e:
             logger.warning("local.text.load.fail", extra={"path": local_path, "error": str(e)})
     if not dataset_id:
         return texts, labels
     try:
-        logger.info("hf.dataset.load", extra={"dataset": dataset_id})
-        ds_train = load_dataset(dataset_id, split="train[:2%]", use_auth_token=hf_token)
-        # Heuristics to find text/label columns
-        text_cols = [c for c in ds_train.column_names if c.lower() in ("text", "sentence", "review", "content", "document")]
-        label_cols = [c for c in ds_train.column_names if c.lower() in ("label", "labels", "target", "class")]
-        tcol = text_cols[0] if text_cols else None
-        lcol = label_cols[0] if label_cols else None
-        if tcol and lcol:
-            n = min(max_examples, len(ds_train))
-            sub = ds_train.select(range(n))
-            texts = [str(ex[tcol]) for ex in sub]
-            raw_labels = [ex[lcol] for ex in sub]
-            if isinstance(raw_labels[0], (list, tuple)):
-                raw_labels = [int(x[0]) for x in raw_labels]
-            labels = [int(x) for x in raw_labels]
-    except Exception as e:
-        logger.warning("hf.dataset.load.fail", extra={"dataset": dataset_id, "error": str(e)})
-    return texts, labels
+        # Failures are not cached, so the next round retries the download
+        return _cached(("text", dataset_id, max_examples), lambda: _load_hf_text_data(dataset_id, hf_token, max_examples, ("train[:2%]",)))
+    except _LoadFailed:
+        return texts, labels
+
+
+def get_text_classification_holdout(
+    dataset_id: Optional[str], hf_token: Optional[str], max_examples: int = 256, train_examples: int = 128
+) -> Tuple[List[str], List[int]]:
+    """Held-out examples for evaluation: the dataset's validation or test split, else the end of train.
+
+    A local TEXT_DATA_PATH file is split instead: rows past the first ``train_examples``
+    (or the file named by TEXT_EVAL_PATH). Without a dataset the dummy texts are used.
+    """
+    local_path = os.getenv("TEXT_EVAL_PATH") or os.getenv("TEXT_DATA_PATH")
+    tcol = os.getenv("TEXT_COL")
+    lcol = os.getenv("LABEL_COL")
+    if local_path and tcol and lcol:
+        skip = 0 if os.getenv("TEXT_EVAL_PATH") else train_examples
+
+        def _load_local():
+            texts, labels = _load_local_text_data(local_path, tcol, lcol, max_examples, skip=skip)
+            if not texts:
+                raise ValueError(f"no rows after the first {skip}")
+            return texts, labels
+
+        try:
+            return _cached(("text", local_path, tcol, lcol, max_examples, skip), _load_local)
+        except Exception as e:
+            logger.warning("local.text.load.fail", extra={"path": local_path, "error": str(e)})
+    if not dataset_id:
+        return get_text_classification_data(None, None)
+    splits = (f"validation[:{max_examples}]", f"test[:{max_examples}]", "train[-2%:]")
+    try:
+        return _cached(("text", dataset_id, "holdout", max_examples), lambda: _load_hf_text_data(dataset_id, hf_token, max_examples, splits))
+    except _LoadFailed:
+        return get_text_classification_data(None, None)
+
+
+def _load_hf_text_data(dataset_id: str, hf_token: Optional[str], max_examples: int, splits: Sequence[str]) -> Tuple[List[str], List[int]]:
+    """Examples of the first of ``splits`` that loads and has labelled text."""
+    error: Optional[Exception] = None
+    for split in splits:
+        try:
+            logger.info("hf.dataset.load", extra={"dataset": dataset_id, "split": split})
+            return _text_examples(load_dataset(dataset_id, split=split, use_auth_token=hf_token), max_examples)
+        except Exception as e:
+            error = e
+    logger.warning("hf.dataset.load.fail", extra={"dataset": dataset_id, "error": str(error)})
+    raise _LoadFailed() from error
+
+
+def _text_examples(ds, max_examples: int) -> Tuple[List[str], List[int]]:
+    # Heuristics to find text/label columns
+    text_cols = [c for c in ds.column_names if c.lower() in ("text", "sentence", "review", "content", "document")]
+    label_cols = [c for c in ds.column_names if c.lower() in ("label", "labels", "target", "class")]
+    if not text_cols or not label_cols:
+        raise ValueError(f"no text/label columns in {ds.column_names}")
+    tcol, lcol = text_cols[0], label_cols[0]
+    sub = ds.select(range(min(max_examples, len(ds))))
+    raw_labels = [ex[lcol] for ex in sub]
+    if raw_labels and isinstance(raw_labels[0], (list, tuple)):
+        raw_labels = [x[0] for x in raw_labels]
+    # Unlabelled rows (e.g. label -1 in a hidden test split) are dropped
+    pairs = [(str(ex[tcol]), int(y)) for ex, y in zip(sub, raw_labels) if int(y) >= 0]
+    if not pairs:
+        raise ValueError("no labelled examples")
+    return [t for t, _ in pairs], [y for _, y in pairs]
 
 
-def _load_local_text_data(path: str, text_col: str, label_col: str, max_examples: int) -> Tuple[List[str], List[int]]:
+def _load_local_text_data(path: str, text_col: str, label_col: str, max_examples: int, skip: int = 0) -> Tuple[List[str], List[int]]:
     texts: List[str] = []
     labels: List[int] = []
     if path.lower().endswith(".jsonl") or path.lower().endswith(".ndjson"):
         with open(path, "r", encoding="utf-8") as f:
             for i, line in enumerate(f):
-                if i >= max_examples:
+                if i < skip:
+                    continue
+                if i >= skip + max_examples:
                     break
                 obj = json.loads(line)
                 texts.append(str(obj[text_col]))
@@ -84,7 +277,9 @@ def _load_local_text_data(path: str, text_col: str, label_col: str, max_examples
         with open(path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for i, row in enumerate(reader):
-                if i >= max_examples:
+                if i < skip:
+                    continue
+                if i >= skip + max_examples:
                     break
                 texts.append(str(row[text_col]))
                 labels.append(int(row[label_col]))
@@ -0,0 +1,127 @@
+"""Process-wide cache of Hugging Face models and tokenizers.
+
+Loading a sequence classifier with ``from_pretrained`` takes seconds to minutes, so
+the worker keeps loaded models keyed by ``(model id, revision)`` and reuses them
+across rounds and endpoints. The cache holds at most ``HF_MODEL_CACHE_MB`` of
+parameters and buffers; the least recently used models are evicted past that (a
+model larger than the budget is still served, it just displaces everything else).
+
+A cached model carries whatever weights the previous lease left in it. Callers load
+the new global weights into it, and fall back to ``CachedModel.restore()`` (back to
+the pretrained weights) when there are none.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Tuple
+
+from torch import nn
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+HF_MODEL_CACHE_MB = int(os.getenv("HF_MODEL_CACHE_MB", "4096"))  # 0 disables caching
+HF_MODEL_REVISION = os.getenv("HF_MODEL_REVISION", "main")
+
+logger = logging.getLogger("quackmesh.hf_cache")
+
+
+def model_nbytes(model: nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in model.state_dict().values())
+
+
+class CachedModel:
+    def __init__(self, model_id: str, revision: str, token: Optional[str]):
+        self.model_id = model_id
+        self.revision = revision
+        self.lock = threading.Lock()
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, revision=revision, use_auth_token=token)
+        self.model = self._load_model(token)
+        self.nbytes = model_nbytes(self.model)
+        # False until a lease may have changed the weights
+        self.dirty = False
+        self._token = token
+
+    def _load_model(self, token: Optional[str]) -> nn.Module:
+        return AutoModelForSequenceClassification.from_pretrained(self.model_id, revision=self.revision, use_auth_token=token)
+
+    def restore(self) -> None:
+        """Put the pretrained weights back (from the local HF cache) if a lease changed them."""
+        if not self.dirty:
+            return
+        logger.info("hf.cache.restore", extra={"model": self.model_id, "revision": self.revision})
+        pretrained = self._load_model(self._token)
+        self.model.load_state_dict(pretrained.state_dict())
+        self.dirty = False
+
+
+class ModelCache:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[Tuple[str, str], CachedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One loader per key at a time, so concurrent requests don't load the same model twice
+        self._loading: dict = {}
+
+    def _get(self, model_id: str, revision: str, token: Optional[str]) -> CachedModel:
+        key = (model_id, revision)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry
+            logger.info("hf.model.load.begin", extra={"model": model_id, "revision": revision})
+            entry = None
+            try:
+                entry = CachedModel(model_id, revision, token)
+                logger.info("hf.model.load.ok", extra={"model": model_id, "revision": revision, "mb": entry.nbytes // 2**20})
+            finally:
+                # Also on failure (bad revision, network), so waiters retry with their own load
+                with self._lock:
+                    if self._loading.get(key) is load_lock:
+                        del self._loading[key]
+                    if entry is not None and self.budget_bytes > 0:
+                        self._entries[key] = entry
+                        self._evict()
+            return entry
+
+    def _evict(self) -> None:
+        used = sum(e.nbytes for e in self._entries.values())
+        while used > self.budget_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            used -= entry.nbytes
+            logger.info("hf.cache.evict", extra={"model": key[0], "revision": key[1], "mb": entry.nbytes // 2**20})
+
+    @contextmanager
+    def lease(self, model_id: str, token: Optional[str], revision: Optional[str] = None) -> Iterator[CachedModel]:
+        """Exclusive use of the cached model for ``model_id``; loads it on a miss.
+
+        Anything the caller does to the weights stays in the cached model, so the next
+        lease must reset them.
+        """
+        entry = self._get(model_id, revision or HF_MODEL_REVISION, token)
+        with entry.lock:
+            # The token is only needed for reloads; keep the most recent one
+            entry._token = token
+            try:
+                yield entry
+            finally:
+                entry.dirty = True
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "models": [f"{m}@{r}" for m, r in self._entries],
+                "mb": sum(e.nbytes for e in self._entries.values()) // 2**20,
+                "budget_mb": self.budget_bytes // 2**20,
+            }
+
+
+model_cache = ModelCache(HF_MODEL_CACHE_MB * 2**20)
@@ -0,0 +1,191 @@
+"""Batched fine-tuning and evaluation of Hugging Face sequence classifiers on the worker.
+
+Texts are tokenized once, without padding, and the token ids are cached per
+tokenizer, so later rounds skip tokenization entirely. Batches are formed from
+examples of similar length (length bucketing) and padded only to the longest
+example in the batch (dynamic padding). One optimizer step covers
+``HF_GRAD_ACCUM`` batches of ``HF_BATCH_SIZE`` examples.
+
+Evaluation runs the same way under ``torch.inference_mode`` over a held-out split
+(``HF_EVAL_EXAMPLES`` examples, ``HF_EVAL_BATCH_SIZE`` per batch). Throughput is
+reported as samples and (non-padding) tokens per second.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from torch import nn
+
+from .data_pipeline import get_text_classification_holdout
+
+HF_BATCH_SIZE = int(os.getenv("HF_BATCH_SIZE", "16"))
+HF_GRAD_ACCUM = int(os.getenv("HF_GRAD_ACCUM", "1"))
+HF_MAX_LENGTH = int(os.getenv("HF_MAX_LENGTH", "32"))
+HF_LR = float(os.getenv("HF_LR", "5e-5"))
+HF_TRAIN_EXAMPLES = int(os.getenv("HF_TRAIN_EXAMPLES", "64"))  # examples taken from the dataset per worker
+HF_EVAL_EXAMPLES = int(os.getenv("HF_EVAL_EXAMPLES", "256"))
+HF_EVAL_BATCH_SIZE = int(os.getenv("HF_EVAL_BATCH_SIZE", str(2 * HF_BATCH_SIZE)))
+# Examples sorted together when bucketing, in batches; larger pools pad less but shuffle less
+HF_BUCKET_BATCHES = int(os.getenv("HF_BUCKET_BATCHES", "50"))
+
+logger = logging.getLogger("quackmesh.hf_training")
+
+
+class TokenizedDataset:
+    def __init__(self, input_ids: List[List[int]], labels: List[int], pad_id: int):
+        self.input_ids = input_ids
+        self.labels = labels
+        self.pad_id = pad_id
+        self.lengths = [len(ids) for ids in input_ids]
+
+    def __len__(self) -> int:
+        return len(self.input_ids)
+
+    def collate(self, indices: Sequence[int]) -> Tuple[Dict[str, torch.Tensor], torch.Tensor, int]:
+        """Batch of ``indices`` padded to its longest example; also returns the real token count."""
+        width = max(self.lengths[i] for i in indices)
+        ids = torch.full((len(indices), width), self.pad_id, dtype=torch.long)
+        mask = torch.zeros((len(indices), width), dtype=torch.long)
+        tokens = 0
+        for row, i in enumerate(indices):
+            n = self.lengths[i]
+            ids[row, :n] = torch.as_tensor(self.input_ids[i], dtype=torch.long)
+            mask[row, :n] = 1
+            tokens += n
+        labels = torch.as_tensor([self.labels[i] for i in indices], dtype=torch.long)
+        return {"input_ids": ids, "attention_mask": mask}, labels, tokens
+
+
+_tokenized: Dict[Tuple, TokenizedDataset] = {}
+_tokenized_lock = threading.Lock()
+
+
+def pretokenize(tokenizer, texts: Sequence[str], labels: Sequence[int], max_length: int = HF_MAX_LENGTH) -> TokenizedDataset:
+    """Token ids of ``texts`` (truncated, unpadded), cached per tokenizer and text list."""
+    key = (getattr(tokenizer, "name_or_path", id(tokenizer)), max_length, tuple(texts), tuple(int(y) for y in labels))
+    with _tokenized_lock:
+        cached = _tokenized.get(key)
+    if cached is not None:
+        return cached
+    enc = tokenizer(list(texts), truncation=True, max_length=max_length, padding=False)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    ds = TokenizedDataset([list(ids) for ids in enc["input_ids"]], [int(y) for y in labels], pad_id)
+    with _tokenized_lock:
+        _tokenized[key] = ds
+    return ds
+
+
+def clear_tokenized() -> None:
+    with _tokenized_lock:
+        _tokenized.clear()
+
+
+def length_batches(lengths: Sequence[int], batch_size: int, shuffle: bool = True, seed: Optional[int] = None) -> List[List[int]]:
+    """Batches of indices with similar lengths.
+
+    Indices are shuffled, split into pools of ``HF_BUCKET_BATCHES`` batches, sorted by
+    length within each pool and cut into batches; the batch order is shuffled again.
+    """
+    rng = random.Random(seed)
+    order = list(range(len(lengths)))
+    if shuffle:
+        rng.shuffle(order)
+    pool = max(1, HF_BUCKET_BATCHES) * batch_size
+    batches: List[List[int]] = []
+    for start in range(0, len(order), pool):
+        chunk = sorted(order[start:start + pool], key=lambda i: lengths[i])
+        batches += [chunk[j:j + batch_size] for j in range(0, len(chunk), batch_size)]
+    if shuffle:
+        rng.shuffle(batches)
+    return batches
+
+
+def train(
+    model: nn.Module,
+    ds: TokenizedDataset,
+    steps: int,
+    batch_size: int = HF_BATCH_SIZE,
+    grad_accum: int = HF_GRAD_ACCUM,
+    lr: float = HF_LR,
+    on_step: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Run ``steps`` optimizer steps (cycling over the data as needed). Returns training stats.
+
+    ``on_step`` gets the running stats after every optimizer step; an exception it
+    raises (e.g. a cancellation) aborts training.
+    """
+    batch_size, grad_accum = max(1, batch_size), max(1, grad_accum)
+    model.train()
+    optim = torch.optim.AdamW(model.parameters(), lr=lr)
+    optim.zero_grad(set_to_none=True)
+    samples = tokens = micro = steps_done = 0
+    loss_sum = 0.0
+    t0 = time.perf_counter()
+    while steps_done < steps and len(ds):
+        for indices in length_batches(ds.lengths, batch_size):
+            inputs, labels, n_tokens = ds.collate(indices)
+            out = model(**inputs, labels=labels)
+            (out.loss / grad_accum).backward()
+            loss_sum += float(out.loss.detach()) * len(indices)
+            samples += len(indices)
+            tokens += n_tokens
+            micro += 1
+            if micro % grad_accum:
+                continue
+            optim.step()
+            optim.zero_grad(set_to_none=True)
+            steps_done += 1
+            elapsed = max(time.perf_counter() - t0, 1e-9)
+            running = {"steps": steps_done, "samples": samples, "samples_per_s": round(samples / elapsed, 1), "tokens_per_s": round(tokens / elapsed, 1)}
+            if steps_done % 5 == 0 or steps_done == steps:
+                logger.info("hf.train.step", extra={"loss": float(out.loss.detach()), **running})
+            if on_step is not None:
+                on_step(running)
+            if steps_done >= steps:
+                break
+    seconds = time.perf_counter() - t0
+    return {
+        "steps": steps_done,
+        "samples": samples,
+        "tokens": tokens,
+        "loss": loss_sum / max(1, samples),
+        "seconds": round(seconds, 3),
+        "samples_per_s": round(samples / max(seconds, 1e-9), 1),
+        "tokens_per_s": round(tokens / max(seconds, 1e-9), 1),
+    }
+
+
+def holdout(tokenizer, dataset_id: Optional[str], hf_token: Optional[str]) -> TokenizedDataset:
+    """The cached, pre-tokenized evaluation split for ``dataset_id``."""
+    texts, labels = get_text_classification_holdout(dataset_id, hf_token, max_examples=HF_EVAL_EXAMPLES, train_examples=HF_TRAIN_EXAMPLES)
+    return pretokenize(tokenizer, texts, labels)
+
+
+def evaluate(model: nn.Module, ds: TokenizedDataset, batch_size: int = HF_EVAL_BATCH_SIZE) -> Dict[str, Any]:
+    """Accuracy (percent) and mean loss of ``model`` on ``ds``, with throughput."""
+    model.eval()
+    correct = samples = tokens = 0
+    loss_sum = 0.0
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        # Sorted by length, so each batch pads as little as possible
+        for indices in length_batches(ds.lengths, max(1, batch_size), shuffle=False):
+            inputs, labels, n_tokens = ds.collate(indices)
+            logits = model(**inputs).logits
+            loss_sum += float(nn.functional.cross_entropy(logits, labels, reduction="sum"))
+            correct += int((logits.argmax(dim=-1) == labels).sum())
+            samples += len(indices)
+            tokens += n_tokens
+    seconds = time.perf_counter() - t0
+    return {
+        "accuracy": 100.0 * correct / max(1, samples),
+        "loss": loss_sum / max(1, samples),
+        "samples": samples,
+        "seconds": round(seconds, 3),
+        "samples_per_s": round(samples / max(seconds, 1e-9), 1),
+        "tokens_per_s": round(tokens / max(seconds, 1e-9), 1),
+    }
@@ -0,0 +1,280 @@
+"""Orchestrator model download / update upload with binary tensor negotiation.
+
+Binary tensors (see tensor_codec) are preferred; JSON is used when WIRE_FORMAT=json
+or when the orchestrator does not understand the binary content type.
+
+The last downloaded model of each job is kept under MODEL_CACHE_DIR together with
+its ETag; downloads are conditional and a 304 answer is served from that file. When
+the model did change, the worker asks for a delta from the version it holds
+(``?since=``). Quantized deltas are approximate: the patched model is checked
+against the per-layer sums the delta carries, and the error bound of every applied
+delta is added up in the cache (``drift``). Once the drift would pass
+``MODEL_DELTA_TOLERANCE`` the worker downloads the full model instead.
+"""
+import hashlib
+import os
+import logging
+import mmap
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+
+from .tensor_codec import TENSOR_CONTENT_TYPE, decode_tensors, encode_tensors, is_tensor_payload, iter_encoded
+from .update_codec import commit_residual, encode_update, reset_residual
+
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "binary").lower()  # binary (default) or json
+UPLOAD_CHUNK_THRESHOLD = int(os.getenv("UPLOAD_CHUNK_THRESHOLD", str(32 * 1024 * 1024)))  # bytes; larger bodies use resumable uploads
+UPLOAD_CHUNK_RETRIES = int(os.getenv("UPLOAD_CHUNK_RETRIES", "5"))
+MODEL_DELTA_TOLERANCE = float(os.getenv("MODEL_DELTA_TOLERANCE", "1e-2"))  # max accumulated per-weight error of patched models
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.getenv("DATA_DIR", "/tmp/data"), "model_cache"))
+
+logger = logging.getLogger("quackmesh.transport")
+
+
+def _use_binary() -> bool:
+    return WIRE_FORMAT != "json"
+
+
+def _cache_path(job_id: int) -> str:
+    return os.path.join(MODEL_CACHE_DIR, f"job_{job_id}.qmt")
+
+
+def _load_cached(api_base: str, job_id: int) -> Optional[Tuple[List[np.ndarray], Dict[str, Any]]]:
+    """The cached model of a job and its info (including ``etag``), or None."""
+    try:
+        with open(_cache_path(job_id), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays, meta = decode_tensors(mm)
+    except (OSError, ValueError):
+        return None
+    if meta.get("api_base") != api_base or not meta.get("etag"):
+        return None
+    return [a.reshape(-1) for a in arrays], meta
+
+
+def _store_cached(api_base: str, job_id: int, arrays: List[np.ndarray], info: Dict[str, Any]) -> None:
+    if not info.get("etag"):
+        return
+    try:
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=MODEL_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter_encoded(arrays, metadata={**info, "api_base": api_base}):
+                    f.write(chunk)
+            # Atomic swap: a reader holding the previous file's mapping keeps valid pages
+            os.replace(tmp, _cache_path(job_id))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError as e:
+        logger.warning("model.cache.write.fail", extra={"job_id": job_id, "error": str(e)})
+
+
+def _apply_delta(base: List[np.ndarray], body: bytes, drift: float = 0.0) -> Tuple[List[np.ndarray], float]:
+    """Patch a copy of ``base`` with a per-layer delta; returns the model and its accumulated error bound.
+
+    Raises ValueError when the delta does not fit ``base`` or the patched layers do not
+    match the published sums within that bound.
+    """
+    arrays, meta = decode_tensors(body)
+    layers = meta.get("layers") or []
+    if [int(m.get("size", -1)) for m in layers] != [b.size for b in base]:
+        raise ValueError("Model delta does not match the cached model")
+    drift += float(meta.get("max_error") or 0.0)
+    if drift > MODEL_DELTA_TOLERANCE:
+        raise ValueError(f"accumulated delta error {drift:g} exceeds tolerance")
+    out = [np.array(b, dtype=np.float32) for b in base]
+    pos = 0
+    for layer, m in zip(out, layers):
+        mode = m.get("mode")
+        if mode == "replace":
+            idx, vals = arrays[pos], arrays[pos + 1]
+            layer[idx.astype(np.intp, copy=False)] = vals
+            pos += 2
+        elif mode == "q8":
+            d = arrays[pos].astype(np.float64) * float(m["scale"]) + float(m["zero"])
+            np.add(layer, d, out=layer, casting="same_kind")
+            pos += 1
+        elif mode == "dense":
+            layer[...] = arrays[pos].reshape(-1)
+            pos += 1
+        else:
+            raise ValueError(f"Unknown model delta mode {mode!r}")
+        # Each entry is off by at most ``drift``; allow float32 rounding on top
+        expected = float(m.get("sum", 0.0))
+        actual = float(layer.sum(dtype=np.float64))
+        if abs(actual - expected) > layer.size * drift + 1e-5 * (layer.size + abs(expected)):
+            raise ValueError("patched model does not match the published layer sums")
+    if pos != len(arrays):
+        raise ValueError("Model delta does not match the cached model")
+    return out, drift
+def fetch_model_info(
+    api_base: str, job_id: int, headers: Optional[Dict[str, str]] = None, timeout: float = 10, use_cache: bool = True
+) -> Tuple[List[np.ndarray], Dict[str, Any]]:
+    """Download the global model plus its version, digest and the job's update codec.
+
+    Unchanged models (304 Not Modified) are read back from the on-disk cache; changed
+    ones are fetched as a delta from the cached version when the orchestrator can.
+    """
+    hdrs = dict(headers or {})
+    params: Dict[str, Any] = {}
+    if _use_binary():
+        hdrs["Accept"] = f"{TENSOR_CONTENT_TYPE}, application/json;q=0.5"
+    cached = _load_cached(api_base, job_id) if use_cache else None
+    if cached is not None:
+        hdrs["If-None-Match"] = cached[1]["etag"]
+        if _use_binary() and cached[1].get("version") and float(cached[1].get("drift") or 0.0) < MODEL_DELTA_TOLERANCE:
+            params["since"] = int(cached[1]["version"])
+    resp = requests.get(f"{api_base}/job/{job_id}/model", headers=hdrs, params=params or None, timeout=timeout)
+    if resp.status_code == 304 and cached is not None:
+        logger.info("model.cache.hit", extra={"job_id": job_id, "version": cached[1].get("version")})
+        arrays, meta = cached
+        meta.pop("api_base", None)
+        return arrays, meta
+    resp.raise_for_status()
+    info: Dict[str, Any] = {
+        "version": int(resp.headers.get("X-Model-Version") or 0),
+        "digest": resp.headers.get("X-Model-Digest"),
+        "update_codec": resp.headers.get("X-Update-Codec") or "fp32",
+        "etag": resp.headers.get("ETag"),
+    }
+    if resp.headers.get("X-Model-Delta-From") and cached is not None:
+        try:
+            arrays, info["drift"] = _apply_delta(cached[0], resp.content, float(cached[1].get("drift") or 0.0))
+        except ValueError as e:
+            logger.warning("model.delta.fail", extra={"job_id": job_id, "error": str(e)})
+            return fetch_model_info(api_base, job_id, headers=headers, timeout=timeout, use_cache=False)
+        logger.info("model.delta.ok", extra={"job_id": job_id, "bytes": len(resp.content), "version": info["version"], "drift": info["drift"]})
+    elif is_tensor_payload(resp.headers.get("content-type")):
+        arrays, _ = decode_tensors(resp.content)
+        arrays = [a.reshape(-1) for a in arrays]
+    else:
+        data = resp.json()
+        info["digest"] = data.get("digest") or info["digest"]
+        info["update_codec"] = data.get("update_codec") or info["update_codec"]
+        arrays = [np.asarray(w, dtype=np.float32) for w in data.get("weights") or []]
+    _store_cached(api_base, job_id, arrays, info)
+    return arrays, info
+
+
+def fetch_model(api_base: str, job_id: int, headers: Optional[Dict[str, str]] = None, timeout: float = 10) -> List[np.ndarray]:
+    """Download the global model for a job as a list of flat float32 arrays (empty if none yet)."""
+    return fetch_model_info(api_base, job_id, headers=headers, timeout=timeout)[0]
+
+
+def _upload_chunked(
+    api_base: str, job_id: int, body: bytes, headers: Dict[str, str], timeout: float
+) -> Optional[requests.Response]:
+    """Send ``body`` through a resumable upload session and commit it.
+
+    Returns None if the orchestrator has no upload sessions (caller falls back to one POST).
+    Failed chunks are retried; after a reconnect the session's received ranges tell
+    which bytes still need to be sent.
+    """
+    base = f"{api_base}/job/{job_id}/uploads"
+    r = requests.post(base, json={"size": len(body), "sha256": hashlib.sha256(body).hexdigest()}, headers=headers, timeout=timeout)
+    if r.status_code in (404, 405):
+        return None
+    r.raise_for_status()
+    session = r.json()
+    url = f"{base}/{session['upload_id']}"
+    chunk_size = max(1, int(session.get("chunk_size") or 8 * 1024 * 1024))
+    view = memoryview(body)
+    failures = 0
+    received: List[List[int]] = []
+    while True:
+        missing = []
+        pos = 0
+        for start, end in sorted(received) + [[len(body), len(body)]]:
+            if pos < start:
+                missing.append((pos, start))
+            pos = max(pos, end)
+        if not missing:
+            break
+        try:
+            for start, end in missing:
+                for off in range(start, end, chunk_size):
+                    chunk = view[off : min(off + chunk_size, end)]
+                    hdrs = {
+                        **headers,
+                        "Content-Type": "application/octet-stream",
+                        "Content-Range": f"bytes {off}-{off + len(chunk) - 1}/{len(body)}",
+                        "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(),
+                    }
+                    cr = requests.put(url, data=chunk.tobytes(), headers=hdrs, timeout=timeout)
+                    cr.raise_for_status()
+                    received = cr.json().get("received") or received
+        except requests.RequestException as e:
+            failures += 1
+            if failures > UPLOAD_CHUNK_RETRIES:
+                raise
+            logger.warning("update.chunk.retry", extra={"job_id": job_id, "attempt": failures, "error": str(e)})
+            time.sleep(min(30.0, 2.0 ** failures))
+            try:
+                status = requests.get(url, headers=headers, timeout=timeout)
+                status.raise_for_status()
+                received = status.json().get("received") or []
+            except requests.RequestException:
+                pass
+    r = requests.post(f"{url}/commit", headers=headers, timeout=timeout)
+    return r
+
+
+def _send_binary(api_base: str, job_id: int, body: bytes, headers: Dict[str, str], timeout: float) -> requests.Response:
+    if len(body) > UPLOAD_CHUNK_THRESHOLD:
+        r = _upload_chunked(api_base, job_id, body, headers, timeout)
+        if r is not None:
+            return r
+    hdrs = {**headers, "Content-Type": TENSOR_CONTENT_TYPE}
+    return requests.post(f"{api_base}/job/{job_id}/update", data=body, headers=hdrs, timeout=timeout)
+
+
+def post_update(
+    api_base: str,
+    job_id: int,
+    weights: Sequence[np.ndarray],
+    val_accuracy: float,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+    codec: str = "fp32",
+    base: Optional[Sequence[np.ndarray]] = None,
+    base_digest: Optional[str] = None,
+    **fields: Any,
+) -> requests.Response:
+    """Submit a weight update. Extra keyword fields are sent alongside val_accuracy.
+
+    ``codec`` (fp32/fp16/int8/topk) applies to binary uploads; int8 and topk need the
+    downloaded ``base`` model and its ``base_digest``. JSON uploads are always fp32.
+    Binary bodies above UPLOAD_CHUNK_THRESHOLD go through a resumable upload session.
+    """
+    url = f"{api_base}/job/{job_id}/update"
+    meta: Dict[str, Any] = {"val_accuracy": float(val_accuracy), **fields}
+    if _use_binary():
+        arrays, codec_meta = encode_update(weights, codec, base=base, base_digest=base_digest, residual_key=job_id)
+        body = encode_tensors(arrays, metadata={**meta, **codec_meta})
+        r = _send_binary(api_base, job_id, body, dict(headers or {}), timeout)
+        if r.status_code == 409 and codec_meta.get("codec") in ("int8", "topk"):
+            # The base model was pruned server-side; a non-delta upload is always accepted
+            arrays, codec_meta = encode_update(weights, "fp16", residual_key=job_id)
+            body = encode_tensors(arrays, metadata={**meta, **codec_meta})
+            r = _send_binary(api_base, job_id, body, dict(headers or {}), timeout)
+        # Older orchestrators reject the binary body; retry once as JSON
+        if r.status_code not in (415, 422):
+            r.raise_for_status()
+            # Only now is what topk held back safe to forget
+            commit_residual(job_id)
+            return r
+        logger.warning("update.binary.rejected", extra={"job_id": job_id, "status": r.status_code})
+    r = requests.post(
+        url,
+        json={"weights": [np.asarray(w, dtype=np.float32).reshape(-1).tolist() for w in weights], **meta},
+        headers=headers,
+        timeout=timeout,
+    )
+    r.raise_for_status()
+    reset_residual(job_id)
+    return r
@@ -0,0 +1,179 @@
+"""Background task queue for long-running worker tasks (a training round).
+
+``POST /task/train`` only enqueues: the task gets an id right away and runs on a
+queue thread. ``GET /task/{id}`` reports its status and the progress the task
+publishes (step, samples/s, ...), ``POST /task/{id}/cancel`` stops it at its next
+progress report, and when it finishes the worker POSTs the final state to the
+task's callback URL on the orchestrator.
+
+The queue holds at most ``WORKER_TASK_QUEUE_SIZE`` waiting tasks. The worker runs
+one task per training slot (see train_pool), or ``WORKER_TASK_CONCURRENCY`` when
+training in-process.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+WORKER_TASK_QUEUE_SIZE = int(os.getenv("WORKER_TASK_QUEUE_SIZE", "8"))
+WORKER_TASK_CONCURRENCY = int(os.getenv("WORKER_TASK_CONCURRENCY", "1"))
+WORKER_TASK_HISTORY = int(os.getenv("WORKER_TASK_HISTORY", "200"))  # finished tasks kept for GET /task/{id}
+CALLBACK_RETRIES = int(os.getenv("WORKER_TASK_CALLBACK_RETRIES", "3"))
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+logger = logging.getLogger("quackmesh.tasks")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, kind: str, job_id: int, fn: Callable[["Task"], Any], callback_url: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.job_id = job_id
+        self.fn = fn
+        self.callback_url = callback_url
+        self.status = "queued"  # queued | running | succeeded | failed | cancelled
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def report(self, **fields: Any) -> None:
+        """Publish progress; raises TaskCancelled once cancellation was requested."""
+        self.progress.update(fields)
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "task_id": self.id,
+            "kind": self.kind,
+            "job_id": self.job_id,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class TaskQueue:
+    def __init__(
+        self,
+        headers: Optional[Callable[[], Optional[Dict[str, str]]]] = None,
+        maxsize: int = WORKER_TASK_QUEUE_SIZE,
+        workers: int = WORKER_TASK_CONCURRENCY,
+    ):
+        self._headers = headers or (lambda: None)
+        self._queue: "queue.Queue[Task]" = queue.Queue(maxsize=max(1, maxsize))
+        self._tasks: "OrderedDict[str, Task]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = max(1, workers)
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers):
+            th = threading.Thread(target=self._run, daemon=True, name=f"task-worker-{i}")
+            th.start()
+            self._threads.append(th)
+
+    def submit(self, kind: str, job_id: int, fn: Callable[[Task], Any], callback_url: Optional[str] = None) -> Task:
+        """Enqueue ``fn(task)``; raises QueueFull when the queue is at capacity."""
+        task = Task(kind, job_id, fn, callback_url)
+        with self._lock:
+            try:
+                self._queue.put_nowait(task)
+            except queue.Full:
+                raise QueueFull(f"{self._queue.maxsize} tasks already queued")
+            self._tasks[task.id] = task
+            self._trim()
+        logger.info("task.queued", extra={"task_id": task.id, "kind": kind, "job_id": job_id})
+        return task
+
+    def get(self, task_id: str) -> Optional[Task]:
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def list(self) -> List[Task]:
+        with self._lock:
+            return list(self._tasks.values())
+
+    def cancel(self, task_id: str) -> Optional[Task]:
+        """Cancel a queued task outright, or a running one at its next progress report."""
+        task = self.get(task_id)
+        if task is None or task.status in FINISHED:
+            return task
+        task._cancel.set()
+        logger.info("task.cancel", extra={"task_id": task_id, "status": task.status})
+        return task
+
+    def _trim(self) -> None:
+        finished = [t.id for t in self._tasks.values() if t.status in FINISHED]
+        for task_id in finished[: max(0, len(finished) - WORKER_TASK_HISTORY)]:
+            del self._tasks[task_id]
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task.cancel_requested:
+                task.status = "cancelled"
+                task.finished_at = time.time()
+                self._callback(task)
+                continue
+            task.status = "running"
+            task.started_at = time.time()
+            try:
+                task.result = task.fn(task)
+                task.status = "succeeded"
+            except TaskCancelled:
+                task.status = "cancelled"
+            except Exception as e:
+                logger.exception("task.fail", extra={"task_id": task.id, "job_id": task.job_id})
+                task.status = "failed"
+                task.error = getattr(e, "detail", None) or str(e)
+            task.finished_at = time.time()
+            logger.info(
+                "task.done",
+                extra={"task_id": task.id, "status": task.status, "seconds": round(task.finished_at - task.started_at, 3)},
+            )
+            self._callback(task)
+
+    def _callback(self, task: Task) -> None:
+        if not task.callback_url:
+            return
+        body = task.to_dict()
+        for attempt in range(max(1, CALLBACK_RETRIES)):
+            try:
+                r = requests.post(task.callback_url, json=body, headers=self._headers(), timeout=10)
+                if r.status_code < 500:
+                    if r.status_code >= 400:
+                        logger.warning("task.callback.rejected", extra={"task_id": task.id, "status": r.status_code})
+                    return
+            except requests.RequestException as e:
+                logger.warning("task.callback.fail", extra={"task_id": task.id, "error": str(e)})
+            time.sleep(2 ** attempt)
@@ -0,0 +1,254 @@
+"""Pool of long-lived training processes.
+
+Training runs in ``WORKER_TRAIN_PROCESSES`` spawned slots instead of the uvicorn
+process, so PyTorch never holds the GIL the API, ``/health``, ``/logs`` and the
+heartbeat thread need. A slot keeps its model and dataset caches across rounds and
+uses ``WORKER_TRAIN_THREADS`` torch threads (by default the cores split evenly), so
+several jobs can train side by side. ``WORKER_TRAIN_PROCESSES=0`` trains in-process.
+
+Weights cross the process boundary through shared memory owned by the API
+process: the global model is copied into one segment the slot reads from, and the
+slot writes its trained weights into a second segment, from which the API process
+submits them. The pipe to the slot only carries the job spec, progress and
+metrics, and a ``cancel`` request. Pushing an aggregated HF model to the Hub also
+runs in a slot (``spec["op"] = "push_hf"``), so HF models live only in the slots;
+after each op a slot reports its model cache, which ``cache_stats`` returns.
+"""
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .task_queue import Task, TaskCancelled
+
+WORKER_TRAIN_PROCESSES = int(os.getenv("WORKER_TRAIN_PROCESSES", "1"))
+WORKER_TRAIN_THREADS = int(os.getenv("WORKER_TRAIN_THREADS", "0"))
+
+logger = logging.getLogger("quackmesh.train_pool")
+
+
+def _pack(arrays: Sequence[np.ndarray]) -> Tuple[Optional[SharedMemory], List[int]]:
+    """Copy ``arrays`` back to back (float32) into a new segment."""
+    sizes = [int(np.size(a)) for a in arrays]
+    if not sizes:
+        return None, sizes
+    shm = SharedMemory(create=True, size=max(1, 4 * sum(sizes)))
+    for view, arr in zip(_unpack(shm, sizes), arrays):
+        view[...] = np.asarray(arr, dtype=np.float32).reshape(-1)
+    return shm, sizes
+
+
+def _unpack(shm: SharedMemory, sizes: Sequence[int]) -> List[np.ndarray]:
+    flat = np.ndarray((sum(sizes),), dtype=np.float32, buffer=shm.buf)
+    out: List[np.ndarray] = []
+    offset = 0
+    for n in sizes:
+        out.append(flat[offset:offset + n])
+        offset += n
+    return out
+
+
+def _release(shm: Optional[SharedMemory], unlink: bool = True) -> None:
+    if shm is None:
+        return
+    try:
+        shm.close()
+    except BufferError:
+        pass  # a view is still referenced; the mapping goes with the process
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _slot_main(conn: Connection, threads: int) -> None:
+    """Slot process: run the rounds sent over ``conn`` one after another until told to exit."""
+    import torch
+
+    from .hf_cache import model_cache
+    from .training_round import run_op  # imported up front, so the slot is warm
+
+    logging.basicConfig(level=getattr(logging, os.getenv("WORKER_LOG_LEVEL", "INFO").upper(), logging.INFO))
+    torch.set_num_threads(max(1, threads))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        if msg == "cancel":
+            continue  # sent after the last round had already finished
+        spec, in_name, in_sizes = msg
+        in_shm = SharedMemory(name=in_name) if in_name else None
+
+        def report(**fields: Any) -> None:
+            conn.send(("progress", fields))
+            while conn.poll():
+                if conn.recv() == "cancel":
+                    raise TaskCancelled()
+
+        def sink(weights: List[np.ndarray], metrics: Dict[str, Any]) -> None:
+            sizes = [int(w.size) for w in weights]
+            conn.send(("alloc", sizes))
+            reply = conn.recv()
+            while reply == "cancel":  # too late to cancel: the round is done
+                reply = conn.recv()
+            out_shm = SharedMemory(name=reply)
+            views = _unpack(out_shm, sizes)
+            for view, w in zip(views, weights):
+                view[...] = w
+            views = view = None
+            _release(out_shm, unlink=False)
+            conn.send(("weights", metrics))
+
+        try:
+            weights = _unpack(in_shm, in_sizes) if in_shm is not None else []
+            result: Tuple[str, Any] = ("done", run_op(spec, weights, report, sink))
+        except TaskCancelled:
+            result = ("cancelled", None)
+        except ValueError as e:
+            result = ("invalid", str(e))
+        except Exception as e:
+            logger.exception("train_pool.round.fail", extra={"job_id": spec.get("job_id")})
+            result = ("error", getattr(e, "detail", None) or str(e))
+        finally:
+            weights = None
+            _release(in_shm, unlink=False)
+        conn.send(("stats", model_cache.stats()))
+        conn.send(result)
+
+
+class _Slot:
+    def __init__(self, ctx, threads: int):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_slot_main, args=(child, threads), daemon=True, name="train-slot")
+        self.proc.start()
+        child.close()
+        self.stats: Dict[str, Any] = {}
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+
+
+class TrainPool:
+    def __init__(self, processes: int = WORKER_TRAIN_PROCESSES, threads: int = WORKER_TRAIN_THREADS):
+        self.processes = max(0, processes)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, self.processes))
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_Slot]" = queue.Queue()
+        self._slots: List[_Slot] = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started or not self.enabled:
+                return
+            self._started = True
+        for _ in range(self.processes):
+            self._idle.put(self._spawn())
+        logger.info("train_pool.start", extra={"processes": self.processes, "threads": self.threads})
+
+    def shutdown(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def _spawn(self, dead: Optional[_Slot] = None) -> _Slot:
+        slot = _Slot(self._ctx, self.threads)
+        with self._lock:
+            self._slots = [s for s in self._slots if s is not dead] + [slot]
+        return slot
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """HF model cache of every slot, as last reported (slots report after each op)."""
+        with self._lock:
+            slots = list(self._slots)
+        return {"slots": [dict(slot.stats, pid=slot.proc.pid) for slot in slots]}
+
+    def run(self, spec: Dict[str, Any], server_weights: Sequence[np.ndarray], task: Task, sink) -> Dict[str, Any]:
+        """Run ``run_op(spec, ...)`` on a free slot; ``sink`` is called here with the trained weights.
+
+        Raises ValueError when the op rejected its input, RuntimeError when it failed.
+        """
+        self.start()
+        slot = self._idle.get()
+        in_shm: Optional[SharedMemory] = None
+        try:
+            if not slot.proc.is_alive():
+                slot = self._spawn(slot)
+            in_shm, in_sizes = _pack(server_weights)
+            slot.conn.send((spec, in_shm.name if in_shm else None, in_sizes))
+            return self._follow(slot, task, sink)
+        finally:
+            _release(in_shm)
+            if not slot.proc.is_alive():
+                slot = self._spawn(slot)
+            self._idle.put(slot)
+
+    def _follow(self, slot: _Slot, task: Task, sink) -> Dict[str, Any]:
+        """Relay the slot's messages until the round ends; returns its metrics."""
+        out_shm: Optional[SharedMemory] = None
+        out_sizes: List[int] = []
+        sink_error: Optional[BaseException] = None
+        # The slot only reads cancels until it has sent its weights or stats
+        cancellable = True
+        try:
+            while True:
+                if task.cancel_requested and cancellable:
+                    slot.conn.send("cancel")
+                    cancellable = False
+                if not slot.conn.poll(1.0):
+                    if not slot.proc.is_alive():
+                        raise RuntimeError(f"training process exited with code {slot.proc.exitcode}")
+                    continue
+                kind, payload = slot.conn.recv()
+                if kind == "progress":
+                    task.progress.update(payload)
+                elif kind == "stats":
+                    cancellable = False
+                    slot.stats = payload
+                elif kind == "alloc":
+                    out_sizes = list(payload)
+                    out_shm = SharedMemory(create=True, size=max(1, 4 * sum(out_sizes)))
+                    slot.conn.send(out_shm.name)
+                elif kind == "weights":
+                    cancellable = False
+                    views = _unpack(out_shm, out_sizes)
+                    try:
+                        sink(views, payload)
+                    except Exception as e:
+                        sink_error = e
+                    del views
+                elif kind == "done":
+                    if sink_error is not None:
+                        raise sink_error
+                    return payload
+                elif kind == "cancelled":
+                    raise TaskCancelled()
+                elif kind == "invalid":
+                    raise ValueError(payload)
+                else:
+                    raise RuntimeError(payload)
+        except (EOFError, OSError) as e:
+            slot.proc.kill()
+            raise RuntimeError(f"training process failed: {e}")
+        finally:
+            _release(out_shm)
@@ -0,0 +1,188 @@
+"""The compute half of a training round: load the global weights, train, evaluate.
+
+``train_round`` runs either in the API process or in a train_pool slot. The HTTP
+half of the round (downloading the global model, submitting the update) stays in
+worker_server, so a slot needs no orchestrator credentials beyond the HF token.
+``push_to_hub`` (publishing the aggregated model) runs the same way, so Hugging
+Face models are only ever loaded where training happens.
+"""
+import logging
+import os
+import time
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+import torch
+from torch import nn
+
+from . import hf_training
+from .data_pipeline import BatchLoader, get_fake_mnist_loaders, get_mnist_loaders, get_text_classification_data
+from .hf_cache import model_cache
+from .weight_codec import load_weights_into_model, serialize_weights
+
+DATASET = os.getenv("DATASET", "FAKE").upper()  # FAKE (default) or MNIST
+
+logger = logging.getLogger("quackmesh.worker")
+
+# report(**progress) publishes progress and raises to cancel; sink(weights, metrics) receives
+# the trained weights, as views that are only valid during the call
+Report = Callable[..., None]
+Sink = Callable[[List[np.ndarray], Dict[str, Any]], None]
+
+
+def build_model() -> nn.Module:
+    # Simple MNIST MLP: 28*28 -> 128 -> 10
+    return nn.Sequential(
+        nn.Flatten(),
+        nn.Linear(28 * 28, 128),
+        nn.ReLU(),
+        nn.Linear(128, 10),
+    )
+
+
+def get_data_loaders(batch_size: int = 128) -> tuple[BatchLoader, BatchLoader]:
+    if DATASET == "MNIST":
+        return get_mnist_loaders(batch_size=batch_size)
+    else:
+        return get_fake_mnist_loaders(batch_size=batch_size)
+
+
+def run_op(spec: Dict[str, Any], server_weights: Sequence[np.ndarray], report: Report, sink: Sink) -> Dict[str, Any]:
+    """Entry point of a train_pool slot: ``spec["op"]`` is ``train`` (default) or ``push_hf``."""
+    if spec.get("op") == "push_hf":
+        return push_to_hub(spec, server_weights, report, sink)
+    return train_round(spec, server_weights, report, sink)
+
+
+def push_to_hub(spec: Dict[str, Any], server_weights: Sequence[np.ndarray], report: Report, sink: Sink) -> Dict[str, Any]:
+    """Load the aggregated ``server_weights`` into the job's HF model and push it to the Hub.
+
+    Raises ValueError if the weights do not fit the model.
+    """
+    hf = spec["hf"]
+    model_id, hf_token = hf["model_id"], hf["hf_token"]
+    with model_cache.lease(model_id, hf_token) as entry:
+        model_hf = entry.model
+        if not load_weights_into_model(model_hf, server_weights):
+            raise ValueError("Aggregated weights shape mismatch for HF model")
+        report(phase="push")
+        logger.info("push_hf.hub.push.begin", extra={"model": model_id, "private": hf.get("private", True)})
+        with TemporaryDirectory() as tmpd:
+            model_hf.save_pretrained(tmpd)
+            # Push via model API
+            model_hf.push_to_hub(model_id, use_auth_token=hf_token, private=hf.get("private", True), commit_message="quackmesh aggregated push")
+    logger.info("push_hf.hub.push.ok", extra={"model": model_id})
+    return {"pushed": True, "hf_model": model_id}
+
+
+def train_round(spec: Dict[str, Any], server_weights: Sequence[np.ndarray], report: Report, sink: Sink) -> Dict[str, Any]:
+    """Train ``spec["steps"]`` steps from ``server_weights`` and hand the result to ``sink``.
+
+    ``spec["hf"]`` (model_id, hf_token, dataset_id) selects the Hugging Face path;
+    without it the MNIST MLP is trained. Returns the round's metrics.
+    """
+    if spec.get("hf"):
+        return _train_hf(spec, server_weights, report, sink)
+    return _train_mnist(spec, server_weights, report, sink)
+
+
+def _train_hf(spec: Dict[str, Any], server_weights: Sequence[np.ndarray], report: Report, sink: Sink) -> Dict[str, Any]:
+    hf = spec["hf"]
+    model_id, hf_token, dataset_id = hf["model_id"], hf["hf_token"], hf.get("dataset_id")
+    with model_cache.lease(model_id, hf_token) as entry:
+        tokenizer, model_hf = entry.tokenizer, entry.model
+        loaded = bool(server_weights) and load_weights_into_model(model_hf, server_weights)
+        if not loaded:
+            entry.restore()
+        # Dataset split if provided (cached across rounds); else dummy texts
+        texts, labels = get_text_classification_data(dataset_id, hf_token, max_examples=hf_training.HF_TRAIN_EXAMPLES)
+        logger.info("hf.dataset.ok", extra={"dataset": dataset_id, "n_texts": len(texts)})
+        ds = hf_training.pretokenize(tokenizer, texts, labels)
+        stats = hf_training.train(model_hf, ds, steps=max(1, int(spec["steps"])), on_step=lambda st: report(phase="train", **st))
+        logger.info("hf.train.done", extra=stats)
+
+        # Validation on the held-out split
+        report(phase="eval")
+        eval_stats = hf_training.evaluate(model_hf, hf_training.holdout(tokenizer, dataset_id, hf_token))
+        logger.info("hf.eval.done", extra=eval_stats)
+
+        metrics = {
+            "val_accuracy": float(eval_stats["accuracy"]),
+            "num_examples": stats["samples"],
+            "loaded": loaded,
+            "hf_model": model_id,
+            "train": stats,
+            "eval": eval_stats,
+        }
+        # Views of the cached model: hand them over before the lease is released
+        report(phase="submit")
+        sink(serialize_weights(model_hf), metrics)
+    return metrics
+
+
+def _train_mnist(spec: Dict[str, Any], server_weights: Sequence[np.ndarray], report: Report, sink: Sink) -> Dict[str, Any]:
+    device = torch.device("cpu")
+    model = build_model().to(device)
+
+    # Start from the global weights; if shapes mismatch, start fresh
+    loaded = False
+    if server_weights:
+        try:
+            loaded = load_weights_into_model(model, server_weights)
+        except Exception:
+            loaded = False
+        # Otherwise proceed with the randomly initialized model
+
+    logger.info("mnist.data.load.begin", extra={"dataset": DATASET})
+    train_loader, test_loader = get_data_loaders()
+    logger.info("mnist.data.load.ok", extra={"dataset": DATASET})
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
+    criterion = nn.CrossEntropyLoss()
+
+    # Train for `steps` mini-batches to keep runtime bounded
+    steps = max(1, int(spec["steps"]))
+    batches_trained = 0
+    samples_trained = 0
+    logger.info("mnist.train.begin", extra={"steps": steps})
+    t0 = time.perf_counter()
+    for x, y in train_loader:
+        x, y = x.to(device), y.to(device)
+        optimizer.zero_grad(set_to_none=True)
+        logits = model(x)
+        loss = criterion(logits, y)
+        loss.backward()
+        optimizer.step()
+        batches_trained += 1
+        samples_trained += int(y.size(0))
+        if batches_trained % 10 == 0 or batches_trained == steps:
+            logger.info("mnist.train.step", extra={"step": batches_trained, "loss": float(loss.item())})
+        report(
+            phase="train",
+            steps=batches_trained,
+            samples=samples_trained,
+            samples_per_s=round(samples_trained / max(time.perf_counter() - t0, 1e-9), 1),
+        )
+        if batches_trained >= steps:
+            break
+
+    # Quick validation on a limited subset for speed
+    report(phase="eval")
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for i, (x, y) in enumerate(test_loader):
+            x, y = x.to(device), y.to(device)
+            logits = model(x)
+            pred = logits.argmax(dim=1)
+            correct += (pred == y).sum().item()
+            total += y.size(0)
+            if total >= 2000:  # limit to ~2k samples for speed
+                break
+    metrics = {"val_accuracy": float(100.0 * correct / max(1, total)), "num_examples": samples_trained, "loaded": loaded}
+
+    report(phase="submit")
+    sink(serialize_weights(model), metrics)
+    return metrics
@@ -0,0 +1,132 @@
+"""Encode weight updates in the job's update codec before upload.
+
+``fp32``  float32 weights
+``fp16``  float16 weights
+``int8``  per-layer affine int8 delta against the downloaded global model,
+          ``w ~= base + q * scale + zero``; needs the base and its digest
+``topk``  only the TOPK_RATIO largest-magnitude entries of the delta against the
+          downloaded model, as per-layer (index, value) pairs; what is not sent is
+          kept as a residual and added to the next round's delta (error feedback)
+
+A new residual is only staged by ``encode_update``; the caller commits it with
+``commit_residual`` once the upload went through, so a failed upload keeps the
+previous residual (and with it nothing is lost).
+"""
+import logging
+import math
+import os
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+UPDATE_CODECS = ("fp32", "fp16", "int8", "topk")
+TOPK_RATIO = float(os.getenv("TOPK_RATIO", "0.01"))  # fraction of each layer's entries sent by topk
+
+logger = logging.getLogger("quackmesh.update_codec")
+
+# Error-feedback residuals of topk uploads, per job; None staged means "clear"
+_residuals: Dict[Hashable, List[np.ndarray]] = {}
+_pending: Dict[Hashable, Optional[List[np.ndarray]]] = {}
+
+
+def quantize_int8(delta: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """Affine-quantize one flat layer to int8 codes in [-127, 127]. Returns (codes, scale, zero)."""
+    if delta.size == 0:
+        return np.zeros(0, dtype=np.int8), 1.0, 0.0
+    lo, hi = float(delta.min()), float(delta.max())
+    zero = (hi + lo) / 2.0
+    scale = (hi - lo) / 254.0 or 1.0
+    codes = np.rint((delta - zero) / scale)
+    np.clip(codes, -127, 127, out=codes)
+    return codes.astype(np.int8), scale, zero
+
+
+def sparsify_topk(delta: np.ndarray, ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices (sorted) and values of the ``ratio`` largest-magnitude entries of one flat layer."""
+    n = delta.size
+    k = min(n, max(1, math.ceil(ratio * n))) if n else 0
+    if k == n:
+        idx = np.arange(n)
+    else:
+        idx = np.sort(np.argpartition(np.abs(delta), n - k)[n - k :])
+    return idx.astype(np.uint32 if n <= np.iinfo(np.uint32).max else np.int64), delta[idx]
+
+
+def reset_residual(key: Hashable) -> None:
+    _residuals.pop(key, None)
+    _pending.pop(key, None)
+
+
+def commit_residual(key: Hashable) -> None:
+    """Make the residual staged by the last ``encode_update`` under ``key`` current."""
+    if key not in _pending:
+        return
+    residual = _pending.pop(key)
+    if residual is None:
+        _residuals.pop(key, None)
+    else:
+        _residuals[key] = residual
+
+
+def encode_update(
+    layers: Sequence[np.ndarray],
+    codec: str = "fp32",
+    base: Optional[Sequence[np.ndarray]] = None,
+    base_digest: Optional[str] = None,
+    implicit_base: bool = False,
+    residual_key: Optional[Hashable] = None,
+) -> Tuple[List[np.ndarray], Dict[str, Any]]:
+    """Return (arrays, metadata) ready for ``encode_tensors``.
+
+    Delta codecs (int8, topk) fall back to fp16 when the base model is unknown or does
+    not match the layers. ``implicit_base`` skips the digest for transports where the
+    receiver already knows the base (the parameters of a Flower round). topk stages its
+    residual under ``residual_key`` (the job id); any dense upload stages clearing it.
+    Call ``commit_residual`` once the update was delivered.
+    """
+    codec = (codec or "fp32").lower()
+    flat = [np.asarray(w, dtype=np.float32).reshape(-1) for w in layers]
+    if codec in ("int8", "topk"):
+        usable = (base_digest or implicit_base) and base is not None and len(base) == len(flat) and all(
+            np.size(b) == w.size for b, w in zip(base, flat)
+        )
+        if not usable:
+            logger.info("update.delta.no_base", extra={"codec": codec, "fallback": "fp16"})
+            codec = "fp16"
+        elif codec == "topk":
+            residual = _residuals.get(residual_key) if residual_key is not None else None
+            if residual is not None and [r.size for r in residual] != [w.size for w in flat]:
+                residual = None
+            arrays: List[np.ndarray] = []
+            new_residual: List[np.ndarray] = []
+            for i, (w, b) in enumerate(zip(flat, base)):
+                delta = w - np.asarray(b, dtype=np.float32).reshape(-1)
+                if residual is not None:
+                    delta += residual[i]
+                idx, vals = sparsify_topk(delta, TOPK_RATIO)
+                arrays += [idx, vals]
+                delta[idx] = 0.0
+                new_residual.append(delta)
+            if residual_key is not None:
+                _pending[residual_key] = new_residual
+            meta = {"codec": "topk", "shapes": [[w.size] for w in flat]}
+            if base_digest:
+                meta["base_digest"] = base_digest
+            return arrays, meta
+        else:
+            codes: List[np.ndarray] = []
+            scales = np.empty(len(flat), dtype=np.float32)
+            zeros = np.empty(len(flat), dtype=np.float32)
+            for i, (w, b) in enumerate(zip(flat, base)):
+                q, scales[i], zeros[i] = quantize_int8(w - np.asarray(b, dtype=np.float32).reshape(-1))
+                codes.append(q)
+            meta: Dict[str, Any] = {"codec": "int8"}
+            if base_digest:
+                meta["base_digest"] = base_digest
+            return codes + [scales, zeros], meta
+    if residual_key is not None:
+        # Full weights carry everything the residual was holding back
+        _pending[residual_key] = None
+    if codec == "fp16":
+        return [w.astype(np.float16) for w in flat], {"codec": "fp16"}
+    return flat, {"codec": "fp32"}
@@ -0,0 +1,61 @@
+"""Model weights <-> flat float32 arrays without intermediate copies.
+
+``serialize_weights`` returns numpy views of the model's float32 CPU tensors (only
+tensors of other dtypes or devices are converted), and ``load_weights_into_model``
+copies each array straight into its parameter through a ``torch.from_numpy`` view.
+Together with the view-based wire encoding in tensor_codec, a submit holds roughly
+one extra copy of the model: the encoded request body.
+
+Views alias the live model: finish with them (submit, hand to Flower) before the
+model trains again, or pass ``copy=True``.
+"""
+import warnings
+from typing import List, Sequence
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def serialize_weights(model: nn.Module, copy: bool = False) -> List[np.ndarray]:
+    """One flat float32 array per state_dict tensor."""
+    weights: List[np.ndarray] = []
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            t = tensor.detach()
+            if t.dtype != torch.float32 or t.device.type != "cpu" or not t.is_contiguous():
+                t = t.to(device="cpu", dtype=torch.float32).contiguous()
+            elif copy:
+                t = t.clone()
+            weights.append(t.view(-1).numpy())
+    return weights
+
+
+def _as_tensor(flat: np.ndarray) -> torch.Tensor:
+    arr = np.asarray(flat)
+    if not arr.flags.c_contiguous:
+        arr = np.ascontiguousarray(arr)
+    if arr.flags.writeable:
+        return torch.from_numpy(arr)
+    # Read-only buffers (decoded bodies, the mmapped model cache) are only read from
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(arr)
+
+
+def load_weights_into_model(model: nn.Module, weights: Sequence[np.ndarray]) -> bool:
+    """Copy flat ``weights`` into the model's tensors in place.
+
+    Returns False, leaving the model untouched, if the layer count or sizes differ.
+    """
+    state = model.state_dict()
+    if len(weights) != len(state):
+        return False
+    sources = [_as_tensor(flat) for flat in weights]
+    if any(src.numel() != tensor.numel() for src, tensor in zip(sources, state.values())):
+        return False
+    with torch.no_grad():
+        for src, tensor in zip(sources, state.values()):
+            # copy_ converts dtype/device on the fly; state_dict tensors share storage with the model
+            tensor.copy_(src.view(tensor.shape))
+    return True
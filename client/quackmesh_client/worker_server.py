@@ -12,25 +12,29 @@ import threading
 import multiprocessing as mp
 import time
 import anyio
+from contextlib import contextmanager
 import torch
 from torch import nn
-from torch.utils.data import DataLoader
-import torchvision
-from torchvision import transforms
 import base64
+import json
 from cryptography.fernet import Fernet
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from tempfile import TemporaryDirectory
-from datasets import load_dataset
 import flwr as fl
 
-from .data_pipeline import get_mnist_loaders, get_fake_mnist_loaders, get_text_classification_data
+from .data_pipeline import get_text_classification_data
+from .data_pipeline import invalidate as invalidate_data
+from .hf_cache import model_cache
+from . import hf_training
+from .model_transport import fetch_model, fetch_model_info, post_update
+from .task_queue import WORKER_TASK_CONCURRENCY, QueueFull, Task, TaskCancelled, TaskQueue
+from .train_pool import TrainPool
+from .training_round import build_model, get_data_loaders, push_to_hub, train_round
+from .update_codec import commit_residual, encode_update
+from .weight_codec import load_weights_into_model, serialize_weights
 
 API_BASE = os.getenv("ORCHESTRATOR_API", "https://8000-01k42mwc8wv62x7je6az5zqksp.cloudspaces.litng.ai/api")
 API_KEY = os.getenv("API_KEY")
 CONTROL_KEY = os.getenv("WORKER_CONTROL_KEY")
 DATA_DIR = os.getenv("DATA_DIR", "/tmp/data")
-DATASET = os.getenv("DATASET", "FAKE").upper()  # FAKE (default) or MNIST
 HF_TOKEN_DEC_KEY = os.getenv("HF_TOKEN_DEC_KEY") or os.getenv("HF_TOKEN_ENC_KEY")
 
 # Logging
@@ -61,51 +65,6 @@ def api_headers():
     return {"X-API-Key": API_KEY} if API_KEY else None
 
 
-def build_model() -> nn.Module:
-    # Simple MNIST MLP: 28*28 -> 128 -> 10
-    return nn.Sequential(
-        nn.Flatten(),
-        nn.Linear(28 * 28, 128),
-        nn.ReLU(),
-        nn.Linear(128, 10),
-    )
-
-
-def serialize_weights(model: nn.Module) -> List[List[float]]:
-    """Flatten each parameter tensor to a 1D float list."""
-    weights: List[List[float]] = []
-    with torch.no_grad():
-        for _, tensor in model.state_dict().items():
-            arr = tensor.detach().cpu().contiguous().view(-1).numpy().astype(np.float32)
-            weights.append(arr.tolist())
-    return weights
-
-
-def load_weights_into_model(model: nn.Module, weights: List[List[float]]) -> bool:
-    """Load flattened weights into model by reshaping to each param's shape.
-    Returns True if successfully loaded (shapes match), else False.
-    """
-    state = model.state_dict()
-    if len(weights) != len(state):
-        return False
-    new_state = {}
-    with torch.no_grad():
-        for (name, tensor), flat in zip(state.items(), weights):
-            t = torch.tensor(flat, dtype=tensor.dtype)
-            if t.numel() != tensor.numel():
-                return False
-            new_state[name] = t.view_as(tensor)
-    model.load_state_dict(new_state)
-    return True
-
-
-def get_data_loaders(batch_size: int = 128) -> tuple[DataLoader, DataLoader]:
-    if DATASET == "MNIST":
-        return get_mnist_loaders(batch_size=batch_size)
-    else:
-        return get_fake_mnist_loaders(batch_size=batch_size)
-
-
 def _collect_metrics() -> dict:
     try:
         cpu = float(psutil.cpu_percent(interval=0.1))
@@ -128,6 +87,8 @@ def _collect_metrics() -> dict:
 class TrainTask(BaseModel):
     job_id: int
     steps: int = 1
+    # Where to POST the finished task; defaults to the orchestrator's task report endpoint
+    callback_url: Optional[str] = None
 
 
 def create_app() -> FastAPI:
@@ -163,6 +124,8 @@ def create_app() -> FastAPI:
                 "disk_percent": (disk.used / disk.total) * 100,
             },
             "capabilities": ["training", "inference"],
+            # With the pool, HF models are cached in the training slots, not in this process
+            "hf_model_cache": train_pool.cache_stats() if train_pool.enabled else model_cache.stats(),
             "status": "online",
             "last_updated": time.time(),
         }
@@ -176,11 +139,17 @@ def create_app() -> FastAPI:
             "node_id": os.getenv("NODE_ID", "unknown"),
         }
 
-    @app.post("/task/train")
-    def task_train(task: TrainTask):
+    # Rounds train in pool slots (one queue thread per slot), off the API process's GIL
+    train_pool = TrainPool()
+    train_pool.start()
+    tasks = TaskQueue(headers=api_headers, workers=train_pool.processes or WORKER_TASK_CONCURRENCY)
+    tasks.start()
+
+    def _run_train(task: TrainTask, progress: Task):
+        """One training round: download, train, evaluate, submit. Runs on the task queue."""
         try:
-            logger.info("train.start", extra={"job_id": task.job_id, "steps": task.steps})
-            device = torch.device("cpu")
+            logger.info("train.start", extra={"job_id": task.job_id, "steps": task.steps, "task_id": progress.id})
+            progress.report(phase="prepare")
 
             # Try Hugging Face path first
             hf_meta = None
@@ -193,6 +162,7 @@ def create_app() -> FastAPI:
             except Exception:
                 hf_meta = None
 
+            spec = {"job_id": task.job_id, "steps": task.steps, "hf": None}
             if hf_meta and hf_meta.get("huggingface_model_id") and hf_meta.get("token_enc_b64"):
                 # HF fine-tune minimal and push
                 if not HF_TOKEN_DEC_KEY:
@@ -209,156 +179,84 @@ def create_app() -> FastAPI:
                     logger.info("hf.token.decrypt.ok")
                 except Exception:
                     raise HTTPException(status_code=500, detail="Failed to decrypt HF token")
+                spec["hf"] = {
+                    "model_id": hf_meta["huggingface_model_id"],
+                    "hf_token": hf_token,
+                    "dataset_id": hf_meta.get("huggingface_dataset_id"),
+                }
 
-                model_id = hf_meta["huggingface_model_id"]
-                hf_private = bool(hf_meta.get("hf_private", True))
-                dataset_id = hf_meta.get("huggingface_dataset_id")
-
-                # Tiny fine-tune on small subset (dataset if provided; else dummy texts)
-                logger.info("hf.model.load.begin", extra={"model": model_id})
-                tokenizer = AutoTokenizer.from_pretrained(model_id, use_auth_token=hf_token)
-                model_hf = AutoModelForSequenceClassification.from_pretrained(model_id, use_auth_token=hf_token)
-                logger.info("hf.model.load.ok", extra={"model": model_id})
-                model_hf.train()
-                optim = torch.optim.AdamW(model_hf.parameters(), lr=5e-5)
-                texts = ["hello world", "quack mesh", "duck ai", "federated learning"]
-                labels = torch.tensor([0, 1, 0, 1])
-
-                # If dataset provided, try to load a tiny split
-                if dataset_id:
-                    try:
-                        logger.info("hf.dataset.load.begin", extra={"dataset": dataset_id})
-                        ds_train = load_dataset(dataset_id, split="train[:1%]", use_auth_token=hf_token)
-                        # Heuristics to find text/label columns
-                        text_cols = [c for c in ds_train.column_names if c.lower() in ("text", "sentence", "review", "content", "document")]
-                        label_cols = [c for c in ds_train.column_names if c.lower() in ("label", "labels", "target", "class")]
-                        tcol = text_cols[0] if text_cols else None
-                        lcol = label_cols[0] if label_cols else None
-                        if tcol and lcol:
-                            # Build a small list to keep runtime bounded
-                            texts = [ex[tcol] for ex in ds_train.select(range(min(64, len(ds_train))))]
-                            raw_labels = [ex[lcol] for ex in ds_train.select(range(min(64, len(ds_train))))]
-                            # Normalize labels to ints
-                            if isinstance(raw_labels[0], (list, tuple)):
-                                raw_labels = [int(x[0]) for x in raw_labels]
-                            labels = torch.tensor([int(x) for x in raw_labels])
-                        logger.info("hf.dataset.load.ok", extra={"dataset": dataset_id, "n_texts": len(texts)})
-                    except Exception as e:
-                        # Keep default dummy texts if dataset loading fails
-                        logger.warning("hf.dataset.load.fail", extra={"dataset": dataset_id, "error": str(e)})
-                steps = max(1, int(task.steps))
-                steps_done = 0
-                for t, y in zip(texts, labels):
-                    enc = tokenizer(t, return_tensors="pt", padding=True, truncation=True, max_length=32)
-                    optim.zero_grad(set_to_none=True)
-                    out = model_hf(**enc, labels=torch.tensor([int(y.item())]))
-                    loss = out.loss
-                    loss.backward()
-                    optim.step()
-                    steps_done += 1
-                    if steps_done % 5 == 0 or steps_done == steps:
-                        logger.info("hf.train.step", extra={"step": steps_done, "loss": float(loss.item())})
-                    if steps_done >= steps:
-                        break
-
-                # For validation proxy, just compute a dummy accuracy on same texts
-                model_hf.eval()
-                with torch.no_grad():
-                    preds = []
-                    for t in texts:
-                        enc = tokenizer(t, return_tensors="pt", padding=True, truncation=True, max_length=32)
-                        logits = model_hf(**enc).logits
-                        preds.append(int(logits.argmax(dim=-1).item()))
-                val_acc = float(100.0 * sum(p in (0, 1) for p in preds) / len(preds))
-
-                # Submit HF model weights to orchestrator for FedAvg
-                out_weights = serialize_weights(model_hf)
-                logger.info("hf.update.submit.begin", extra={"job_id": task.job_id})
-                r = requests.post(
-                    f"{API_BASE}/job/{task.job_id}/update",
-                    json={"weights": out_weights, "val_accuracy": val_acc},
+                # Global weights of the job, if a round was aggregated already
+                try:
+                    server_weights, model_info = fetch_model_info(API_BASE, task.job_id, headers=api_headers(), timeout=30)
+                except Exception:
+                    server_weights, model_info = [], {"update_codec": "fp32", "digest": None, "version": None}
+                codec = hf_meta.get("update_codec") or model_info["update_codec"]
+            else:
+                # Default FedAvg MNIST path; if the global weights' shapes mismatch, train starts fresh
+                server_weights, model_info = fetch_model_info(API_BASE, task.job_id, timeout=10)
+                codec = model_info["update_codec"]
+            kind = "hf" if spec["hf"] else "mnist"
+
+            def submit(out_weights: List[np.ndarray], metrics: dict):
+                loaded = metrics["loaded"]
+                logger.info(f"{kind}.update.submit.begin", extra={"job_id": task.job_id})
+                r = post_update(
+                    API_BASE,
+                    task.job_id,
+                    out_weights,
+                    metrics["val_accuracy"],
                     headers=api_headers(),
                     timeout=30,
+                    codec=codec,
+                    base=server_weights if loaded else None,
+                    base_digest=model_info["digest"] if loaded else None,
+                    base_version=model_info["version"] if loaded else None,
+                    num_examples=metrics["num_examples"],
                 )
-                r.raise_for_status()
-                logger.info("hf.update.submit.ok", extra={"status": r.status_code, "val_accuracy": val_acc})
-                # Clear token from memory (best-effort)
-                del hf_token
-                return {"submitted": True, "val_accuracy": val_acc, "hf_model": model_id}
-
-            # Default FedAvg MNIST path
-            # Model and data
-            model = build_model().to(device)
-
-            # Fetch current global weights; if shapes mismatch, start fresh
-            resp = requests.get(f"{API_BASE}/job/{task.job_id}/model", timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            server_weights = data.get("weights") or []
-            if server_weights:
-                try:
-                    loaded = load_weights_into_model(model, server_weights)
-                except Exception:
-                    loaded = False
-                if not loaded:
-                    # Proceed with randomly initialized model
-                    pass
-
-            logger.info("mnist.data.load.begin", extra={"dataset": DATASET})
-            train_loader, test_loader = get_data_loaders()
-            logger.info("mnist.data.load.ok", extra={"dataset": DATASET})
-            model.train()
-            optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
-            criterion = nn.CrossEntropyLoss()
-
-            # Train for `steps` mini-batches to keep runtime bounded
-            steps = max(1, int(task.steps))
-            batches_trained = 0
-            logger.info("mnist.train.begin", extra={"steps": steps})
-            for x, y in train_loader:
-                x, y = x.to(device), y.to(device)
-                optimizer.zero_grad(set_to_none=True)
-                logits = model(x)
-                loss = criterion(logits, y)
-                loss.backward()
-                optimizer.step()
-                batches_trained += 1
-                if batches_trained % 10 == 0 or batches_trained == steps:
-                    logger.info("mnist.train.step", extra={"step": batches_trained, "loss": float(loss.item())})
-                if batches_trained >= steps:
-                    break
-
-            # Quick validation on a limited subset for speed
-            model.eval()
-            correct = 0
-            total = 0
-            with torch.no_grad():
-                for i, (x, y) in enumerate(test_loader):
-                    x, y = x.to(device), y.to(device)
-                    logits = model(x)
-                    pred = logits.argmax(dim=1)
-                    correct += (pred == y).sum().item()
-                    total += y.size(0)
-                    if total >= 2000:  # limit to ~2k samples for speed
-                        break
-            val_acc = float(100.0 * correct / max(1, total))
-
-            # Serialize and submit update
-            out_weights = serialize_weights(model)
-            logger.info("mnist.update.submit.begin", extra={"job_id": task.job_id})
-            r = requests.post(
-                f"{API_BASE}/job/{task.job_id}/update",
-                json={"weights": out_weights, "val_accuracy": val_acc},
-                headers=api_headers(),
-                timeout=30,
-            )
-            r.raise_for_status()
-            logger.info("mnist.update.submit.ok", extra={"status": r.status_code, "val_accuracy": val_acc})
-            return {"submitted": True, "val_accuracy": val_acc}
+                logger.info(f"{kind}.update.submit.ok", extra={"status": r.status_code, "val_accuracy": metrics["val_accuracy"]})
+
+            if train_pool.enabled:
+                metrics = train_pool.run(spec, server_weights, progress, submit)
+            else:
+                metrics = train_round(spec, server_weights, progress.report, submit)
+            # Clear token from memory (best-effort)
+            spec["hf"] = hf_token = None
+            return {"submitted": True, **{k: v for k, v in metrics.items() if k not in ("loaded", "num_examples")}}
+        except TaskCancelled:
+            logger.info("train.cancelled", extra={"job_id": task.job_id, "task_id": progress.id})
+            raise
         except Exception as e:
             logger.exception("train.fail", extra={"job_id": getattr(task, "job_id", None)})
             raise HTTPException(status_code=502, detail=f"train failed: {e}")
 
+    @app.post("/task/train", status_code=202)
+    def task_train(task: TrainTask):
+        """Queue a training round; poll GET /task/{task_id} or wait for the callback."""
+        callback_url = task.callback_url or f"{API_BASE}/round/{task.job_id}/tasks/report"
+        try:
+            queued = tasks.submit("train", task.job_id, lambda t: _run_train(task, t), callback_url=callback_url)
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        return queued.to_dict()
+
+    @app.get("/tasks")
+    def list_tasks():
+        return {"tasks": [t.to_dict() for t in tasks.list()]}
+
+    @app.get("/task/{task_id}")
+    def get_task(task_id: str):
+        t = tasks.get(task_id)
+        if t is None:
+            raise HTTPException(status_code=404, detail="task not found")
+        return t.to_dict()
+
+    @app.post("/task/{task_id}/cancel")
+    def cancel_task(task_id: str):
+        t = tasks.cancel(task_id)
+        if t is None:
+            raise HTTPException(status_code=404, detail="task not found")
+        return t.to_dict()
+
     @app.get("/logs")
     def logs():
         return PlainTextResponse("\n".join(list(LOG_BUFFER)))
@@ -398,31 +296,24 @@ def create_app() -> FastAPI:
 
             # Fetch aggregated weights from orchestrator
             logger.info("push_hf.model.fetch", extra={"job_id": task.job_id})
-            resp = requests.get(f"{API_BASE}/job/{task.job_id}/model", headers=api_headers(), timeout=15)
-            resp.raise_for_status()
-            data = resp.json()
-            weights = data.get("weights") or []
+            weights = fetch_model(API_BASE, task.job_id, headers=api_headers(), timeout=15)
             if not weights:
                 raise HTTPException(status_code=400, detail="No aggregated weights available for job")
 
-            # Load base model and apply weights
-            logger.info("push_hf.model.load.begin", extra={"model": model_id})
-            model_hf = AutoModelForSequenceClassification.from_pretrained(model_id, use_auth_token=hf_token)
-            ok = load_weights_into_model(model_hf, weights)
-            if not ok:
-                raise HTTPException(status_code=400, detail="Aggregated weights shape mismatch for HF model")
-
-            # Push to Hub
-            logger.info("push_hf.hub.push.begin", extra={"model": model_id, "private": hf_private})
-            with TemporaryDirectory() as tmpd:
-                model_hf.save_pretrained(tmpd)
-                # Push via model API
-                model_hf.push_to_hub(model_id, use_auth_token=hf_token, private=hf_private, commit_message="quackmesh aggregated push")
-            logger.info("push_hf.hub.push.ok", extra={"model": model_id})
+            # Apply the aggregated weights to the (cached) base model and push to Hub,
+            # in a training slot when the pool is on
+            spec = {"op": "push_hf", "job_id": task.job_id, "hf": {"model_id": model_id, "hf_token": hf_token, "private": hf_private}}
+            try:
+                if train_pool.enabled:
+                    result = train_pool.run(spec, weights, Task("push_hf", task.job_id, None, None), lambda w, m: None)
+                else:
+                    result = push_to_hub(spec, weights, lambda **_: None, lambda w, m: None)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
             # Clear token
-            del hf_token
-            return {"pushed": True, "hf_model": model_id}
+            spec["hf"] = hf_token = None
+            return result
         except HTTPException:
             raise
         except Exception as e:
@@ -456,19 +347,20 @@ def create_app() -> FastAPI:
         except Exception:
             raise HTTPException(status_code=500, detail="Failed to decrypt HF token")
 
-    def _build_model_for_job(job_id: int):
-        """Build a model for the job: HF text classifier if configured, else MNIST MLP."""
+    @contextmanager
+    def _model_for_job(job_id: int):
+        """Model for the job: HF text classifier if configured (leased from the cache), else MNIST MLP."""
         meta = _hf_meta(job_id)
         if meta and meta.get("huggingface_model_id") and meta.get("token_enc_b64"):
             token = _decrypt_hf_token(meta["token_enc_b64"])
             model_id = meta["huggingface_model_id"]
-            tokenizer = AutoTokenizer.from_pretrained(model_id, use_auth_token=token)
-            model = AutoModelForSequenceClassification.from_pretrained(model_id, use_auth_token=token)
-            return {"type": "hf", "model": model, "tokenizer": tokenizer, "model_id": model_id, "hf_token": token, "dataset_id": meta.get("huggingface_dataset_id")}
+            with model_cache.lease(model_id, token) as entry:
+                yield {"type": "hf", "model": entry.model, "tokenizer": entry.tokenizer, "model_id": model_id, "hf_token": token, "dataset_id": meta.get("huggingface_dataset_id")}
+            return
         # default MNIST
-        return {"type": "mnist", "model": build_model()}
+        yield {"type": "mnist", "model": build_model()}
 
-    def _set_model_weights(model: nn.Module, weights: List[List[float]]):
+    def _set_model_weights(model: nn.Module, weights: List[np.ndarray]):
         if not weights:
             return
         ok = load_weights_into_model(model, weights)
@@ -476,10 +368,9 @@ def create_app() -> FastAPI:
             raise RuntimeError("Flower: weights shape mismatch")
 
     class _FlowerClient(fl.client.NumPyClient):
-        def __init__(self, job_id: int, steps: int = 1):
+        def __init__(self, job_id: int, info: dict, steps: int = 1):
             self.job_id = job_id
             self.steps = max(1, int(steps))
-            info = _build_model_for_job(job_id)
             self.kind = info["type"]
             self.model = info["model"]
             self.hf_token = info.get("hf_token")
@@ -487,26 +378,16 @@ def create_app() -> FastAPI:
             self.dataset_id = info.get("dataset_id")
 
         def get_parameters(self, config):
-            return [np.array(w, dtype=np.float32) for w in serialize_weights(self.model)]
+            return serialize_weights(self.model)
 
         def fit(self, parameters, config):
-            weights = [w.tolist() if isinstance(w, np.ndarray) else w for w in parameters]
-            _set_model_weights(self.model, weights)
+            _set_model_weights(self.model, parameters)
+            num_examples = 0
             if self.kind == "hf":
-                texts, labels = get_text_classification_data(self.dataset_id, self.hf_token, max_examples=64)
-                optim = torch.optim.AdamW(self.model.parameters(), lr=5e-5)
-                self.model.train()
-                steps_done = 0
-                for t, y in zip(texts, labels):
-                    enc = self.tokenizer(t, return_tensors="pt", padding=True, truncation=True, max_length=32)
-                    optim.zero_grad(set_to_none=True)
-                    out = self.model(**enc, labels=torch.tensor([int(y)]))
-                    loss = out.loss
-                    loss.backward()
-                    optim.step()
-                    steps_done += 1
-                    if steps_done >= self.steps:
-                        break
+                texts, labels = get_text_classification_data(self.dataset_id, self.hf_token, max_examples=hf_training.HF_TRAIN_EXAMPLES)
+                stats = hf_training.train(self.model, hf_training.pretokenize(self.tokenizer, texts, labels), steps=self.steps)
+                logger.info("hf.train.done", extra={"job_id": self.job_id, **stats})
+                num_examples = stats["samples"]
             else:
                 train_loader, _ = get_data_loaders()
                 optimizer = torch.optim.SGD(self.model.parameters(), lr=0.01, momentum=0.9)
@@ -520,25 +401,30 @@ def create_app() -> FastAPI:
                     loss.backward()
                     optimizer.step()
                     batches_trained += 1
+                    num_examples += int(y.size(0))
                     if batches_trained >= self.steps:
                         break
-            new_params = [np.array(w, dtype=np.float32) for w in serialize_weights(self.model)]
-            return new_params, self.steps, {}
+            codec = str((config or {}).get("update_codec") or "fp32")
+            new_params, codec_meta = encode_update(
+                serialize_weights(self.model), codec, base=parameters, implicit_base=True, residual_key=("flower", self.job_id)
+            )
+            # Flower delivers the fit result itself; there is no later point to commit at
+            commit_residual(("flower", self.job_id))
+            metrics = {"codec": codec_meta["codec"]}
+            if "shapes" in codec_meta:
+                metrics["shapes"] = json.dumps(codec_meta["shapes"])
+            return new_params, max(1, num_examples), metrics
 
         def evaluate(self, parameters, config):
-            weights = [w.tolist() if isinstance(w, np.ndarray) else w for w in parameters]
-            _set_model_weights(self.model, weights)
+            _set_model_weights(self.model, parameters)
             if self.kind == "hf":
-                texts, _ = get_text_classification_data(self.dataset_id, self.hf_token, max_examples=64)
-                self.model.eval()
-                with torch.no_grad():
-                    preds = []
-                    for t in texts:
-                        enc = self.tokenizer(t, return_tensors="pt", padding=True, truncation=True, max_length=32)
-                        logits = self.model(**enc).logits
-                        preds.append(int(logits.argmax(dim=-1).item()))
-                # dummy metric
-                return float(0.0), len(texts), {"metric": 0.0}
+                stats = hf_training.evaluate(self.model, hf_training.holdout(self.tokenizer, self.dataset_id, self.hf_token))
+                logger.info("hf.eval.done", extra={"job_id": self.job_id, **stats})
+                return float(stats["loss"]), stats["samples"], {
+                    "val_accuracy": stats["accuracy"],
+                    "samples_per_s": stats["samples_per_s"],
+                    "tokens_per_s": stats["tokens_per_s"],
+                }
             else:
                 _, test_loader = get_data_loaders()
                 self.model.eval()
@@ -559,16 +445,27 @@ def create_app() -> FastAPI:
     def task_flower_start(task: FlowerStartTask):
         try:
             logger.info("flower.client.start", extra={"job_id": task.job_id, "server": task.server_address, "steps": task.steps})
-            client = _FlowerClient(job_id=task.job_id, steps=task.steps)
-
-            def _run():
+            def _serve(info: dict):
+                client = _FlowerClient(job_id=task.job_id, info=info, steps=task.steps)
                 try:
                     fl.client.start_numpy_client(server_address=task.server_address, client=client)
                 except Exception:
                     logger.exception("flower.client.fail", extra={"job_id": task.job_id})
 
-            proc = mp.Process(target=_run, daemon=True, name=f"flower-client-{task.job_id}")
-            proc.start()
+            if train_pool.enabled:
+                # HF models live in the training slots, not here: the client process loads its own
+                def _run():
+                    with _model_for_job(task.job_id) as info:
+                        _serve(info)
+
+                proc = mp.Process(target=_run, daemon=True, name=f"flower-client-{task.job_id}")
+                proc.start()
+            else:
+                # The forked client gets its own copy of the cached model, so the lease only
+                # has to cover the fork; every fit/evaluate then loads the round's parameters into it
+                with _model_for_job(task.job_id) as info:
+                    proc = mp.Process(target=_serve, args=(info,), daemon=True, name=f"flower-client-{task.job_id}")
+                    proc.start()
             # record pid for control ops
             try:
                 state["flower_pids"][int(task.job_id)] = int(proc.pid)
@@ -608,7 +505,7 @@ def create_app() -> FastAPI:
             if hdr_key != CONTROL_KEY:
                 raise HTTPException(status_code=403, detail="invalid control key")
 
-        if action not in {"start", "stop", "restart", "terminate"}:
+        if action not in {"start", "stop", "restart", "terminate", "invalidate_data"}:
             raise HTTPException(status_code=400, detail="unknown action")
 
         result: dict = {"action": action}
@@ -641,6 +538,10 @@ def create_app() -> FastAPI:
                 # resume
                 state["suspended"] = False
                 result["suspended"] = False
+            elif action == "invalidate_data":
+                # Rebuild datasets on the next round (e.g. after the data under DATA_DIR changed)
+                result["invalidated"] = invalidate_data((body.get("params") or {}).get("kind"))
+                hf_training.clear_tokenized()
             elif action == "terminate":
                 # stop clients, then exit the worker process (supervisor may restart)
                 for jid, pid in list(state["flower_pids"].items()):
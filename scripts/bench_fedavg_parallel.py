@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Benchmark FedAvg fold/average time against the number of pool processes.
+
+    python scripts/bench_fedavg_parallel.py            # 100M params, 1..cpu_count processes
+    BENCH_PARAMS=25000000 BENCH_CLIENTS=8 python scripts/bench_fedavg_parallel.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from app.config import settings  # noqa: E402
+from app.services.fedavg import FedAvgEngine, LayerLayout  # noqa: E402
+from app.services.parallel_fedavg import ParallelFedAvgEngine, shutdown  # noqa: E402
+
+PARAMS = int(os.getenv("BENCH_PARAMS", "100000000"))
+CLIENTS = int(os.getenv("BENCH_CLIENTS", "4"))
+LAYERS = int(os.getenv("BENCH_LAYERS", "24"))
+MAX_PROCS = int(os.getenv("BENCH_MAX_PROCS", str(os.cpu_count() or 1)))
+
+
+def run(engine, clients):
+    engine.add(clients[0], 1.0)  # warm up the pool and the staging segment
+    t0 = time.perf_counter()
+    for i, layers in enumerate(clients):
+        engine.add(layers, float(10 + i))
+    t1 = time.perf_counter()
+    out = engine.average()
+    t2 = time.perf_counter()
+    return (t1 - t0) / len(clients), t2 - t1, out
+
+
+def main():
+    per_layer = PARAMS // LAYERS
+    layout = LayerLayout([(per_layer,)] * LAYERS)
+    rng = np.random.default_rng(0)
+    clients = [[rng.standard_normal(per_layer, dtype=np.float32) for _ in range(LAYERS)] for _ in range(CLIENTS)]
+    print(f"{layout.size:,} params ({layout.size * 4 / 2**20:.0f} MiB fp32), {CLIENTS} clients")
+
+    fold, avg, ref = run(FedAvgEngine(layout), clients)
+    print(f"{'serial':>10}  fold {fold * 1e3:8.1f} ms/client  average {avg * 1e3:8.1f} ms")
+    procs = 1
+    while procs <= MAX_PROCS:
+        shutdown()
+        settings.fedavg_processes = procs
+        engine = ParallelFedAvgEngine(layout, processes=procs)
+        fold_p, avg_p, out = run(engine, clients)
+        assert np.allclose(out, ref, atol=1e-5), "parallel result differs from serial"
+        print(
+            f"{procs:>4} procs  fold {fold_p * 1e3:8.1f} ms/client  average {avg_p * 1e3:8.1f} ms"
+            f"  speedup x{fold / fold_p:.2f} / x{avg / avg_p:.2f}"
+        )
+        engine.close()
+        procs *= 2
+    shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Benchmark MNIST batch throughput: torchvision DataLoader vs the memory-mapped tensor cache.
+
+    DATASET=MNIST python scripts/bench_mnist_pipeline.py        # real MNIST under DATA_DIR
+    BENCH_DATASET=FAKE BENCH_BATCHES=50 python scripts/bench_mnist_pipeline.py
+
+Reports samples/s for a training pass (shuffled) and the 2k-sample evaluation pass;
+the first cached pass includes the one-time conversion, later passes are steady state.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+
+from quackmesh_client import data_pipeline  # noqa: E402
+
+DATASET = os.getenv("BENCH_DATASET", os.getenv("DATASET", "MNIST")).upper()
+BATCH_SIZE = int(os.getenv("BENCH_BATCH_SIZE", "128"))
+BATCHES = int(os.getenv("BENCH_BATCHES", "200"))
+EVAL_SAMPLES = int(os.getenv("BENCH_EVAL_SAMPLES", "2000"))
+REPEATS = int(os.getenv("BENCH_REPEATS", "3"))
+
+
+def drain(loader, max_samples):
+    samples = 0
+    t0 = time.perf_counter()
+    for x, y in loader:
+        samples += int(y.shape[0])
+        if samples >= max_samples:
+            break
+    return samples / max(time.perf_counter() - t0, 1e-9)
+
+
+def loaders(cached):
+    if DATASET == "MNIST":
+        build = data_pipeline._build_mnist_batch_loaders if cached else data_pipeline._build_mnist_loaders
+    else:
+        build = data_pipeline._build_fake_mnist_batch_loaders if cached else data_pipeline._build_fake_mnist_loaders
+    t0 = time.perf_counter()
+    train, test = build(BATCH_SIZE)
+    return train, test, time.perf_counter() - t0
+
+
+def main():
+    print(f"dataset={DATASET} batch_size={BATCH_SIZE} train_samples={BATCHES * BATCH_SIZE} eval_samples={EVAL_SAMPLES}")
+    print(f"{'pipeline':<12} {'build s':>8} {'train samples/s':>16} {'eval samples/s':>15}")
+    results = {}
+    for name, cached in (("torchvision", False), ("tensors", True)):
+        train, test, build_s = loaders(cached)
+        train_rate = max(drain(train, BATCHES * BATCH_SIZE) for _ in range(REPEATS))
+        eval_rate = max(drain(test, EVAL_SAMPLES) for _ in range(REPEATS))
+        results[name] = (train_rate, eval_rate)
+        print(f"{name:<12} {build_s:>8.2f} {train_rate:>16,.0f} {eval_rate:>15,.0f}")
+    (tv_train, tv_eval), (t_train, t_eval) = results["torchvision"], results["tensors"]
+    print(f"speedup: train x{t_train / max(tv_train, 1e-9):.1f}, eval x{t_eval / max(tv_eval, 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""add_upload_sessions
+
+Revision ID: 0b9d3f6e8a42
+Revises: e2b6f0a9c351
+Create Date: 2026-10-17 18:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b9d3f6e8a42'
+down_revision: Union[str, None] = 'e2b6f0a9c351'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.String(length=32), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('received', sa.JSON(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_upload_sessions_job_id', 'upload_sessions', ['job_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_upload_sessions_job_id', table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,35 @@
+"""add_model_versions
+
+Revision ID: 5a7e2c9d4b18
+Revises: c4e8a1d2b7f3
+Create Date: 2026-10-17 16:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a7e2c9d4b18'
+down_revision: Union[str, None] = 'c4e8a1d2b7f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'model_versions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('weights_digest', sa.String(length=64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_model_versions_job_id', 'model_versions', ['job_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_model_versions_job_id', table_name='model_versions')
+    op.drop_table('model_versions')
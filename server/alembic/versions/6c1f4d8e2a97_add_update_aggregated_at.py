@@ -0,0 +1,32 @@
+"""add_update_aggregated_at
+
+Revision ID: 6c1f4d8e2a97
+Revises: 0b9d3f6e8a42
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c1f4d8e2a97'
+down_revision: Union[str, None] = '0b9d3f6e8a42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('updates', sa.Column('aggregated_at', sa.DateTime(), nullable=True))
+    op.add_column('updates', sa.Column('aggregation_error', sa.String(), nullable=True))
+    op.create_index(op.f('ix_updates_aggregated_at'), 'updates', ['aggregated_at'], unique=False)
+    # Existing updates were aggregated inline when they were submitted
+    op.execute("UPDATE updates SET aggregated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE aggregated_at IS NULL")
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_updates_aggregated_at'), table_name='updates')
+    op.drop_column('updates', 'aggregation_error')
+    op.drop_column('updates', 'aggregated_at')
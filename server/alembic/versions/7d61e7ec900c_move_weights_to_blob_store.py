@@ -0,0 +1,41 @@
+"""move_weights_to_blob_store
+
+Revision ID: 7d61e7ec900c
+Revises: eb73f8e73785
+Create Date: 2026-10-17 11:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d61e7ec900c'
+down_revision: Union[str, None] = 'eb73f8e73785'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing JSON weights stay readable; new writes go to the blob store
+    for table in ('updates', 'model_artifacts'):
+        op.add_column(table, sa.Column('weights_digest', sa.String(length=64), nullable=True))
+        op.add_column(table, sa.Column('weights_shapes', sa.JSON(), nullable=True))
+        op.add_column(table, sa.Column('weights_dtype', sa.String(), nullable=True))
+        op.add_column(table, sa.Column('weights_nbytes', sa.BigInteger(), nullable=True))
+        op.create_index(op.f(f'ix_{table}_weights_digest'), table, ['weights_digest'], unique=False)
+    op.add_column('model_artifacts', sa.Column('version', sa.Integer(), nullable=True, server_default='0'))
+    op.alter_column('model_artifacts', 'weights', existing_type=sa.JSON(), nullable=True)
+
+
+def downgrade() -> None:
+    op.alter_column('model_artifacts', 'weights', existing_type=sa.JSON(), nullable=False)
+    op.drop_column('model_artifacts', 'version')
+    for table in ('model_artifacts', 'updates'):
+        op.drop_index(op.f(f'ix_{table}_weights_digest'), table_name=table)
+        op.drop_column(table, 'weights_nbytes')
+        op.drop_column(table, 'weights_dtype')
+        op.drop_column(table, 'weights_shapes')
+        op.drop_column(table, 'weights_digest')
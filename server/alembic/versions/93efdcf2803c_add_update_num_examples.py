@@ -0,0 +1,26 @@
+"""add_update_num_examples
+
+Revision ID: 93efdcf2803c
+Revises: 7d61e7ec900c
+Create Date: 2026-10-17 14:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '93efdcf2803c'
+down_revision: Union[str, None] = '7d61e7ec900c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('updates', sa.Column('num_examples', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('updates', 'num_examples')
@@ -0,0 +1,28 @@
+"""add_update_norm_and_pruned_at
+
+Revision ID: 9e3a7b5c1f60
+Revises: 6c1f4d8e2a97
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e3a7b5c1f60'
+down_revision: Union[str, None] = '6c1f4d8e2a97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('updates', sa.Column('norm', sa.Float(), nullable=True))
+    op.add_column('updates', sa.Column('pruned_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('updates', 'pruned_at')
+    op.drop_column('updates', 'norm')
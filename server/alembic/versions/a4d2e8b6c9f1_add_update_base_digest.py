@@ -0,0 +1,26 @@
+"""add_update_base_digest
+
+Revision ID: a4d2e8b6c9f1
+Revises: f3c8d1a6b2e4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d2e8b6c9f1'
+down_revision: Union[str, None] = 'f3c8d1a6b2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('updates', sa.Column('base_digest', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('updates', 'base_digest')
@@ -0,0 +1,26 @@
+"""add_job_update_codec
+
+Revision ID: c4e8a1d2b7f3
+Revises: 93efdcf2803c
+Create Date: 2026-10-17 15:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1d2b7f3'
+down_revision: Union[str, None] = '93efdcf2803c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('update_codec', sa.String(), nullable=True, server_default='fp32'))
+
+
+def downgrade() -> None:
+    op.drop_column('jobs', 'update_codec')
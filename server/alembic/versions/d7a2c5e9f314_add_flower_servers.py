@@ -0,0 +1,50 @@
+"""add_flower_servers
+
+Revision ID: d7a2c5e9f314
+Revises: 9e3a7b5c1f60
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a2c5e9f314'
+down_revision: Union[str, None] = '9e3a7b5c1f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'flower_servers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('node', sa.String(), nullable=False),
+        sa.Column('instance', sa.String(), nullable=False),
+        sa.Column('host', sa.String(), nullable=False),
+        sa.Column('port', sa.Integer(), nullable=False),
+        sa.Column('pid', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('rounds', sa.Integer(), nullable=True),
+        sa.Column('current_round', sa.Integer(), nullable=True),
+        sa.Column('clients', sa.Integer(), nullable=True),
+        sa.Column('round_timings', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_flower_servers_job_id'), 'flower_servers', ['job_id'], unique=False)
+    op.create_index(op.f('ix_flower_servers_status'), 'flower_servers', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_flower_servers_status'), table_name='flower_servers')
+    op.drop_index(op.f('ix_flower_servers_job_id'), table_name='flower_servers')
+    op.drop_table('flower_servers')
@@ -0,0 +1,34 @@
+"""add_async_aggregation
+
+Revision ID: e2b6f0a9c351
+Revises: 5a7e2c9d4b18
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b6f0a9c351'
+down_revision: Union[str, None] = '5a7e2c9d4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('aggregation_mode', sa.String(), nullable=True, server_default='sync'))
+    op.add_column('jobs', sa.Column('buffer_size', sa.Integer(), nullable=True, server_default='4'))
+    op.add_column('jobs', sa.Column('server_lr', sa.Float(), nullable=True, server_default='1.0'))
+    op.add_column('updates', sa.Column('base_version', sa.Integer(), nullable=True))
+    op.add_column('updates', sa.Column('folded_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('updates', 'folded_version')
+    op.drop_column('updates', 'base_version')
+    op.drop_column('jobs', 'server_lr')
+    op.drop_column('jobs', 'buffer_size')
+    op.drop_column('jobs', 'aggregation_mode')
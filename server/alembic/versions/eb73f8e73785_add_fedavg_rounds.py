@@ -0,0 +1,30 @@
+"""add_fedavg_rounds
+
+Revision ID: eb73f8e73785
+Revises: a00f7990d102
+Create Date: 2026-10-17 09:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'eb73f8e73785'
+down_revision: Union[str, None] = 'a00f7990d102'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('current_round', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('updates', sa.Column('round', sa.Integer(), nullable=True, server_default='0'))
+    op.create_index(op.f('ix_updates_round'), 'updates', ['round'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_updates_round'), table_name='updates')
+    op.drop_column('updates', 'round')
+    op.drop_column('jobs', 'current_round')
@@ -0,0 +1,49 @@
+"""add_worker_tasks
+
+Revision ID: f3c8d1a6b2e4
+Revises: d7a2c5e9f314
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c8d1a6b2e4'
+down_revision: Union[str, None] = 'd7a2c5e9f314'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'worker_tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('endpoint', sa.String(), nullable=False),
+        sa.Column('task_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=True),
+        sa.Column('round', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('progress', sa.JSON(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_worker_tasks_job_id'), 'worker_tasks', ['job_id'], unique=False)
+    op.create_index(op.f('ix_worker_tasks_task_id'), 'worker_tasks', ['task_id'], unique=False)
+    op.create_index(op.f('ix_worker_tasks_status'), 'worker_tasks', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_worker_tasks_status'), table_name='worker_tasks')
+    op.drop_index(op.f('ix_worker_tasks_task_id'), table_name='worker_tasks')
+    op.drop_index(op.f('ix_worker_tasks_job_id'), table_name='worker_tasks')
+    op.drop_table('worker_tasks')
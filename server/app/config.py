@@ -38,6 +38,45 @@ class Settings(BaseModel):
     # Worker control key for forwarding control commands
     worker_control_key: str | None = os.getenv("WORKER_CONTROL_KEY")
 
+    # Model weight blobs (content-addressed)
+    blob_store_backend: str = os.getenv("BLOB_STORE_BACKEND", "local")
+    blob_store_dir: str = os.getenv("BLOB_STORE_DIR", "/tmp/quackmesh/blobs")
+    # Recent global model versions per job that ?since= delta downloads can diff against
+    model_version_ring: int = int(os.getenv("MODEL_VERSION_RING", "8"))
+    # Largest per-weight error a quantized ?since= delta may introduce, and the delta document cache
+    model_delta_max_error: float = float(os.getenv("MODEL_DELTA_MAX_ERROR", "1e-3"))
+    model_delta_cache_mb: int = int(os.getenv("MODEL_DELTA_CACHE_MB", "256"))
+
+    # Resumable chunked update uploads (spool dir should share a filesystem with the blob store)
+    upload_spool_dir: str = os.getenv("UPLOAD_SPOOL_DIR", "/tmp/quackmesh/uploads")
+    upload_chunk_size: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+    upload_max_bytes: int = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+    upload_session_ttl_hours: int = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+    # Process-parallel FedAvg for large models (0 processes = one per CPU, 1 = off)
+    fedavg_processes: int = int(os.getenv("FEDAVG_PROCESSES", "0"))
+    fedavg_parallel_min_params: int = int(os.getenv("FEDAVG_PARALLEL_MIN_PARAMS", str(16 * 1024 * 1024)))
+
+    # Background aggregation worker: "local" (in-process queue) or "redis" (stream shared by all processes)
+    aggregation_queue: str = os.getenv("AGGREGATION_QUEUE", "local")
+    aggregation_stream: str = os.getenv("AGGREGATION_STREAM", "quackmesh:aggregation")
+    aggregation_batch_size: int = int(os.getenv("AGGREGATION_BATCH_SIZE", "64"))
+    aggregation_sweep_seconds: float = float(os.getenv("AGGREGATION_SWEEP_SECONDS", "5"))
+    # In-memory round sums / async buffers of jobs idle this long are dropped (rebuilt from rows on demand)
+    aggregation_idle_seconds: float = float(os.getenv("AGGREGATION_IDLE_SECONDS", "900"))
+
+    # Compaction: drop weights of folded updates after the retention window (0 = keep forever)
+    update_retention_hours: int = int(os.getenv("UPDATE_RETENTION_HOURS", "168"))
+    compaction_interval_seconds: float = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+    # Unreferenced blobs younger than this are kept (they may belong to an uncommitted submission)
+    blob_gc_grace_minutes: int = int(os.getenv("BLOB_GC_GRACE_MINUTES", "60"))
+
+    # Flower server supervisor (per orchestrator replica)
+    flower_port_range: str = os.getenv("FLOWER_PORT_RANGE", "8089-8099")
+    flower_max_servers: int = int(os.getenv("FLOWER_MAX_SERVERS", "4"))
+    flower_warm_processes: int = int(os.getenv("FLOWER_WARM_PROCESSES", "1"))
+    flower_heartbeat_seconds: float = float(os.getenv("FLOWER_HEARTBEAT_SECONDS", "10"))
+
 settings = Settings()
 
 
@@ -3,6 +3,8 @@ from .routers import job, cluster, provider, training, nodes, datasets, marketpl
 from .db import Base, engine
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
 from sqlalchemy import text
 import redis
 from .config import settings
@@ -13,10 +15,13 @@ import time
 import hashlib
 from fastapi.responses import JSONResponse, Response
 from .services.events import listener
+from .services.aggregation_worker import worker as aggregation_worker
+from .services.flower_supervisor import supervisor as flower_supervisor
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import structlog
 from .security import authenticate_headers, issue_jwt, extract_identity, get_jwt_subject
 from .schemas import TokenIssueRequest, TokenResponse
+from .services.tensor_codec import accepts_tensors
 
 # Configure structured JSON logging
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -69,7 +74,18 @@ else:
         allow_methods=["*"],
         allow_headers=["*"],
     )
-app.add_middleware(GZipMiddleware, minimum_size=1024)
+class TensorAwareGZipMiddleware(GZipMiddleware):
+    """GZip everything except binary tensor downloads: float32 weights barely compress
+    and gzipping them would cost CPU proportional to model size on every request."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and accepts_tensors(Headers(scope=scope).get("accept")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(TensorAwareGZipMiddleware, minimum_size=1024)
 
 @app.middleware("http")
 async def request_id_middleware(request: Request, call_next):
@@ -190,6 +206,29 @@ def _stop_event_listener():
         pass
 
 
+@app.on_event("startup")
+def _start_aggregation_worker():
+    aggregation_worker.start()
+
+
+@app.on_event("shutdown")
+def _stop_aggregation_worker():
+    aggregation_worker.stop()
+
+
+@app.on_event("startup")
+def _warm_flower_servers():
+    try:
+        flower_supervisor.warm()
+    except Exception:
+        logging.getLogger("quackmesh").debug("Failed to warm Flower server pool", exc_info=True)
+
+
+@app.on_event("shutdown")
+def _stop_flower_servers():
+    flower_supervisor.shutdown()
+
+
 @app.get("/metrics")
 def metrics():
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, LargeBinary, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, ForeignKey, LargeBinary, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -15,6 +15,11 @@ class Job(Base):
     huggingface_dataset_id = Column(String, nullable=True)
     hf_token_enc = Column(LargeBinary, nullable=True)
     hf_private = Column(String, default="true")  # use string "true"/"false" for simplicity
+    current_round = Column(Integer, default=0)  # FedAvg round; updates from earlier rounds stop counting
+    update_codec = Column(String, default="fp32")  # wire codec workers use for updates: fp32 | fp16 | int8 | topk
+    aggregation_mode = Column(String, default="sync")  # sync (per-round FedAvg) | async (FedBuff)
+    buffer_size = Column(Integer, default=4)  # async: updates buffered before the global model moves
+    server_lr = Column(Float, default=1.0)  # async: step size applied to the buffered mean delta
 
     updates = relationship("Update", back_populates="job")
     artifact = relationship("ModelArtifact", back_populates="job", uselist=False)
@@ -23,10 +28,23 @@ class Update(Base):
     __tablename__ = "updates"
     id = Column(Integer, primary_key=True, index=True)
     job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
-    weights = Column(JSON, nullable=True)  # list of lists (numpy arrays tolist()); nullable for HF jobs
+    weights = Column(JSON, nullable=True)  # legacy inline weights; new rows use the blob store
+    weights_digest = Column(String(64), nullable=True, index=True)  # sha256 of the weights blob
+    weights_shapes = Column(JSON, nullable=True)  # per-layer shapes, e.g. [[100352], [128]]
+    weights_dtype = Column(String, nullable=True)
+    weights_nbytes = Column(BigInteger, nullable=True)
+    base_digest = Column(String(64), nullable=True)  # model blob an int8/top-k update was computed against
     val_accuracy = Column(Float, default=0.0)
+    num_examples = Column(Integer, nullable=True)  # training samples behind the update (FedAvg weight)
     contributor = Column(String, nullable=True)  # contributor wallet or id
+    round = Column(Integer, default=0, index=True)  # job round the update was submitted in
+    base_version = Column(Integer, nullable=True)  # global model version the client trained from
+    folded_version = Column(Integer, nullable=True)  # model version the update was first folded into
     created_at = Column(DateTime, default=datetime.utcnow)
+    aggregated_at = Column(DateTime, nullable=True, index=True)  # set by the aggregation worker
+    aggregation_error = Column(String, nullable=True)  # why the worker could not fold the update
+    norm = Column(Float, nullable=True)  # L2 norm of the update's delta from its base model, when known
+    pruned_at = Column(DateTime, nullable=True)  # weights payload deleted by compaction; metadata kept
 
     job = relationship("Job", back_populates="updates")
 
@@ -34,11 +52,74 @@ class ModelArtifact(Base):
     __tablename__ = "model_artifacts"
     id = Column(Integer, primary_key=True)
     job_id = Column(Integer, ForeignKey("jobs.id"), unique=True, index=True)
-    weights = Column(JSON, nullable=False)  # latest global model weights
+    weights = Column(JSON, nullable=True)  # legacy inline weights; new rows use the blob store
+    weights_digest = Column(String(64), nullable=True, index=True)  # sha256 of the weights blob
+    weights_shapes = Column(JSON, nullable=True)
+    weights_dtype = Column(String, nullable=True)
+    weights_nbytes = Column(BigInteger, nullable=True)
+    version = Column(Integer, default=0)  # incremented on every write of the global model
     updated_at = Column(DateTime, default=datetime.utcnow)
 
     job = relationship("Job", back_populates="artifact")
 
+class ModelVersion(Base):
+    """Recent published versions of a job's global model, kept so workers can download deltas."""
+    __tablename__ = "model_versions"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    version = Column(Integer, nullable=False)
+    weights_digest = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSession(Base):
+    """Resumable chunked upload of an update body, spooled to disk until committed."""
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=True)  # expected digest of the whole body, if the client sent one
+    received = Column(JSON, nullable=True)  # merged [start, end) byte ranges written so far
+    status = Column(String, default="open")  # open | committed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class FlowerServer(Base):
+    """A Flower server run by the supervisor; the registry shared by all orchestrator replicas."""
+    __tablename__ = "flower_servers"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    node = Column(String, nullable=False)  # hostname of the orchestrator replica running it
+    instance = Column(String, nullable=False)  # replica process, "<hostname>-<pid>"
+    host = Column(String, nullable=False)
+    port = Column(Integer, nullable=False)
+    pid = Column(Integer, nullable=True)
+    status = Column(String, default="starting", index=True)  # starting | running | completed | failed
+    rounds = Column(Integer, default=1)
+    current_round = Column(Integer, default=0)
+    clients = Column(Integer, default=0)  # clients connected at the last heartbeat
+    round_timings = Column(JSON, nullable=True)  # [{"round", "seconds", "clients", "results", "failures"}]
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # heartbeat
+    finished_at = Column(DateTime, nullable=True)
+
+class WorkerTask(Base):
+    """A task queued on a worker (a training round); updated from the worker's completion callback."""
+    __tablename__ = "worker_tasks"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    endpoint = Column(String, nullable=False)
+    task_id = Column(String, index=True, nullable=False)  # id assigned by the worker
+    kind = Column(String, default="train")
+    round = Column(Integer, nullable=True)
+    status = Column(String, default="queued", index=True)  # queued | running | succeeded | failed | cancelled
+    progress = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
 class ProviderMachine(Base):
     __tablename__ = "provider_machines"
     id = Column(Integer, primary_key=True)
@@ -0,0 +1,51 @@
+import mmap
+import os
+from typing import Mapping, Optional
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+class MmapFileResponse(Response):
+    """Stream a file straight out of a read-only memory map.
+
+    Body chunks are memoryview slices of the mapping, so serving a large model costs
+    no heap proportional to the file size; the page cache is shared by every
+    concurrent download of the same blob. The file is mapped when the response is
+    created, so the download survives the blob being deleted (e.g. by blob GC) before
+    or while it is sent.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: str, media_type: Optional[str] = None, headers: Optional[Mapping[str, str]] = None, status_code: int = 200):
+        self.path = path
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.init_headers({**(headers or {}), "content-length": str(self.size)})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        mm, self._mm = self._mm, None
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method", "GET").upper() == "HEAD" or mm is None:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            view = memoryview(mm)
+            try:
+                for start in range(0, self.size, self.chunk_size):
+                    end = min(start + self.chunk_size, self.size)
+                    await send({"type": "http.response.body", "body": view[start:end], "more_body": end < self.size})
+            finally:
+                view.release()
+        finally:
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    # A server/middleware still holds a slice; the mapping is freed with it
+                    pass
@@ -1,15 +1,37 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from pydantic import ValidationError
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from ..db import get_session, Base, engine
 from ..models import Job, ModelArtifact, Update
-from ..schemas import CreateJobRequest, CreateJobResponse, ModelResponse, UpdateRequest, HfMetaResponse, JobStatusResponse
-from ..services.fedavg import fedavg
+from ..schemas import (
+    CreateJobRequest,
+    CreateJobResponse,
+    ModelResponse,
+    UpdateRequest,
+    HfMetaResponse,
+    JobStatusResponse,
+    UploadCreateRequest,
+    UploadStatusResponse,
+)
+from ..services import aggregator, json_stream, model_delta, model_store, update_codec, upload_sessions
+from ..services.aggregation_worker import worker as aggregation_worker
+from ..services.blob_store import file_digest, get_blob_store
 from ..security import require_auth
 from ..config import settings
 from ..services.crypto import encrypt_token
+from ..responses import MmapFileResponse
+from starlette.concurrency import run_in_threadpool
 import base64
-from ..services.flower_server import is_flower_running
+import mmap
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from ..services.flower_supervisor import is_flower_running
+from ..services.tensor_codec import TENSOR_CONTENT_TYPE, accepts_tensors, decode_tensors, encode_tensors, is_tensor_payload
+from ..services.update_codec import EncodedUpdate
 
 # Create tables if not exist
 if settings.enable_create_all:
@@ -19,6 +41,14 @@ router = APIRouter(prefix="/job", tags=["job"])
 
 @router.post("/", response_model=CreateJobResponse)
 def create_job(payload: CreateJobRequest, _auth: dict = Depends(require_auth(["job:create"]))):
+    codec = (payload.update_codec or "fp32").lower()
+    if codec not in update_codec.UPDATE_CODECS:
+        raise HTTPException(status_code=400, detail=f"update_codec must be one of {', '.join(update_codec.UPDATE_CODECS)}")
+    mode = (payload.aggregation_mode or "sync").lower()
+    if mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail="aggregation_mode must be 'sync' or 'async'")
+    if payload.buffer_size < 1 or payload.server_lr <= 0:
+        raise HTTPException(status_code=400, detail="buffer_size must be >= 1 and server_lr > 0")
     with get_session() as session:
         job = Job(
             model_arch=payload.model_arch,
@@ -26,6 +56,10 @@ def create_job(payload: CreateJobRequest, _auth: dict = Depends(require_auth(["j
             huggingface_model_id=payload.huggingface_model_id,
             huggingface_dataset_id=payload.huggingface_dataset_id,
             hf_private=str(bool(payload.hf_private)).lower() if payload.hf_private is not None else "true",
+            update_codec=codec,
+            aggregation_mode=mode,
+            buffer_size=payload.buffer_size,
+            server_lr=payload.server_lr,
         )
         # Encrypt HF token if provided
         if payload.huggingface_token:
@@ -35,20 +69,81 @@ def create_job(payload: CreateJobRequest, _auth: dict = Depends(require_auth(["j
                 raise HTTPException(status_code=400, detail="HF token encryption failed; check server config")
         session.add(job)
         session.flush()
-        weights = payload.initial_weights or []
-        artifact = ModelArtifact(job_id=job.id, weights=weights)
-        session.add(artifact)
+        model_store.save_artifact(session, job.id, payload.initial_weights or None)
         return CreateJobResponse(job_id=job.id)
 
+def _model_etag(artifact: ModelArtifact, binary: bool) -> str:
+    # Version plus content hash: identical weights republished as a new version still
+    # get a new tag, so workers always learn the current version number
+    tag = f"v{artifact.version or 0}"
+    if artifact.weights_digest:
+        tag += f"-{artifact.weights_digest}"
+    return f'"{tag}"' if binary else f'"{tag}-json"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # Weak comparison (RFC 9110 13.1.2): a W/ prefix does not prevent a match
+    return "*" in candidates or etag in (c[2:] if c.startswith("W/") else c for c in candidates)
+
+
+def _delta_since(session: Session, job_id: int, since: int, artifact: ModelArtifact) -> Optional[bytes]:
+    """Delta document from version ``since`` to the current model, or None to send it in full."""
+    if not artifact.weights_digest or since >= (artifact.version or 0):
+        return None
+    old_digest = model_store.version_digest(session, job_id, since)
+    if old_digest is None:
+        return None
+    try:
+        return model_delta.delta_document(old_digest, artifact.weights_digest)
+    except model_store.BaseModelUnavailable:
+        return None
+
+
 @router.get("/{job_id}/model", response_model=ModelResponse)
-def get_model(job_id: int):
+def get_model(
+    job_id: int,
+    response: Response,
+    accept: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    since: Optional[int] = Query(default=None, ge=0, description="Version the caller holds; binary responses may then be a delta"),
+):
     with get_session() as session:
-        # Query by job_id since it's not the primary key
-        stmt = select(ModelArtifact).where(ModelArtifact.job_id == job_id)
-        artifact = session.execute(stmt).scalar_one_or_none()
+        artifact = model_store.get_artifact(session, job_id)
         if artifact is None:
             raise HTTPException(status_code=404, detail="Model not found")
-        return ModelResponse(job_id=job_id, weights=artifact.weights or [])
+        job = session.get(Job, job_id)
+        codec = (job.update_codec if job else None) or "fp32"
+        version = artifact.version or 0
+        digest = artifact.weights_digest
+        binary = accepts_tensors(accept)
+        headers = {
+            "X-Model-Version": str(version),
+            "X-Update-Codec": codec,
+            "ETag": _model_etag(artifact, binary),
+            "Vary": "Accept",
+        }
+        if digest:
+            headers["X-Model-Digest"] = digest
+        if _etag_matches(if_none_match, headers["ETag"]):
+            # Worker already holds this version
+            return Response(status_code=304, headers=headers)
+        # Binary tensors when the client negotiates them; JSON stays the fallback
+        if binary:
+            delta = _delta_since(session, job_id, since, artifact) if since is not None else None
+            if delta is not None:
+                return Response(content=delta, media_type=TENSOR_CONTENT_TYPE, headers={**headers, "X-Model-Delta-From": str(since)})
+            path = model_store.blob_path(artifact)
+            if path:
+                # The stored blob already is the wire format: serve it straight from the page cache
+                return MmapFileResponse(path, media_type=TENSOR_CONTENT_TYPE, headers=headers)
+            body = encode_tensors(model_store.load_weights(artifact))
+            return Response(content=body, media_type=TENSOR_CONTENT_TYPE, headers=headers)
+        weights = model_store.load_weights(artifact)
+    response.headers.update(headers)
+    return ModelResponse(job_id=job_id, weights=[w.tolist() for w in weights], version=version, digest=digest, update_codec=codec)
 
 @router.get("/{job_id}/status", response_model=JobStatusResponse)
 def get_job_status(job_id: int):
@@ -56,12 +151,24 @@ def get_job_status(job_id: int):
         job = session.get(Job, job_id)
         if job is None:
             raise HTTPException(status_code=404, detail="Job not found")
-        stmt = select(ModelArtifact).where(ModelArtifact.job_id == job_id)
-        artifact = session.execute(stmt).scalar_one_or_none()
-        has_model = bool(artifact and artifact.weights and len(artifact.weights) > 0)
+        has_model = model_store.has_weights(model_store.get_artifact(session, job_id))
         # Capture status before the session is closed to avoid DetachedInstanceError
         status_str = job.status or "created"
-    return JobStatusResponse(job_id=job_id, status=status_str, flower_running=is_flower_running(job_id), has_model=has_model)
+        round_no = job.current_round or 0
+        mode = job.aggregation_mode or "sync"
+        buffered = aggregator.pending_count(session, job_id) if mode == "async" else 0
+        lag, lag_seconds = aggregator.aggregation_lag(session, job_id)
+    return JobStatusResponse(
+        job_id=job_id,
+        status=status_str,
+        flower_running=is_flower_running(job_id),
+        has_model=has_model,
+        round=round_no,
+        aggregation_mode=mode,
+        buffered=buffered,
+        aggregation_lag=lag,
+        aggregation_lag_seconds=round(lag_seconds, 3),
+    )
 
 @router.get("/{job_id}/hf_meta", response_model=HfMetaResponse)
 def get_hf_meta(job_id: int, _auth: dict = Depends(require_auth(["job:read"]))):
@@ -76,29 +183,230 @@ def get_hf_meta(job_id: int, _auth: dict = Depends(require_auth(["job:read"]))):
             huggingface_dataset_id=job.huggingface_dataset_id,
             token_enc_b64=token_enc_b64,
             hf_private=(job.hf_private == "true") if job.hf_private is not None else True,
+            update_codec=job.update_codec or "fp32",
         )
 
+ParsedUpdate = Tuple[UpdateRequest, Optional[EncodedUpdate], Optional[bytes]]
+
+
+def _expected_layer_sizes(job_id: int) -> Optional[List[int]]:
+    """Flat layer sizes of the job's current model, when known, for early shape checks."""
+    with get_session() as session:
+        artifact = model_store.get_artifact(session, job_id)
+        shapes = artifact.weights_shapes if artifact is not None and artifact.weights_digest else None
+    return [int(np.prod(s, dtype=np.int64)) for s in shapes] if shapes else None
+
+
+async def _read_update(job_id: int, request: Request) -> ParsedUpdate:
+    """Parse an update body sent either as JSON (UpdateRequest) or as binary tensors.
+
+    Binary bodies carry the non-weight fields in the header metadata, and may use a
+    compact update codec (fp16, int8 delta); the raw body is returned so it can be
+    stored as-is. JSON bodies are parsed as they stream in, with weights going
+    straight into float32 arrays.
+    """
+    try:
+        if is_tensor_payload(request.headers.get("content-type")):
+            body = await request.body()
+            try:
+                arrays, meta = decode_tensors(body)
+                encoded = update_codec.from_tensors(arrays, meta)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid tensor payload: {e}")
+            return _update_request(meta), encoded, body
+        expected = await run_in_threadpool(_expected_layer_sizes, job_id)
+        try:
+            fields, layers = await json_stream.parse_update_json(request.stream(), expected)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        payload = UpdateRequest(**fields)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    encoded = update_codec.from_layers(layers) if layers else None
+    return payload, encoded, None
+
+
+def _update_request(meta: Dict[str, Any]) -> UpdateRequest:
+    """The non-weight fields of a binary update, carried in its header metadata."""
+    fields = {k: v for k, v in meta.items() if k not in ("weights", "codec", "base_digest", "shapes")}
+    return UpdateRequest(**fields)
+
+
+def _check_update(artifact: Optional[ModelArtifact], encoded: update_codec.EncodedUpdate) -> None:
+    """Cheap checks done before acknowledging, so obviously bad updates are rejected synchronously."""
+    if encoded.is_delta and not get_blob_store().exists(encoded.base_digest):
+        raise HTTPException(status_code=409, detail="Base model of this update is no longer available; re-download the model")
+    shapes = artifact.weights_shapes if artifact is not None and artifact.weights_digest else None
+    if shapes:
+        expected = [int(np.prod(s, dtype=np.int64)) for s in shapes]
+        if [int(np.prod(s, dtype=np.int64)) for s in encoded.shapes] != expected:
+            raise HTTPException(status_code=400, detail="Update shape does not match the global model")
+
+
+def _record_update(
+    session: Session,
+    job_id: int,
+    payload: UpdateRequest,
+    encoded: Optional[update_codec.EncodedUpdate],
+    store: Callable[[Update], None],
+) -> Dict[str, Any]:
+    """Record an update and store its weights via ``store``; the aggregation worker folds it."""
+    job = session.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    round_no = job.current_round or 0
+    if encoded is not None:
+        _check_update(model_store.get_artifact(session, job_id), encoded)
+    upd = Update(
+        job_id=job_id,
+        val_accuracy=payload.val_accuracy,
+        num_examples=payload.num_examples,
+        contributor=payload.contributor,
+        round=round_no,
+        base_version=payload.base_version,
+    )
+    if encoded is not None:
+        store(upd)
+    session.add(upd)
+    session.flush()
+    return {"status": "ok", "round": round_no, "update_id": upd.id, "queued": True}
+
+
 @router.post("/{job_id}/update")
-def submit_update(job_id: int, payload: UpdateRequest, _auth: dict = Depends(require_auth(["job:update"]))):
+def submit_update(
+    job_id: int,
+    _auth: dict = Depends(require_auth(["job:update"])),
+    parsed: ParsedUpdate = Depends(_read_update),
+):
+    payload, encoded, raw = parsed
+
+    def store(upd: Update) -> None:
+        model_store.put_update(upd, encoded, raw if encoded.codec != "fp32" else None)
+
     with get_session() as session:
-        job = session.get(Job, job_id)
-        if job is None:
+        result = _record_update(session, job_id, payload, encoded, store)
+    # Only after commit, so the worker sees the row
+    aggregation_worker.enqueue(job_id)
+    return result
+
+
+def _upload_status(upload) -> UploadStatusResponse:
+    return UploadStatusResponse(
+        upload_id=upload.id,
+        size=upload.size,
+        received=upload.received or [],
+        chunk_size=settings.upload_chunk_size,
+        status=upload.status or "open",
+    )
+
+
+@router.post("/{job_id}/uploads", response_model=UploadStatusResponse)
+def create_upload(job_id: int, payload: UploadCreateRequest, _auth: dict = Depends(require_auth(["job:update"]))):
+    """Open a resumable upload for a large binary update body."""
+    with get_session() as session:
+        if session.get(Job, job_id) is None:
             raise HTTPException(status_code=404, detail="Job not found")
-        upd = Update(job_id=job_id, weights=payload.weights, val_accuracy=payload.val_accuracy, contributor=payload.contributor)
-        session.add(upd)
-        session.flush()
-        # Aggregate (filter out None weights for HF jobs)
-        stmt = select(Update).where(Update.job_id == job_id)
-        updates_all = session.execute(stmt).scalars().all()
-        update_weights = [u.weights for u in updates_all if u.weights]
-        if update_weights:
-            new_weights = fedavg(update_weights)
-            # upsert artifact
-            stmt = select(ModelArtifact).where(ModelArtifact.job_id == job_id)
-            artifact = session.execute(stmt).scalar_one_or_none()
-            if artifact:
-                artifact.weights = new_weights
-            else:
-                artifact = ModelArtifact(job_id=job_id, weights=new_weights)
-                session.add(artifact)
-        return {"status": "ok"}
+        upload_sessions.expire(session)
+        try:
+            upload = upload_sessions.create(session, job_id, payload.size, payload.sha256)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return _upload_status(upload)
+
+
+@router.get("/{job_id}/uploads/{upload_id}", response_model=UploadStatusResponse)
+def get_upload(job_id: int, upload_id: str, _auth: dict = Depends(require_auth(["job:update"]))):
+    with get_session() as session:
+        upload = upload_sessions.get(session, job_id, upload_id)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return _upload_status(upload)
+
+
+def _lookup_open_upload(job_id: int, upload_id: str) -> Tuple[int, str]:
+    with get_session() as session:
+        upload = upload_sessions.get(session, job_id, upload_id)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if upload.status != "open":
+            raise HTTPException(status_code=409, detail="Upload already committed")
+        return upload.size, upload_sessions.spool_path(upload.id)
+
+
+def _record_range(job_id: int, upload_id: str, start: int, end: int):
+    with get_session() as session:
+        upload = upload_sessions.get(session, job_id, upload_id, for_update=True)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        upload.received = upload_sessions.add_range(upload.received or [], start, end)
+        upload.updated_at = datetime.utcnow()
+        return _upload_status(upload)
+
+
+@router.put("/{job_id}/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def put_upload_chunk(
+    job_id: int,
+    upload_id: str,
+    request: Request,
+    _auth: dict = Depends(require_auth(["job:update"])),
+    content_range: Optional[str] = Header(default=None),
+    x_chunk_sha256: Optional[str] = Header(default=None),
+):
+    """Write one byte range (``Content-Range``, ``X-Chunk-SHA256``) straight into the spool file."""
+    size, path = await run_in_threadpool(_lookup_open_upload, job_id, upload_id)
+    try:
+        start, end = upload_sessions.parse_content_range(content_range, size)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e))
+    try:
+        await upload_sessions.write_range(path, start, end, request.stream(), x_chunk_sha256)
+    except ValueError as e:
+        # The range is not recorded, so the client simply sends it again
+        raise HTTPException(status_code=400, detail=str(e))
+    return await run_in_threadpool(_record_range, job_id, upload_id, start, end)
+
+
+@router.post("/{job_id}/uploads/{upload_id}/commit")
+def commit_upload(job_id: int, upload_id: str, _auth: dict = Depends(require_auth(["job:update"]))):
+    """Move a complete upload into the blob store and queue it like a regular update."""
+    with get_session() as session:
+        upload = upload_sessions.get(session, job_id, upload_id, for_update=True)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if upload.status != "open":
+            raise HTTPException(status_code=409, detail="Upload already committed")
+        if not upload_sessions.is_complete(upload):
+            raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "received": upload.received or []})
+        path = upload_sessions.spool_path(upload.id)
+        digest, size = file_digest(path)
+        if upload.sha256 and digest != upload.sha256:
+            raise HTTPException(status_code=400, detail="Upload SHA-256 mismatch")
+        with open(path, "rb") as f:
+            spool = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = encoded = None
+        try:
+            error: Optional[Exception] = None
+            try:
+                arrays, meta = decode_tensors(spool)
+                encoded = update_codec.from_tensors(arrays, meta)
+                payload = _update_request(meta)
+            except ValueError as e:
+                error = HTTPException(status_code=400, detail=f"Invalid tensor payload: {e}")
+            except ValidationError as e:
+                error = RequestValidationError(e.errors())
+            if error is not None:
+                # Raised outside the handler, so the decoder frames (and their spool views) are freed
+                raise error
+            result = _record_update(
+                session, job_id, payload, encoded, lambda upd: model_store.attach_update_blob(upd, encoded, digest, size)
+            )
+        finally:
+            # Drop the views into the spool before unmapping it (the result holds none)
+            arrays = encoded = None
+            spool.close()
+        # Only now move the spool file into the blob store, so a rejected update can be committed again
+        get_blob_store().put_file(path, digest=digest)
+        upload.status = "committed"
+        upload.updated_at = datetime.utcnow()
+    aggregation_worker.enqueue(job_id)
+    return result
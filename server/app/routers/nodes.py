@@ -248,7 +248,7 @@ def control_node(machine_id: int, control: NodeControlRequest, _auth: dict = Dep
 
         # Forward control command to worker if endpoint available
         forward_result: Dict | None = None
-        if node.endpoint and control.action in {"start", "stop", "restart", "terminate"}:
+        if node.endpoint and control.action in {"start", "stop", "restart", "terminate", "invalidate_data"}:
             headers = {}
             if settings.worker_control_key:
                 headers["X-Control-Key"] = settings.worker_control_key
@@ -1,12 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends
 import logging
+from typing import List, Optional
 from pydantic import BaseModel
 from sqlalchemy import select
 import requests
 from ..db import get_session
 from ..models import ClusterNode, Job
+from ..schemas import FlowerServerStatus, WorkerTaskReport, WorkerTaskStatus
 from ..security import require_auth
-from ..services.flower_server import start_flower_server, is_flower_running
+from ..services import aggregator
+from ..services.flower_supervisor import FlowerCapacityError, list_servers, start_flower_server
+from ..services.worker_tasks import cancel as cancel_worker_task
+from ..services.worker_tasks import dispatch_train, list_tasks, record_report
+from ..services.worker_tasks import refresh as refresh_tasks
 
 router = APIRouter(prefix="/round", tags=["training"])
 logger = logging.getLogger(__name__)
@@ -23,33 +29,86 @@ def start_round(job_id: int, payload: RoundStartRequest, _auth: dict = Depends(r
     if not nodes:
         raise HTTPException(status_code=400, detail="No cluster nodes assigned for this job")
 
-    # Mark job as running
+    # Mark job as running and open a new FedAvg round
     try:
         with get_session() as session:
             job = session.get(Job, job_id)
             if job:
                 job.status = "running"
+                job.current_round = (job.current_round or 0) + 1
     except Exception:
         pass
 
+    # Workers queue the round and answer with a task id; completion comes back via /tasks/report
     results: list[dict] = []
+    with get_session() as session:
+        job = session.get(Job, job_id)
+        round_no = job.current_round if job else None
+    if round_no:
+        # The previous round is closed: its running sum is no longer needed in memory
+        aggregator.close_round(job_id, round_no - 1)
     for ep in nodes:
-        url = f"http://{ep}/task/train"
-        try:
-            logger.info("round.start: calling worker", extra={"job_id": job_id, "endpoint": ep, "timeout_s": payload.timeout_s, "steps": payload.steps})
-            r = requests.post(url, json={"job_id": job_id, "steps": payload.steps}, timeout=payload.timeout_s)
-            ok = r.status_code == 200
-            body = r.json() if ok else r.text
-            results.append({"endpoint": ep, "status": r.status_code, "ok": ok, "body": body})
-            logger.info("round.start: worker response", extra={"job_id": job_id, "endpoint": ep, "status": r.status_code, "ok": ok})
-        except Exception as e:
-            results.append({"endpoint": ep, "error": str(e)})
-            logger.warning("round.start: worker call failed", extra={"job_id": job_id, "endpoint": ep, "error": str(e)})
+        logger.info("round.start: queueing on worker", extra={"job_id": job_id, "endpoint": ep, "timeout_s": payload.timeout_s, "steps": payload.steps})
+        # One transaction per worker, so its row is committed before the round can finish
+        with get_session() as session:
+            item = dispatch_train(session, job_id, ep, payload.steps, round_no, timeout=payload.timeout_s)
+        results.append(item)
+        if item.get("ok"):
+            logger.info("round.start: worker queued", extra={"job_id": job_id, "endpoint": ep, "task_id": item.get("task_id")})
+        else:
+            logger.warning("round.start: worker call failed", extra={"job_id": job_id, "endpoint": ep, "error": item.get("error") or item.get("status")})
 
     any_ok = any(item.get("ok") for item in results)
     if not any_ok:
         raise HTTPException(status_code=502, detail={"message": "All worker calls failed", "results": results})
-    return {"job_id": job_id, "results": results}
+    return {"job_id": job_id, "round": round_no, "results": results}
+
+
+def _task_status(row) -> WorkerTaskStatus:
+    return WorkerTaskStatus(
+        job_id=row.job_id,
+        endpoint=row.endpoint,
+        task_id=row.task_id,
+        kind=row.kind or "train",
+        round=row.round,
+        status=row.status or "queued",
+        progress=row.progress or {},
+        result=row.result,
+        error=row.error,
+        created_at=row.created_at,
+        updated_at=row.updated_at,
+        finished_at=row.finished_at,
+    )
+
+
+@router.post("/{job_id}/tasks/report", response_model=WorkerTaskStatus)
+def report_task(job_id: int, report: WorkerTaskReport, _auth: dict = Depends(require_auth(["job:update"]))):
+    """Completion callback from a worker's task queue."""
+    with get_session() as session:
+        return _task_status(record_report(session, job_id, report.model_dump()))
+
+
+@router.get("/{job_id}/tasks", response_model=List[WorkerTaskStatus])
+def job_tasks(job_id: int, round: Optional[int] = None, refresh: bool = False, _auth: dict = Depends(require_auth(["job:read"]))):
+    """Tasks dispatched for the job, newest first; ``refresh`` polls workers for unfinished ones."""
+    with get_session() as session:
+        rows = list_tasks(session, job_id, round_no=round)
+        if refresh:
+            refresh_tasks(session, rows)
+        return [_task_status(row) for row in rows]
+
+
+@router.post("/{job_id}/tasks/{task_id}/cancel", response_model=WorkerTaskStatus)
+def cancel_task(job_id: int, task_id: str, _auth: dict = Depends(require_auth(["round:start"]))):
+    with get_session() as session:
+        row = next((r for r in list_tasks(session, job_id) if r.task_id == task_id), None)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Unknown task")
+        try:
+            cancel_worker_task(row)
+        except requests.RequestException as e:
+            raise HTTPException(status_code=502, detail=f"Worker cancel failed: {e}")
+        return _task_status(row)
 
 
 class PushHfRequest(BaseModel):
@@ -90,7 +149,7 @@ def push_hf(job_id: int, payload: PushHfRequest = PushHfRequest(), _auth: dict =
 
 class FlowerStartRequest(BaseModel):
     server_host: str = "0.0.0.0"
-    server_port: int = 8089
+    server_port: Optional[int] = None  # allocated from FLOWER_PORT_RANGE when not given
     rounds: int = 1
     steps: int = 1
     client_timeout_s: int = 20
@@ -110,7 +169,10 @@ def start_flower(job_id: int, payload: FlowerStartRequest, _auth: dict = Depends
     client_host = (
         "server" if payload.server_host in ("0.0.0.0", "127.0.0.1", "localhost") else payload.server_host
     )
-    srv = start_flower_server(job_id=job_id, host=bind_host, port=payload.server_port, rounds=payload.rounds)
+    try:
+        srv = start_flower_server(job_id=job_id, host=bind_host, port=payload.server_port, rounds=payload.rounds)
+    except FlowerCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     # Mark job as running
     try:
@@ -123,7 +185,7 @@ def start_flower(job_id: int, payload: FlowerStartRequest, _auth: dict = Depends
 
     # Instruct each node to start Flower client
     results: list[dict] = []
-    address = f"{client_host}:{payload.server_port}"
+    address = f"{client_host}:{srv['port']}"
     for ep in nodes:
         url = f"http://{ep}/task/flower/start"
         try:
@@ -140,3 +202,28 @@ def start_flower(job_id: int, payload: FlowerStartRequest, _auth: dict = Depends
     if not any_ok:
         raise HTTPException(status_code=502, detail={"message": "All Flower client starts failed", "results": results})
     return {"job_id": job_id, "server": srv, "results": results}
+
+
+@router.get("/flower/servers", response_model=List[FlowerServerStatus])
+def flower_servers(job_id: Optional[int] = None, active: bool = False, _auth: dict = Depends(require_auth(["job:read"]))):
+    """Flower servers across all replicas, newest first, with per-round timings and live client counts."""
+    with get_session() as session:
+        return [
+            FlowerServerStatus(
+                server_id=row.id,
+                job_id=row.job_id,
+                node=row.node,
+                host=row.host,
+                port=row.port,
+                status=row.status or "starting",
+                rounds=row.rounds or 0,
+                current_round=row.current_round or 0,
+                clients=row.clients or 0,
+                round_timings=row.round_timings or [],
+                started_at=row.started_at,
+                updated_at=row.updated_at,
+                finished_at=row.finished_at,
+                error=row.error,
+            )
+            for row in list_servers(session, job_id=job_id, active_only=active)
+        ]
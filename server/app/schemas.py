@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import Any, List, Optional, Dict
 from datetime import datetime
 
 class CreateJobRequest(BaseModel):
@@ -11,6 +11,10 @@ class CreateJobRequest(BaseModel):
     huggingface_dataset_id: Optional[str] = None
     huggingface_token: Optional[str] = None  # plaintext from requester; will be encrypted server-side
     hf_private: bool = True
+    update_codec: str = "fp32"  # fp32 | fp16 | int8 | topk (int8/topk = delta against the downloaded model)
+    aggregation_mode: str = "sync"  # sync | async (buffered, staleness-weighted)
+    buffer_size: int = 4
+    server_lr: float = 1.0
 
 class CreateJobResponse(BaseModel):
     job_id: int
@@ -18,12 +22,20 @@ class CreateJobResponse(BaseModel):
 class ModelResponse(BaseModel):
     job_id: int
     weights: List[List[float]]
+    version: int = 0
+    digest: Optional[str] = None  # base_digest for int8 delta updates
+    update_codec: str = "fp32"
 
 class JobStatusResponse(BaseModel):
     job_id: int
     status: str
     flower_running: bool
     has_model: bool
+    round: int = 0
+    aggregation_mode: str = "sync"
+    buffered: int = 0  # async: updates waiting for the next buffer flush
+    aggregation_lag: int = 0  # submitted updates the aggregation worker has not folded yet
+    aggregation_lag_seconds: float = 0.0  # age of the oldest of them
 
 class HfMetaResponse(BaseModel):
     job_id: int
@@ -31,12 +43,72 @@ class HfMetaResponse(BaseModel):
     huggingface_dataset_id: Optional[str] = None
     token_enc_b64: Optional[str] = None
     hf_private: Optional[bool] = True
+    update_codec: str = "fp32"
 
 class UpdateRequest(BaseModel):
     weights: Optional[List[List[float]]] = None
     val_accuracy: float
+    num_examples: Optional[int] = None  # samples trained on; FedAvg weight (defaults to 1)
+    base_version: Optional[int] = None  # model version trained from; staleness in async jobs
     contributor: Optional[str] = None
 
+class UploadCreateRequest(BaseModel):
+    size: int  # total body size in bytes
+    sha256: Optional[str] = None  # digest of the whole body, checked on commit
+
+class UploadStatusResponse(BaseModel):
+    upload_id: str
+    size: int
+    received: List[List[int]]  # [start, end) ranges stored so far
+    chunk_size: int
+    status: str
+
+class FlowerRoundTiming(BaseModel):
+    round: int
+    seconds: float
+    clients: int = 0
+    results: int = 0
+    failures: int = 0
+
+class FlowerServerStatus(BaseModel):
+    server_id: int
+    job_id: int
+    node: str
+    host: str
+    port: int
+    status: str
+    rounds: int
+    current_round: int = 0
+    clients: int = 0
+    round_timings: List[FlowerRoundTiming] = []
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class WorkerTaskReport(BaseModel):
+    """Body of a worker's task callback (the worker's view of the task)."""
+    task_id: str
+    status: str
+    kind: str = "train"
+    progress: Dict[str, Any] = {}
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class WorkerTaskStatus(BaseModel):
+    job_id: int
+    endpoint: str
+    task_id: str
+    kind: str
+    round: Optional[int] = None
+    status: str
+    progress: Dict[str, Any] = {}
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 class ClusterResponse(BaseModel):
     job_id: int
     nodes: List[str]
@@ -118,7 +190,7 @@ class NodeHeartbeatRequest(BaseModel):
     metadata_: Optional[Dict] = None
 
 class NodeControlRequest(BaseModel):
-    action: str  # restart, stop, terminate
+    action: str  # restart, stop, terminate, invalidate_data (params: {"kind": "mnist" | "fake_mnist" | "text"})
     params: Optional[Dict] = None
 
 # Dataset Schemas
@@ -0,0 +1,175 @@
+"""Background aggregation worker.
+
+``submit_update`` only stores the weights, inserts the ``Update`` row and enqueues
+the job id, so a submission is acknowledged as soon as it is durable. This worker
+drains the queue and calls ``aggregator.aggregate_pending`` for each job, which
+folds the job's unaggregated updates and publishes new artifact versions.
+
+The queue is an in-process stand-in by default (``AGGREGATION_QUEUE=local``), or a
+Redis stream with a consumer group (``AGGREGATION_QUEUE=redis``) so the work is
+shared by every orchestrator process. ``Update.aggregated_at`` is the source of
+truth: a periodic sweep re-enqueues jobs that still have unaggregated updates, so a
+lost message or a restart only delays aggregation. Between drains the worker also
+runs compaction (see compaction) every ``COMPACTION_INTERVAL_SECONDS``, and each
+sweep releases the in-memory sums of finished and idle jobs.
+"""
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import redis
+
+from ..config import settings
+from ..db import get_session
+from . import aggregator, compaction
+
+_GROUP = "aggregators"
+
+
+class AggregationWorker:
+    def __init__(self):
+        self._stop = False
+        self._thread: threading.Thread | None = None
+        self._logger = logging.getLogger("quackmesh.aggregation")
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._queued: set[int] = set()
+        self._queued_lock = threading.Lock()
+        self._redis: Optional[redis.Redis] = None
+        self._consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._last_sweep = 0.0
+        self._last_compaction = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        if settings.aggregation_queue == "redis":
+            self._redis = redis.Redis.from_url(settings.redis_url)
+            try:
+                self._redis.xgroup_create(settings.aggregation_stream, _GROUP, id="0", mkstream=True)
+            except redis.ResponseError:
+                pass  # group already exists
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        # thread is daemon; no join needed on shutdown
+
+    def enqueue(self, job_id: int) -> None:
+        """Ask for ``job_id``'s pending updates to be aggregated (call after the submission commits)."""
+        if self._redis is not None:
+            try:
+                self._redis.xadd(settings.aggregation_stream, {"job_id": str(job_id)}, maxlen=100000, approximate=True)
+                return
+            except redis.RedisError:
+                self._logger.warning("aggregation.enqueue.redis_failed", exc_info=True)
+        self._enqueue_local(job_id)
+
+    def _enqueue_local(self, job_id: int) -> None:
+        with self._queued_lock:
+            if job_id in self._queued:
+                return  # one drain covers every update queued so far
+            self._queued.add(job_id)
+        self._queue.put(job_id)
+
+    def _next_jobs(self, timeout: float) -> Tuple[List[int], List[bytes]]:
+        """Job ids to drain (deduplicated) and the stream message ids to ack afterwards."""
+        if self._redis is not None:
+            try:
+                resp = self._redis.xreadgroup(
+                    _GROUP, self._consumer, {settings.aggregation_stream: ">"}, count=256, block=int(timeout * 1000)
+                )
+            except redis.RedisError:
+                self._logger.warning("aggregation.read.redis_failed", exc_info=True)
+                resp = []
+            jobs: List[int] = []
+            acks: List[bytes] = []
+            for _stream, messages in resp or []:
+                for msg_id, fields in messages:
+                    acks.append(msg_id)
+                    try:
+                        job_id = int(fields.get(b"job_id") or fields.get("job_id"))
+                    except (TypeError, ValueError):
+                        continue
+                    if job_id not in jobs:
+                        jobs.append(job_id)
+            # Submissions that fell back to the local queue
+            jobs += [j for j in self._drain_local(0.0) if j not in jobs]
+            return jobs, acks
+        return self._drain_local(timeout), []
+
+    def _drain_local(self, timeout: float) -> List[int]:
+        jobs: List[int] = []
+        try:
+            jobs.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            while True:
+                jobs.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        with self._queued_lock:
+            self._queued.difference_update(jobs)
+        return jobs
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < settings.aggregation_sweep_seconds:
+            return
+        self._last_sweep = now
+        with get_session() as session:
+            job_ids = aggregator.jobs_with_pending(session)
+            aggregator.release_idle(session, settings.aggregation_idle_seconds)
+        for job_id in job_ids:
+            self._enqueue_local(job_id)
+
+    def _maybe_compact(self) -> None:
+        interval = settings.compaction_interval_seconds
+        now = time.monotonic()
+        if interval <= 0 or now - self._last_compaction < interval:
+            return
+        self._last_compaction = now
+        with get_session() as session:
+            compaction.compact(session)
+
+    def drain_job(self, job_id: int) -> int:
+        """Aggregate everything pending for ``job_id``, batch by batch. Returns the number of updates."""
+        total = 0
+        limit = max(1, settings.aggregation_batch_size)
+        while True:
+            with get_session() as session:
+                n = aggregator.aggregate_pending(session, job_id, limit=limit)
+            total += n
+            if n < limit:
+                return total
+
+    def _run(self):
+        while not self._stop:
+            try:
+                self._sweep()
+                jobs, acks = self._next_jobs(timeout=1.0)
+                for job_id in jobs:
+                    start = time.perf_counter()
+                    try:
+                        n = self.drain_job(job_id)
+                    except Exception:
+                        # Rows stay unaggregated; the next sweep retries them
+                        self._logger.exception("aggregation.job.failed", extra={"job_id": job_id})
+                        continue
+                    if n:
+                        self._logger.info(
+                            "aggregation.job.drained",
+                            extra={"job_id": job_id, "updates": n, "seconds": round(time.perf_counter() - start, 3)},
+                        )
+                if acks and self._redis is not None:
+                    self._redis.xack(settings.aggregation_stream, _GROUP, *acks)
+                self._maybe_compact()
+            except Exception:
+                self._logger.exception("aggregation.worker.error")
+                time.sleep(1.0)
+
+
+worker = AggregationWorker()
@@ -0,0 +1,422 @@
+"""Incremental FedAvg: fold each update into a per-job, per-round running sum.
+
+Each submission costs O(model) instead of re-averaging every stored update, and
+updates are weighted by the number of examples the client trained on.
+Accumulators live in process memory; when a process starts fresh (restart, another
+gunicorn worker handled earlier submissions) it catches up from the round's
+``Update`` rows before folding the new one. Folding runs in the background
+aggregation worker (see aggregation_worker), not in the submitting request.
+A job's in-memory state is dropped when its round closes, when it finishes, and
+after ``AGGREGATION_IDLE_SECONDS`` without updates (see ``release_idle``).
+
+Jobs in ``async`` aggregation mode use FedBuff instead of rounds: each update's
+delta from the model version it trained on goes into a per-job buffer, discounted
+by its staleness, and every ``buffer_size`` arrivals the buffered mean delta is
+applied to the global model.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func, select, update as sql_update
+from sqlalchemy.orm import Session
+
+from ..models import Job, ModelArtifact, Update
+from . import model_store
+from .fedavg import FedAvgEngine, LayerLayout
+from .parallel_fedavg import create_engine
+from .update_codec import EncodedUpdate
+
+logger = logging.getLogger("quackmesh.aggregator")
+
+
+class RoundAccumulator:
+    """Sample-weighted running sum of the updates submitted for one job round."""
+
+    def __init__(self, job_id: int, round_no: int):
+        self.job_id = job_id
+        self.round = round_no
+        self.lock = threading.Lock()
+        self.engine: Optional[FedAvgEngine] = None
+        self.update_ids: Set[int] = set()
+        self.last_used = time.monotonic()
+        # Base models of delta-coded updates, by blob digest (mmap views)
+        self.bases: Dict[str, List[np.ndarray]] = {}
+
+    @property
+    def count(self) -> int:
+        return self.engine.count if self.engine else 0
+
+    @property
+    def total_weight(self) -> float:
+        return self.engine.total_weight if self.engine else 0.0
+
+    def fold(self, update_id: int, update: EncodedUpdate, weight: float = 1.0) -> None:
+        if update_id in self.update_ids:
+            return
+        base = None
+        if update.is_delta:
+            base = self.bases.get(update.base_digest)
+            if base is None:
+                base = self.bases[update.base_digest] = model_store.load_blob_layers(update.base_digest)
+        if self.engine is None:
+            self.engine = create_engine(LayerLayout(update.shapes))
+        update.fold_into(self.engine, weight, base=base)
+        self.update_ids.add(update_id)
+
+    def reset(self) -> None:
+        self.engine = None
+        self.update_ids = set()
+        self.bases = {}
+
+    def skip(self, update_id: int) -> None:
+        """Record an update without weights (e.g. HF metadata-only submissions)."""
+        self.update_ids.add(update_id)
+
+    def average(self) -> Optional[List[np.ndarray]]:
+        if self.engine is None or self.engine.total_weight <= 0:
+            return None
+        return self.engine.average_layers()
+
+
+def update_weight(num_examples: Optional[int]) -> float:
+    """FedAvg weight of an update: its sample count, or 1 when the client did not report one."""
+    return float(num_examples) if num_examples and num_examples > 0 else 1.0
+
+
+_accumulators: Dict[int, RoundAccumulator] = {}
+_registry_lock = threading.Lock()
+
+
+def get_accumulator(job_id: int, round_no: int) -> RoundAccumulator:
+    """Return the job's accumulator for ``round_no``; a newer round discards the previous sum."""
+    with _registry_lock:
+        acc = _accumulators.get(job_id)
+        if acc is None or acc.round < round_no:
+            acc = RoundAccumulator(job_id, round_no)
+            _accumulators[job_id] = acc
+        acc.last_used = time.monotonic()
+        return acc
+
+
+def _close(state) -> None:
+    # Wait for an in-flight fold, then free the engine (shared segments for the parallel one).
+    # The reset state rebuilds from rows if a caller that fetched it earlier still uses it.
+    with state.lock:
+        close = getattr(state.engine, "close", None)
+        if close is not None:
+            close()
+        state.reset()
+
+
+def discard(job_id: int) -> None:
+    """Drop the job's round sum and async buffer; both are rebuilt from ``Update`` rows if needed."""
+    with _registry_lock:
+        states = [_accumulators.pop(job_id, None), _buffers.pop(job_id, None)]
+    for state in states:
+        if state is not None:
+            _close(state)
+
+
+def close_round(job_id: int, round_no: int) -> None:
+    """Drop the job's round sum if it belongs to ``round_no`` or earlier (a newer round was opened)."""
+    with _registry_lock:
+        acc = _accumulators.get(job_id)
+        if acc is None or acc.round > round_no:
+            return
+        del _accumulators[job_id]
+    _close(acc)
+
+
+def release_idle(session: Session, max_idle_seconds: float) -> int:
+    """Drop in-memory state of finished or missing jobs and of jobs idle for ``max_idle_seconds``.
+
+    Returns the number of jobs released.
+    """
+    with _registry_lock:
+        job_ids = set(_accumulators) | set(_buffers)
+        now = time.monotonic()
+        idle = {
+            job_id
+            for job_id in job_ids
+            if all(
+                now - state.last_used >= max_idle_seconds
+                for state in (_accumulators.get(job_id), _buffers.get(job_id))
+                if state is not None
+            )
+        }
+    if not job_ids:
+        return 0
+    active = set(
+        session.execute(
+            select(Job.id).where(Job.id.in_(job_ids), Job.status.notin_(("completed", "failed", "cancelled")))
+        ).scalars().all()
+    )
+    released = (job_ids - active) | idle
+    for job_id in released:
+        discard(job_id)
+    if released:
+        logger.info("aggregator.release", extra={"jobs": sorted(released)})
+    return len(released)
+
+
+def fold_update(session: Session, job_id: int, round_no: int, update: Update, encoded: Optional[EncodedUpdate]) -> Optional[RoundAccumulator]:
+    """Fold ``update`` (already flushed) into the round's sum; returns that accumulator.
+
+    Updates of the same round persisted elsewhere are folded first so every process
+    converges on the same result. Returns None if the job already moved to a newer
+    round. Averaging is left to the caller, once per batch (see ``round_average``).
+    """
+    acc = get_accumulator(job_id, round_no)
+    with acc.lock:
+        if acc.round != round_no:
+            # A concurrent submission already moved the job to a newer round
+            return None
+        known = acc.update_ids | {update.id}
+        # Catch up on what the aggregation worker already folded elsewhere; pending rows come in order
+        ids = session.execute(
+            select(Update.id).where(
+                Update.job_id == job_id,
+                Update.round == round_no,
+                Update.aggregated_at.isnot(None),
+                Update.aggregation_error.is_(None),
+            )
+        ).scalars().all()
+        missing = [i for i in ids if i not in known]
+        for upd_id in missing:
+            row = session.get(Update, upd_id)
+            if model_store.has_weights(row):
+                acc.fold(row.id, model_store.load_update(row), update_weight(row.num_examples))
+            else:
+                acc.skip(upd_id)
+        if encoded is not None:
+            acc.fold(update.id, encoded, update_weight(update.num_examples))
+        else:
+            acc.skip(update.id)
+        return acc
+
+
+def round_average(acc: RoundAccumulator) -> Optional[List[np.ndarray]]:
+    """Current average of ``acc``, or None if the round has no weighted updates."""
+    with acc.lock:
+        return acc.average()
+
+
+def staleness_weight(staleness: int) -> float:
+    """FedBuff discount of an update trained ``staleness`` versions behind the current model."""
+    return 1.0 / math.sqrt(1.0 + max(0, staleness))
+
+
+class UpdateBuffer:
+    """Staleness-weighted sum of the deltas of async updates not yet applied to the global model."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.engine: Optional[FedAvgEngine] = None
+        self.update_ids: Set[int] = set()
+        self.sample_weight = 0.0  # sum of undiscounted update weights
+        self.bases: Dict[str, List[np.ndarray]] = {}
+        self.last_used = time.monotonic()
+
+    @property
+    def count(self) -> int:
+        return len(self.update_ids)
+
+    def reset(self) -> None:
+        self.engine = None
+        self.update_ids = set()
+        self.sample_weight = 0.0
+        self.bases = {}
+
+    def _base(self, digest: str) -> List[np.ndarray]:
+        base = self.bases.get(digest)
+        if base is None:
+            base = self.bases[digest] = model_store.load_blob_layers(digest)
+        return base
+
+    def fold(self, session: Session, row: Update, encoded: EncodedUpdate, current_version: int) -> None:
+        if row.id in self.update_ids:
+            return
+        base_version = row.base_version if row.base_version is not None else current_version
+        base = base_digest = None
+        if not encoded.is_delta:
+            # Dense weights: the delta is taken against the version the client trained from
+            base_digest = model_store.version_digest(session, self.job_id, base_version)
+            if base_digest is None:
+                raise model_store.BaseModelUnavailable(f"version {base_version}")
+            base = self._base(base_digest)
+        weight = update_weight(row.num_examples)
+        if self.engine is None:
+            self.engine = create_engine(LayerLayout(encoded.shapes))
+        encoded.fold_delta_into(self.engine, weight * staleness_weight(current_version - base_version), base=base, base_key=base_digest)
+        self.update_ids.add(row.id)
+        self.sample_weight += weight
+
+    def apply(self, current: List[np.ndarray], server_lr: float) -> List[np.ndarray]:
+        """``current + server_lr * mean delta``; staleness discounts are not renormalized away."""
+        scale = server_lr * self.engine.total_weight / self.sample_weight
+        delta = self.engine.average()
+        out = np.concatenate([np.asarray(layer, dtype=np.float32).reshape(-1) for layer in current])
+        if out.size != delta.size:
+            raise ValueError("Update shape does not match the global model")
+        out += scale * delta
+        return self.engine.layout.split(out)
+
+
+_buffers: Dict[int, UpdateBuffer] = {}
+
+
+def get_buffer(job_id: int) -> UpdateBuffer:
+    with _registry_lock:
+        buf = _buffers.get(job_id)
+        if buf is None:
+            buf = _buffers[job_id] = UpdateBuffer(job_id)
+        buf.last_used = time.monotonic()
+        return buf
+
+
+def buffer_update(session: Session, job: Job, artifact: ModelArtifact, update: Update, encoded: Optional[EncodedUpdate]) -> Optional[List[np.ndarray]]:
+    """Add an async update (already flushed) to the job's buffer; return the new global model on flush.
+
+    The caller holds the artifact row lock. Updates applied by another process are
+    detected through ``folded_version`` and the buffer is rebuilt from pending rows.
+    """
+    buf = get_buffer(job.id)
+    current_version = artifact.version or 0
+    if encoded is not None and not encoded.is_delta and not model_store.has_weights(artifact):
+        # No global model yet: the first dense update seeds it
+        update.folded_version = current_version + 1
+        return encoded.dense()
+    with buf.lock:
+        pending = session.execute(
+            select(Update.id).where(
+                Update.job_id == job.id,
+                Update.folded_version.is_(None),
+                Update.aggregated_at.isnot(None),
+                Update.id != update.id,
+            )
+        ).scalars().all()
+        if not buf.update_ids <= set(pending):
+            buf.reset()
+        for upd_id in pending:
+            if upd_id in buf.update_ids:
+                continue
+            row = session.get(Update, upd_id)
+            if not model_store.has_weights(row):
+                row.folded_version = current_version
+                continue
+            try:
+                buf.fold(session, row, model_store.load_update(row), current_version)
+            except (model_store.BaseModelUnavailable, ValueError) as e:
+                # Its base left the version ring since it was first buffered: drop it for good
+                # instead of failing every later update of the job on the same row
+                logger.warning("aggregation.update.rejected", extra={"job_id": job.id, "update_id": row.id, "error": str(e)})
+                row.aggregation_error = str(e)[:500] or type(e).__name__
+                row.folded_version = current_version
+        if encoded is not None:
+            buf.fold(session, update, encoded, current_version)
+        else:
+            # Nothing to buffer (e.g. HF metadata-only submission)
+            update.folded_version = current_version
+        if buf.count < max(1, job.buffer_size or 1) or buf.engine is None:
+            return None
+        new_weights = buf.apply(model_store.load_weights(artifact), job.server_lr if job.server_lr is not None else 1.0)
+        session.execute(
+            sql_update(Update).where(Update.id.in_(buf.update_ids)).values(folded_version=current_version + 1)
+        )
+        buf.reset()
+        return new_weights
+
+
+def pending_count(session: Session, job_id: int) -> int:
+    """Async updates waiting for the job's next buffer flush."""
+    return session.execute(
+        select(func.count(Update.id)).where(
+            Update.job_id == job_id, Update.folded_version.is_(None), Update.aggregated_at.isnot(None)
+        )
+    ).scalar_one()
+
+
+def aggregate_pending(session: Session, job_id: int, limit: Optional[int] = None) -> int:
+    """Fold the job's not yet aggregated updates in arrival order and publish the result.
+
+    Holds the artifact row lock for the whole batch. Sync jobs publish one new version
+    per batch, async jobs one per buffer flush; either way ``folded_version`` records
+    the version an update first went into, and ``norm`` the size of its delta. An update that cannot be folded is
+    marked with ``aggregation_error`` instead of blocking the ones behind it.
+    Returns the number of updates processed.
+    """
+    job = session.get(Job, job_id)
+    if job is None:
+        return 0
+    artifact = model_store.get_artifact(session, job_id, for_update=True)
+    stmt = select(Update).where(Update.job_id == job_id, Update.aggregated_at.is_(None)).order_by(Update.id)
+    if limit:
+        stmt = stmt.limit(limit)
+    rows = session.execute(stmt).scalars().all()
+    acc: Optional[RoundAccumulator] = None
+    folded: List[Update] = []
+    for row in rows:
+        try:
+            encoded = model_store.load_update(row) if model_store.has_weights(row) else None
+            if encoded is not None:
+                row.norm = _update_norm(session, job_id, row, encoded)
+            if job.aggregation_mode == "async":
+                flushed = buffer_update(session, job, artifact, row, encoded)
+                if flushed is not None:
+                    model_store.save_artifact(session, job_id, flushed, artifact=artifact)
+            else:
+                row_acc = fold_update(session, job_id, row.round or 0, row, encoded)
+                if row_acc is not None:
+                    acc = row_acc
+                    folded.append(row)
+        except (model_store.BaseModelUnavailable, ValueError) as e:
+            logger.warning("aggregation.update.rejected", extra={"job_id": job_id, "update_id": row.id, "error": str(e)})
+            row.aggregation_error = str(e)[:500] or type(e).__name__
+            if job.aggregation_mode == "async" and row.folded_version is None:
+                row.folded_version = artifact.version or 0
+        row.aggregated_at = datetime.utcnow()
+        session.flush()
+    # One model-sized average per batch, of the newest round folded into
+    new_weights = round_average(acc) if acc is not None else None
+    if new_weights is not None:
+        model_store.save_artifact(session, job_id, new_weights, artifact=artifact)
+        for row in folded:
+            row.folded_version = artifact.version
+    return len(rows)
+
+
+def _update_norm(session: Session, job_id: int, row: Update, encoded: EncodedUpdate) -> Optional[float]:
+    """Norm of the update's delta; dense updates need the version they trained from to still be stored."""
+    base = None
+    if not encoded.is_delta:
+        digest = model_store.version_digest(session, job_id, row.base_version) if row.base_version is not None else None
+        if digest is None:
+            return None
+        try:
+            base = model_store.load_blob_layers(digest)
+        except model_store.BaseModelUnavailable:
+            return None
+        if len(base) != len(encoded.layers) or any(b.size != layer.size for b, layer in zip(base, encoded.layers)):
+            return None
+    return encoded.delta_norm(base)
+
+
+def aggregation_lag(session: Session, job_id: int) -> Tuple[int, float]:
+    """(updates not yet aggregated, age in seconds of the oldest one)."""
+    count, oldest = session.execute(
+        select(func.count(Update.id), func.min(Update.created_at)).where(
+            Update.job_id == job_id, Update.aggregated_at.is_(None)
+        )
+    ).one()
+    age = (datetime.utcnow() - oldest).total_seconds() if count and oldest else 0.0
+    return int(count or 0), max(0.0, age)
+
+
+def jobs_with_pending(session: Session) -> List[int]:
+    return list(session.execute(select(Update.job_id).where(Update.aggregated_at.is_(None)).distinct()).scalars().all())
@@ -0,0 +1,137 @@
+"""Content-addressed blob storage for model weights.
+
+Blobs are keyed by the SHA-256 of their bytes. Only a local filesystem backend exists
+today; ``get_blob_store()`` is the single place a different backend would be selected.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from ..config import settings
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class LocalBlobStore:
+    """Stores blobs under ``root/<aa>/<bb>/<sha256>``; writes are atomic renames."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, chunks: Union[BytesLike, Iterable[BytesLike]]) -> Tuple[str, int]:
+        """Write a blob from bytes or an iterable of byte chunks. Returns (digest, size)."""
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            chunks = [chunks]
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(prefix=".put-", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(memoryview(chunk).cast("B"))
+            digest = h.hexdigest()
+            dest = self.path(digest)
+            if os.path.exists(dest):
+                os.unlink(tmp)
+                _touch(dest)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(tmp, dest)
+            return digest, size
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def put_file(self, src: str, digest: Optional[str] = None) -> Tuple[str, int]:
+        """Move a file into the store (same filesystem). Returns (digest, size).
+
+        ``digest`` skips re-hashing when the caller already computed it with ``file_digest``.
+        """
+        if digest is None:
+            digest, size = file_digest(src)
+        else:
+            size = os.path.getsize(src)
+        dest = self.path(digest)
+        if os.path.exists(dest):
+            os.unlink(src)
+            _touch(dest)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(src, dest)
+        return digest, size
+
+    def open_mmap(self, digest: str) -> mmap.mmap:
+        """Map a blob read-only. The mapping stays valid after the file is closed."""
+        with open(self.path(digest), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        """(digest, mtime) of every stored blob; in-progress writes are skipped."""
+        for dirpath, _dirs, files in os.walk(self.root):
+            for name in files:
+                if len(name) != 64 or name.startswith("."):
+                    continue
+                try:
+                    yield name, os.stat(os.path.join(dirpath, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+
+    def delete(self, digest: str) -> bool:
+        try:
+            os.unlink(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def _touch(path: str) -> None:
+    # A re-put blob is referenced anew; refresh its age so garbage collection keeps it
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def file_digest(path: str) -> Tuple[str, int]:
+    """SHA-256 and size of a file, read in 1 MiB chunks."""
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+_store: Optional[LocalBlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> LocalBlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = (settings.blob_store_backend or "local").lower()
+            if backend != "local":
+                raise RuntimeError(f"Unsupported BLOB_STORE_BACKEND: {backend}")
+            _store = LocalBlobStore(settings.blob_store_dir)
+        return _store
@@ -0,0 +1,127 @@
+"""Compaction of folded updates and garbage collection of unreferenced blobs.
+
+Once an update is folded into a published model version (``folded_version``) and
+can no longer be needed to rebuild an aggregate, its weights are only history.
+After the retention window (``UPDATE_RETENTION_HOURS``) compaction deletes the
+payload and keeps the row's metadata: contributor, val_accuracy, num_examples,
+norm, round and versions. An update is prunable when
+
+- async job: it was applied to the model (or rejected);
+- sync job: its round is over (round catch-up only ever re-reads the current round),
+  or the job has finished, which also covers jobs that never left round 0.
+
+Blob garbage collection then deletes blobs no row references any more: not the job
+models, not the ring of recent versions kept for delta downloads and FedBuff, not a
+live update, and not the base model a live int8/top-k update was computed against
+(``Update.base_digest``).
+Blobs younger than ``BLOB_GC_GRACE_MINUTES`` are kept, since they may belong to a
+submission whose transaction has not committed yet.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Job, ModelArtifact, ModelVersion, Update
+from . import model_store
+from .blob_store import get_blob_store
+from .update_codec import CODEC_DTYPES, DELTA_CODECS
+
+logger = logging.getLogger("quackmesh.compaction")
+
+_BATCH = 1000
+_DELTA_DTYPES = tuple(CODEC_DTYPES[c] for c in DELTA_CODECS)
+# No more rounds: nothing re-reads a finished job's updates
+_FINISHED = ("completed", "failed", "cancelled")
+
+
+def prune_updates(session: Session, now: Optional[datetime] = None, limit: int = _BATCH) -> int:
+    """Drop the weights of folded updates older than the retention window. Returns rows pruned."""
+    if settings.update_retention_hours <= 0:
+        return 0
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=settings.update_retention_hours)
+    rows = session.execute(
+        select(Update)
+        .join(Job, Job.id == Update.job_id)
+        .where(
+            Update.pruned_at.is_(None),
+            Update.aggregated_at < cutoff,
+            or_(
+                Update.aggregation_error.isnot(None),
+                and_(Job.aggregation_mode == "async", Update.folded_version.isnot(None)),
+                and_(
+                    func.coalesce(Job.aggregation_mode, "sync") != "async",
+                    or_(Update.round < func.coalesce(Job.current_round, 0), Job.status.in_(_FINISHED)),
+                ),
+            ),
+        )
+        .order_by(Update.id)
+        .limit(limit)
+    ).scalars().all()
+    pruned_at = now or datetime.utcnow()
+    for row in rows:
+        row.weights = None
+        row.weights_digest = None
+        row.weights_nbytes = None
+        row.base_digest = None
+        row.pruned_at = pruned_at
+    return len(rows)
+
+
+def referenced_digests(session: Session) -> Set[str]:
+    """Every blob digest a row still needs."""
+    refs: Set[str] = set()
+    for stmt in (
+        select(ModelArtifact.weights_digest).where(ModelArtifact.weights_digest.isnot(None)),
+        select(ModelVersion.weights_digest),
+        select(Update.weights_digest).where(Update.weights_digest.isnot(None)),
+        select(Update.base_digest).where(Update.weights_digest.isnot(None), Update.base_digest.isnot(None)),
+    ):
+        refs.update(session.execute(stmt).scalars().all())
+    # Delta-coded rows stored before base_digest existed: read the blob header once and record it
+    legacy = session.execute(
+        select(Update).where(
+            Update.weights_digest.isnot(None), Update.base_digest.is_(None), Update.weights_dtype.in_(_DELTA_DTYPES)
+        )
+    ).scalars()
+    for row in legacy:
+        try:
+            row.base_digest = model_store.load_update(row).base_digest
+        except (FileNotFoundError, ValueError):
+            continue
+        if row.base_digest:
+            refs.add(row.base_digest)
+    return refs
+
+
+def collect_garbage(session: Session) -> int:
+    """Delete unreferenced blobs past the grace period. Returns blobs deleted."""
+    store = get_blob_store()
+    refs = referenced_digests(session)
+    cutoff = time.time() - settings.blob_gc_grace_minutes * 60
+    deleted = 0
+    for digest, mtime in list(store.iter_blobs()):
+        if digest in refs or mtime > cutoff:
+            continue
+        if store.delete(digest):
+            deleted += 1
+    return deleted
+
+
+def compact(session: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Prune every prunable update, then collect garbage blobs."""
+    pruned = 0
+    while True:
+        n = prune_updates(session, now=now)
+        session.flush()
+        pruned += n
+        if n < _BATCH:
+            break
+    deleted = collect_garbage(session)
+    if pruned or deleted:
+        logger.info("compaction.done", extra={"updates_pruned": pruned, "blobs_deleted": deleted})
+    return {"updates_pruned": pruned, "blobs_deleted": deleted}
@@ -3,10 +3,11 @@ import time
 import logging
 from .contracts import contracts
 from ..db import get_session
-from ..models import Job, ModelArtifact, ProviderMachine, ClusterNode
+from ..models import Job, ProviderMachine, ClusterNode
+from . import model_store
+from .worker_tasks import dispatch_train
 from ..config import settings
 from sqlalchemy import select
-import requests
 
 class EventListener:
     def __init__(self):
@@ -72,8 +73,7 @@ class EventListener:
                                         job = Job(id=chain_job_id, model_arch="from_chain", reward_pool_duck=reward_duck)
                                         session.add(job)
                                         session.flush()
-                                        artifact = ModelArtifact(job_id=job.id, weights=[])
-                                        session.add(artifact)
+                                        model_store.save_artifact(session, job.id, None)
                                         self._logger.info("Created orchestrator Job id=%s from chain event", chain_job_id)
                                     else:
                                         # Update reward if currently zero
@@ -116,12 +116,12 @@ class EventListener:
                                     except Exception:
                                         pass
                                     for ep in endpoints_assigned:
-                                        url = f"http://{ep}/task/train"
-                                        try:
-                                            rr = requests.post(url, json={"job_id": chain_job_id, "steps": steps}, timeout=20)
-                                            self._logger.info("Start round -> %s status=%s body=%s", url, rr.status_code, rr.text[:200])
-                                        except Exception as e:
-                                            self._logger.warning("Failed starting round on %s: %s", ep, e)
+                                        with get_session() as session:
+                                            item = dispatch_train(session, chain_job_id, ep, steps, None, timeout=20)
+                                        if item.get("ok"):
+                                            self._logger.info("Start round -> %s task=%s", ep, item.get("task_id"))
+                                        else:
+                                            self._logger.warning("Failed starting round on %s: %s", ep, item.get("error") or item.get("body"))
                         except Exception as e:
                             self._logger.exception("Error handling TrainingJobCreated event: %s", e)
                 time.sleep(5)
@@ -1,20 +1,205 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import numpy as np
 
-def fedavg(weight_sets: List[List[List[float]]]) -> List[List[float]]:
+
+class LayerLayout:
+    """Shapes of a model's layers and their slices within one stacked flat buffer."""
+
+    def __init__(self, shapes: Sequence[Tuple[int, ...]]):
+        self.shapes = [tuple(int(d) for d in s) for s in shapes]
+        self.slices: List[Tuple[int, int]] = []
+        offset = 0
+        for shape in self.shapes:
+            n = int(np.prod(shape, dtype=np.int64)) if shape else 1
+            self.slices.append((offset, offset + n))
+            offset += n
+        self.size = offset
+
+    @classmethod
+    def from_layers(cls, layers: Sequence[np.ndarray]) -> "LayerLayout":
+        return cls([np.shape(layer) for layer in layers])
+
+    def matches(self, layers: Sequence[np.ndarray]) -> bool:
+        return len(layers) == len(self.shapes) and all(
+            np.size(layer) == end - start for layer, (start, end) in zip(layers, self.slices)
+        )
+
+    def split(self, flat: np.ndarray) -> List[np.ndarray]:
+        """Per-layer views into a stacked flat buffer."""
+        return [flat[start:end].reshape(shape) for (start, end), shape in zip(self.slices, self.shapes)]
+
+
+class FedAvgEngine:
+    """Sample-weighted FedAvg over preallocated stacked buffers.
+
+    All layers live in one flat accumulator, so folding a client is a couple of
+    vectorized passes over the whole model with no per-client or per-layer
+    temporaries; a single scratch buffer is reused for the weighting step.
+
+    Delta-coded clients (int8, top-k) only add their delta to the sum; the base
+    model they were computed against is tallied per base and added once at
+    ``average()`` time, so a sparse client costs O(k) rather than O(model).
+    """
+
+    def __init__(self, layout: LayerLayout, accum_dtype=np.float64, buffer: Optional[np.ndarray] = None):
+        self.layout = layout
+        # ``buffer``: a zeroed accumulator owned by the caller (e.g. a shared-memory view)
+        self.sum = np.zeros(layout.size, dtype=accum_dtype) if buffer is None else buffer
+        self._scratch: Optional[np.ndarray] = None
+        self._total: Optional[np.ndarray] = None
+        # base key -> [base layers, summed client weight]
+        self._bases: Dict[Any, List[Any]] = {}
+        self.total_weight = 0.0
+        self.count = 0
+
+    def add(self, layers: Sequence[np.ndarray], weight: float = 1.0) -> None:
+        """Fold one client's layers (any float dtype, flat or shaped) into the sum."""
+        if not self.layout.matches(layers):
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        for (start, end), layer in zip(self.layout.slices, layers):
+            acc = self.sum[start:end]
+            src = np.asarray(layer).reshape(-1)
+            if weight != 1.0:
+                scratch = self._scratch_view(start, end)
+                np.multiply(src, weight, out=scratch)
+                src = scratch
+            np.add(acc, src, out=acc)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def add_flat(self, flat: np.ndarray, weight: float = 1.0) -> None:
+        """Fold a client whose layers are already stacked in one contiguous buffer."""
+        if np.size(flat) != self.layout.size:
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        src = np.asarray(flat).reshape(-1)
+        if weight != 1.0:
+            scratch = self._scratch_view(0, self.layout.size)
+            np.multiply(src, weight, out=scratch)
+            src = scratch
+        np.add(self.sum, src, out=self.sum)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def add_affine(
+        self,
+        codes: Sequence[np.ndarray],
+        scales: Sequence[float],
+        zeros: Sequence[float],
+        weight: float = 1.0,
+        base: Optional[Sequence[np.ndarray]] = None,
+        base_key: Any = None,
+    ) -> None:
+        """Fold an affine-quantized client (``base + q * scale + zero`` per layer).
+
+        Dequantization happens in the scratch buffer, so no float copy of the update is made.
+        """
+        if not self.layout.matches(codes):
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        if base is not None:
+            self.tally_base(base, weight, base_key)
+        for i, ((start, end), q) in enumerate(zip(self.layout.slices, codes)):
+            buf = self._scratch_view(start, end)
+            np.multiply(np.asarray(q).reshape(-1), float(scales[i]), out=buf)
+            np.add(buf, float(zeros[i]), out=buf)
+            if weight != 1.0:
+                np.multiply(buf, weight, out=buf)
+            acc = self.sum[start:end]
+            np.add(acc, buf, out=acc)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def add_sparse(
+        self,
+        indices: Sequence[np.ndarray],
+        values: Sequence[np.ndarray],
+        weight: float = 1.0,
+        base: Optional[Sequence[np.ndarray]] = None,
+        base_key: Any = None,
+    ) -> None:
+        """Fold a sparse client: per layer, flat ``indices`` and their delta ``values``.
+
+        Values are scattered straight into the accumulator; the update is never densified.
+        Repeated indices add up.
+        """
+        if len(indices) != len(self.layout.slices) or len(values) != len(indices):
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        for (start, end), idx, vals in zip(self.layout.slices, indices, values):
+            idx = np.asarray(idx).reshape(-1)
+            if idx.size != np.size(vals):
+                raise ValueError("Sparse update has mismatched indices and values")
+            if idx.size and (int(idx.min()) < 0 or int(idx.max()) >= end - start):
+                raise ValueError("Sparse update index out of range")
+        if base is not None:
+            self.tally_base(base, weight, base_key)
+        for (start, _), idx, vals in zip(self.layout.slices, indices, values):
+            if np.size(idx) == 0:
+                continue
+            pos = np.asarray(idx).reshape(-1).astype(np.intp, copy=False) + start
+            vals = np.asarray(vals).reshape(-1)
+            # Unbuffered: a fancy-index += would keep only one value per repeated index
+            np.add.at(self.sum, pos, vals * weight if weight != 1.0 else vals)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def tally_base(self, base: Sequence[np.ndarray], weight: float, key: Any = None) -> None:
+        """Add ``weight * base`` to the sum lazily (at ``average()`` time); weights may be negative."""
+        if not self.layout.matches(base):
+            raise ValueError("Base model shape does not match the aggregation layout")
+        entry = self._bases.setdefault(id(base) if key is None else key, [base, 0.0])
+        entry[1] += float(weight)
+
+    def _scratch_view(self, start: int, end: int) -> np.ndarray:
+        if self._scratch is None:
+            self._scratch = np.empty_like(self.sum)
+        return self._scratch[start:end]
+
+    def average(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Weighted mean as a stacked float32 buffer (written into ``out`` if given)."""
+        if self.total_weight <= 0:
+            raise ValueError("No updates aggregated")
+        if out is None:
+            out = np.empty(self.layout.size, dtype=np.float32)
+        total = self.sum
+        if self._bases:
+            if self._total is None:
+                self._total = np.empty_like(self.sum)
+            total = self._total
+            np.copyto(total, self.sum)
+            for base, weight in self._bases.values():
+                for (start, end), layer in zip(self.layout.slices, base):
+                    buf = self._scratch_view(start, end)
+                    np.multiply(np.asarray(layer).reshape(-1), weight, out=buf)
+                    np.add(total[start:end], buf, out=total[start:end])
+        np.divide(total, self.total_weight, out=out, casting="same_kind")
+        return out
+
+    def average_layers(self) -> List[np.ndarray]:
+        return self.layout.split(self.average())
+
+
+def fedavg(weight_sets: List[List[List[float]]], num_examples: Optional[Sequence[float]] = None) -> List[List[float]]:
     """
     Average a list of model weight sets.
-    Each weight set is a list of tensors, represented as lists of floats.
+    Each weight set is a list of tensors, represented as lists of floats or arrays.
+    When num_examples is given, clients are weighted by their sample counts.
     Returns a single weight set of the same shape.
     """
     if not weight_sets:
         raise ValueError("No weight sets provided")
+    if num_examples is not None and len(num_examples) != len(weight_sets):
+        raise ValueError("num_examples must have one entry per weight set")
 
-    num_clients = len(weight_sets)
-    # Assume all have same shapes
-    averaged: List[List[float]] = []
-    for layer_idx in range(len(weight_sets[0])):
-        layer_arrays = [np.array(ws[layer_idx], dtype=np.float32) for ws in weight_sets]
-        layer_avg = np.mean(layer_arrays, axis=0)
-        averaged.append(layer_avg.tolist())
-    return averaged
+    first = [np.asarray(w, dtype=np.float32) for w in weight_sets[0]]
+    engine = FedAvgEngine(LayerLayout.from_layers(first))
+    for i, ws in enumerate(weight_sets):
+        layers = first if i == 0 else [np.asarray(w, dtype=np.float32) for w in ws]
+        engine.add(layers, float(num_examples[i]) if num_examples is not None else 1.0)
+    return [layer.tolist() for layer in engine.average_layers()]
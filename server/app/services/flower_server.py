@@ -1,33 +1,53 @@
 import os
+import json
 import threading
-import multiprocessing as mp
+import time
 import logging
-from typing import List, Optional, Dict, Any
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Sequence
 
 import numpy as np
 import flwr as fl
 
+from ..config import settings
 from ..db import get_session
-from ..models import ModelArtifact, Job
+from ..models import FlowerServer, Job
+from . import model_store
+from .fedavg import FedAvgEngine, LayerLayout
+from .update_codec import from_tensors
 
 logger = logging.getLogger("quackmesh.flower")
 
-# In-memory registry of running Flower servers by job_id
-_running_servers: Dict[int, mp.Process] = {}
+_MAX_TIMINGS = 200  # round timings kept per server
 
 
-def _to_parameters(weights: List[List[float]]) -> fl.common.Parameters:
-    nds = [np.array(w, dtype=np.float32) for w in weights]
-    return fl.common.ndarrays_to_parameters(nds)
+def _to_parameters(layers: Sequence[np.ndarray]) -> fl.common.Parameters:
+    """Flower parameters serialized straight from float32 arrays (no list round-trip)."""
+    return fl.common.ndarrays_to_parameters([np.asarray(layer, dtype=np.float32) for layer in layers])
 
 
-def _from_parameters(params: fl.common.Parameters) -> List[List[float]]:
-    nds = fl.common.parameters_to_ndarrays(params)
-    return [nd.astype(np.float32).ravel().tolist() for nd in nds]
+def _from_parameters(params: fl.common.Parameters) -> List[np.ndarray]:
+    return [nd.astype(np.float32, copy=False) for nd in fl.common.parameters_to_ndarrays(params)]
+
+
+def _load_layers(art) -> List[np.ndarray]:
+    """The artifact's layers in the shapes they were stored with (mmap views)."""
+    weights = model_store.load_weights(art) if model_store.has_weights(art) else []
+    shapes = art.weights_shapes if art is not None and art.weights_digest else None
+    if shapes and len(shapes) == len(weights):
+        return [w.reshape(s) for w, s in zip(weights, shapes)]
+    return weights
 
 
 class _Strategy(fl.server.strategy.FedAvg):
-    def __init__(self, job_id: int, initial_params: Optional[fl.common.Parameters]):
+    def __init__(
+        self,
+        job_id: int,
+        initial_params: Optional[fl.common.Parameters],
+        update_codec: str = "fp32",
+        initial_layers: Optional[List[np.ndarray]] = None,
+        server_id: Optional[int] = None,
+    ):
         # Configure for single-client operation by default
         super().__init__(
             fraction_fit=1.0,
@@ -35,73 +55,159 @@ class _Strategy(fl.server.strategy.FedAvg):
             min_available_clients=1,
             fraction_evaluate=0.0,
             min_evaluate_clients=0,
+            on_fit_config_fn=lambda server_round: {"update_codec": update_codec},
         )
         self.job_id = job_id
         self.initial_params = initial_params
+        self.update_codec = update_codec
+        # Global weights sent out for the current round: the base of int8 delta updates
+        self._round_base: Optional[List[np.ndarray]] = None
+        # Latest global parameters and their arrays, so rounds never deserialize what we produced
+        self._latest_params = initial_params
+        self._latest_layers = initial_layers
+        # Supervisor registry row this server reports round timings and client counts to
+        self.server_id = server_id
+        self.client_manager: Optional[fl.server.client_manager.ClientManager] = None
+        self._round_started: Optional[float] = None
 
     def initialize_parameters(self, client_manager: fl.server.client_manager.ClientManager) -> Optional[fl.common.Parameters]:
+        self.client_manager = client_manager
         return self.initial_params
 
+    def configure_fit(self, server_round, parameters, client_manager):
+        if parameters is self._latest_params and self._latest_layers is not None:
+            layers = self._latest_layers
+        else:
+            layers = _from_parameters(parameters)
+        self._round_base = [nd.reshape(-1) for nd in layers]
+        self._round_started = time.perf_counter()
+        return super().configure_fit(server_round, parameters, client_manager)
+
     def aggregate_fit(
         self,
         server_round: int,
         results: List[fl.server.client_proxy.FitRes],
         failures: List[BaseException],
     ) -> tuple[Optional[fl.common.Parameters], Dict[str, fl.common.Scalar]]:
-        params_agg, metrics_agg = super().aggregate_fit(server_round, results, failures)
-        # Persist aggregated weights to DB
+        if self.server_id is not None and self._round_started is not None:
+            seconds = time.perf_counter() - self._round_started
+            _record_round(self.server_id, server_round, seconds, self.live_clients(), len(results), len(failures))
+        if not results:
+            return None, {}
+        if not self.accept_failures and failures:
+            return None, {}
+        # Sample-weighted FedAvg into one stacked buffer. Serial: this runs in a daemonic
+        # supervisor worker, which cannot start the FedAvg process pool
+        engine: Optional[FedAvgEngine] = None
+        for _, fit_res in results:
+            nds = fl.common.parameters_to_ndarrays(fit_res.parameters)
+            metrics = fit_res.metrics or {}
+            meta: Dict[str, Any] = {"codec": str(metrics.get("codec") or "fp32")}
+            if metrics.get("shapes"):
+                # Flower metrics are scalars, so topk layer shapes travel as a JSON string
+                meta["shapes"] = json.loads(str(metrics["shapes"]))
+            # The base of a delta is implicit: the parameters this round was configured with
+            update = from_tensors(nds, meta, implicit_base=True)
+            if engine is None:
+                engine = FedAvgEngine(LayerLayout(update.shapes))
+            update.fold_into(engine, float(max(1, fit_res.num_examples)), base=self._round_base)
+        layers = engine.average_layers()
+        params_agg = _to_parameters(layers)
+        self._latest_params, self._latest_layers = params_agg, layers
+        metrics_agg: Dict[str, fl.common.Scalar] = {}
+        if self.fit_metrics_aggregation_fn:
+            metrics_agg = self.fit_metrics_aggregation_fn([(res.num_examples, res.metrics) for _, res in results])
+        # Persist the aggregated arrays as a binary blob (one file write plus the artifact row)
         if params_agg is not None:
             try:
-                weights = _from_parameters(params_agg)
                 with get_session() as session:
-                    art = session.query(ModelArtifact).filter(ModelArtifact.job_id == self.job_id).one_or_none()
-                    if art:
-                        art.weights = weights
-                    else:
-                        art = ModelArtifact(job_id=self.job_id, weights=weights)
-                        session.add(art)
+                    model_store.save_artifact(session, self.job_id, layers)
             except Exception as e:
                 logger.exception("flower.aggregate.persist.fail", extra={"job_id": self.job_id, "error": str(e)})
         return params_agg, metrics_agg
 
+    def live_clients(self) -> int:
+        return self.client_manager.num_available() if self.client_manager is not None else 0
 
-def start_flower_server(job_id: int, host: str = "0.0.0.0", port: int = 8089, rounds: int = 1) -> Dict[str, Any]:
-    if job_id in _running_servers and _running_servers[job_id].is_alive():
-        return {"status": "already_running", "host": host, "port": port}
 
-    # Load initial params from DB if exist
-    initial_params = None
+def _record_round(server_id: int, server_round: int, seconds: float, clients: int, results: int, failures: int) -> None:
     try:
         with get_session() as session:
-            art = session.query(ModelArtifact).filter(ModelArtifact.job_id == job_id).one_or_none()
-            weights = (art.weights or []) if art else []
-            if weights:
-                initial_params = _to_parameters(weights)
-    except Exception:
-        initial_params = None
-
-    strategy = _Strategy(job_id=job_id, initial_params=initial_params)
-
-    def _run():
-        address = f"{host}:{port}"
-        logger.info("flower.server.start", extra={"job_id": job_id, "address": address, "rounds": rounds})
-        fl.server.start_server(server_address=address, config=fl.server.ServerConfig(num_rounds=rounds), strategy=strategy)
-        logger.info("flower.server.stop", extra={"job_id": job_id})
-        # Mark job as completed when Flower server stops
+            row = session.get(FlowerServer, server_id)
+            if row is None:
+                return
+            timings = list(row.round_timings or [])
+            timings.append(
+                {"round": server_round, "seconds": round(seconds, 3), "clients": clients, "results": results, "failures": failures}
+            )
+            row.round_timings = timings[-_MAX_TIMINGS:]
+            row.current_round = server_round
+            row.clients = clients
+            row.updated_at = datetime.utcnow()
+    except Exception as e:
+        logger.warning("flower.server.record_round.fail", extra={"server_id": server_id, "error": str(e)})
+
+
+def _heartbeat(server_id: int, strategy: _Strategy, stop: threading.Event) -> None:
+    while not stop.wait(settings.flower_heartbeat_seconds):
         try:
             with get_session() as session:
-                job = session.get(Job, job_id)
-                if job:
-                    job.status = "completed"
+                row = session.get(FlowerServer, server_id)
+                if row is not None:
+                    row.clients = strategy.live_clients()
+                    row.updated_at = datetime.utcnow()
         except Exception as e:
-            logger.warning("flower.server.mark_complete.fail", extra={"job_id": job_id, "error": str(e)})
+            logger.debug("flower.server.heartbeat.fail", extra={"server_id": server_id, "error": str(e)})
 
-    proc = mp.Process(target=_run, daemon=True, name=f"flower-server-{job_id}")
-    _running_servers[job_id] = proc
-    proc.start()
-    return {"status": "started", "host": host, "port": port}
 
-
-def is_flower_running(job_id: int) -> bool:
-    proc = _running_servers.get(job_id)
-    return bool(proc and proc.is_alive())
+def serve(server_id: int, job_id: int, host: str, port: int, rounds: int) -> str:
+    """Run one job's Flower server to completion in this process. Returns the final status."""
+    initial_params = None
+    initial_layers: Optional[List[np.ndarray]] = None
+    update_codec = "fp32"
+    try:
+        with get_session() as session:
+            initial_layers = _load_layers(model_store.get_artifact(session, job_id)) or None
+            job = session.get(Job, job_id)
+            update_codec = (job.update_codec if job else None) or "fp32"
+            row = session.get(FlowerServer, server_id)
+            if row is not None:
+                row.status = "running"
+                row.pid = os.getpid()
+                row.updated_at = datetime.utcnow()
+        if initial_layers:
+            initial_params = _to_parameters(initial_layers)
+    except Exception:
+        initial_params = initial_layers = None
+
+    strategy = _Strategy(
+        job_id=job_id, initial_params=initial_params, update_codec=update_codec, initial_layers=initial_layers, server_id=server_id
+    )
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(server_id, strategy, stop), daemon=True).start()
+    address = f"{host}:{port}"
+    logger.info("flower.server.start", extra={"job_id": job_id, "address": address, "rounds": rounds})
+    status, error = "completed", None
+    try:
+        fl.server.start_server(server_address=address, config=fl.server.ServerConfig(num_rounds=rounds), strategy=strategy)
+    except Exception as e:
+        status, error = "failed", str(e)
+        logger.exception("flower.server.fail", extra={"job_id": job_id})
+    finally:
+        stop.set()
+    logger.info("flower.server.stop", extra={"job_id": job_id, "status": status})
+    try:
+        with get_session() as session:
+            row = session.get(FlowerServer, server_id)
+            if row is not None:
+                row.status = status
+                row.error = error
+                row.clients = 0
+                row.finished_at = row.updated_at = datetime.utcnow()
+            # Mark job as completed when Flower server stops
+            job = session.get(Job, job_id)
+            if job and status == "completed":
+                job.status = "completed"
+    except Exception as e:
+        logger.warning("flower.server.mark_complete.fail", extra={"job_id": job_id, "error": str(e)})
+    return status
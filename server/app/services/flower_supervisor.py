@@ -0,0 +1,250 @@
+"""Supervisor for the Flower servers run by this orchestrator replica.
+
+Servers run in a small pool of spawned worker processes. Idle workers are kept
+warm (``FLOWER_WARM_PROCESSES``: flwr and the app already imported) and take the
+next job as soon as it is assigned; a worker that finishes a job goes back to the
+pool. Ports are allocated from ``FLOWER_PORT_RANGE`` and at most
+``FLOWER_MAX_SERVERS`` jobs are served at once.
+
+Every server has a ``FlowerServer`` row: the registry shared by all replicas. The
+worker heartbeats it with the live client count and appends per-round timings, so
+any replica can report on, or refuse to double-start, a job served elsewhere.
+"""
+import logging
+import multiprocessing as mp
+import os
+import socket
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..config import settings
+from ..db import get_session
+from ..models import FlowerServer
+
+logger = logging.getLogger("quackmesh.flower")
+
+ACTIVE_STATUSES = ("starting", "running")
+NODE = socket.gethostname()
+INSTANCE = f"{NODE}-{os.getpid()}"
+
+
+class FlowerCapacityError(RuntimeError):
+    """No free slot or port for another Flower server."""
+
+
+def _worker_main(conn: Connection) -> None:
+    """Pool process: serve the jobs sent over ``conn`` one after another until told to exit."""
+    from .flower_server import serve  # imported up front, so the process is warm when a job arrives
+
+    while True:
+        try:
+            spec = conn.recv()
+        except EOFError:
+            return
+        if spec is None:
+            return
+        try:
+            status = serve(**spec)
+        except Exception as e:  # serve() records its own failures; this is a last resort
+            logger.exception("flower.worker.fail", extra={"job_id": spec.get("job_id")})
+            status = f"failed: {e}"
+        conn.send({"server_id": spec["server_id"], "status": status})
+
+
+@dataclass
+class _Worker:
+    proc: mp.Process
+    conn: Connection
+    server_id: Optional[int] = None
+    job_id: Optional[int] = None
+
+
+def parse_port_range(value: str) -> Tuple[int, int]:
+    lo, _, hi = (value or "").partition("-")
+    lo_i = int(lo)
+    return lo_i, int(hi or lo_i)
+
+
+def _port_free(host: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host if host not in ("", "localhost") else "0.0.0.0", port))
+            return True
+        except OSError:
+            return False
+
+
+def _stale_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=max(30.0, 3 * settings.flower_heartbeat_seconds))
+
+
+def _is_live(row: FlowerServer) -> bool:
+    if row.status not in ACTIVE_STATUSES:
+        return False
+    return row.updated_at is not None and row.updated_at >= _stale_before()
+
+
+class FlowerSupervisor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        self._ctx = mp.get_context("spawn")
+
+    # -- worker processes -------------------------------------------------
+
+    def _spawn(self) -> _Worker:
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_worker_main, args=(child,), daemon=True, name="flower-worker")
+        proc.start()
+        child.close()
+        worker = _Worker(proc=proc, conn=parent)
+        self._workers.append(worker)
+        return worker
+
+    def _reap(self) -> None:
+        """Collect finished jobs and drop dead workers (marking their server failed)."""
+        for worker in list(self._workers):
+            try:
+                while worker.conn.poll():
+                    worker.conn.recv()
+                    worker.server_id = worker.job_id = None
+            except (EOFError, OSError):
+                pass
+            if not worker.proc.is_alive():
+                self._workers.remove(worker)
+                if worker.server_id is not None:
+                    _finish(worker.server_id, "failed", f"worker exited with code {worker.proc.exitcode}")
+
+    def warm(self) -> None:
+        """Top the pool up to ``FLOWER_WARM_PROCESSES`` idle workers."""
+        with self._lock:
+            self._reap()
+            idle = sum(1 for w in self._workers if w.server_id is None)
+            room = max(0, settings.flower_max_servers - len(self._workers))
+            for _ in range(min(room, max(0, settings.flower_warm_processes - idle))):
+                self._spawn()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for worker in self._workers:
+                if worker.server_id is None:
+                    try:
+                        worker.conn.send(None)
+                    except OSError:
+                        pass
+                else:
+                    worker.proc.terminate()
+                    _finish(worker.server_id, "failed", "orchestrator shut down")
+            self._workers = []
+
+    # -- servers ----------------------------------------------------------
+
+    def _allocate_port(self, session, host: str, requested: Optional[int]) -> int:
+        taken = {
+            row.port
+            for row in session.execute(
+                select(FlowerServer).where(FlowerServer.node == NODE, FlowerServer.status.in_(ACTIVE_STATUSES))
+            ).scalars()
+            if _is_live(row) or row.instance == INSTANCE
+        }
+        if requested:
+            if requested in taken or not _port_free(host, requested):
+                raise FlowerCapacityError(f"Port {requested} is in use")
+            return requested
+        lo, hi = parse_port_range(settings.flower_port_range)
+        for port in range(lo, hi + 1):
+            if port not in taken and _port_free(host, port):
+                return port
+        raise FlowerCapacityError(f"No free port in {settings.flower_port_range}")
+
+    def start(self, job_id: int, host: str = "0.0.0.0", port: Optional[int] = None, rounds: int = 1) -> Dict[str, Any]:
+        """Serve ``job_id`` on a pooled worker; raises FlowerCapacityError when full."""
+        with self._lock:
+            self._reap()
+            with get_session() as session:
+                existing = session.execute(
+                    select(FlowerServer)
+                    .where(FlowerServer.job_id == job_id, FlowerServer.status.in_(ACTIVE_STATUSES))
+                    .order_by(FlowerServer.id.desc())
+                ).scalars().first()
+                if existing is not None:
+                    if _is_live(existing):
+                        return {"status": "already_running", "host": existing.host, "port": existing.port, "server_id": existing.id}
+                    # Its replica stopped heartbeating (crashed or was redeployed)
+                    existing.status, existing.error = "failed", "heartbeat lost"
+                    existing.finished_at = datetime.utcnow()
+                busy = sum(1 for w in self._workers if w.server_id is not None)
+                if busy >= settings.flower_max_servers:
+                    raise FlowerCapacityError(f"All {settings.flower_max_servers} Flower server slots are busy")
+                row = FlowerServer(
+                    job_id=job_id,
+                    node=NODE,
+                    instance=INSTANCE,
+                    host=host,
+                    port=self._allocate_port(session, host, port),
+                    rounds=rounds,
+                    status="starting",
+                    round_timings=[],
+                )
+                session.add(row)
+                session.flush()
+                server_id, port = row.id, row.port
+            worker = next((w for w in self._workers if w.server_id is None and w.proc.is_alive()), None)
+            warm = worker is not None
+            if worker is None:
+                worker = self._spawn()
+            worker.server_id, worker.job_id = server_id, job_id
+            worker.conn.send({"server_id": server_id, "job_id": job_id, "host": host, "port": port, "rounds": rounds})
+        logger.info("flower.server.assigned", extra={"job_id": job_id, "port": port, "warm": warm})
+        # Replace the warm worker that was just used
+        threading.Thread(target=self.warm, daemon=True).start()
+        return {"status": "started", "host": host, "port": port, "server_id": server_id}
+
+    def is_running(self, job_id: int) -> bool:
+        with self._lock:
+            self._reap()
+        with get_session() as session:
+            rows = session.execute(
+                select(FlowerServer).where(FlowerServer.job_id == job_id, FlowerServer.status.in_(ACTIVE_STATUSES))
+            ).scalars().all()
+            return any(_is_live(row) for row in rows)
+
+
+def _finish(server_id: int, status: str, error: Optional[str] = None) -> None:
+    try:
+        with get_session() as session:
+            row = session.get(FlowerServer, server_id)
+            if row is not None and row.status in ACTIVE_STATUSES:
+                row.status = status
+                row.error = error
+                row.clients = 0
+                row.finished_at = row.updated_at = datetime.utcnow()
+    except Exception as e:
+        logger.warning("flower.server.finish.fail", extra={"server_id": server_id, "error": str(e)})
+
+
+def list_servers(session, job_id: Optional[int] = None, active_only: bool = False) -> List[FlowerServer]:
+    stmt = select(FlowerServer).order_by(FlowerServer.id.desc())
+    if job_id is not None:
+        stmt = stmt.where(FlowerServer.job_id == job_id)
+    rows = session.execute(stmt).scalars().all()
+    if active_only:
+        rows = [row for row in rows if _is_live(row)]
+    return rows
+
+
+supervisor = FlowerSupervisor()
+
+
+def start_flower_server(job_id: int, host: str = "0.0.0.0", port: Optional[int] = None, rounds: int = 1) -> Dict[str, Any]:
+    return supervisor.start(job_id, host=host, port=port, rounds=rounds)
+
+
+def is_flower_running(job_id: int) -> bool:
+    return supervisor.is_running(job_id)
@@ -0,0 +1,201 @@
+"""Incremental parser for JSON update bodies.
+
+``{"weights": [[...], ...], "val_accuracy": ..., ...}`` is read from the request
+stream chunk by chunk. Weight numbers are converted in bulk, a chunk at a time,
+straight into float32 numpy buffers, so a submission never materializes millions
+of Python floats; peak memory stays near the size of the model itself. When the
+expected layer sizes are known, a layer that is too long (or one layer too many)
+is rejected as soon as it is seen, before the rest of the body is read.
+
+Like strict JSON, ``NaN`` and ``Infinity`` are rejected, as are weights that
+overflow float32: one non-finite value would poison the whole round's FedAvg sum.
+"""
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_WS = b" \t\r\n"
+_DELIMS = ",:]} \t\r\n"
+_MAX_FIELD_BYTES = 1024 * 1024  # non-weight values are small scalars
+
+
+def _reject_constant(name: str) -> Any:
+    raise ValueError(f"Non-finite number {name} in JSON body")
+
+
+_decoder = json.JSONDecoder(parse_constant=_reject_constant)
+
+
+class _Reader:
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+        self.buf = b""
+        self.pos = 0
+        self.eof = False
+
+    async def more(self) -> bool:
+        """Append the next chunk, dropping consumed bytes. False at end of body."""
+        if self.eof:
+            return False
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    async def peek(self) -> bytes:
+        """Next non-whitespace byte (not consumed)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos : self.pos + 1]
+            if not await self.more():
+                raise ValueError("Unexpected end of JSON body")
+
+    async def expect(self, ch: bytes) -> None:
+        if await self.peek() != ch:
+            raise ValueError(f"Expected {ch.decode()!r} in JSON body")
+        self.pos += 1
+
+    async def value(self) -> Any:
+        """Decode one small JSON value with the stdlib decoder."""
+        await self.peek()
+        while True:
+            window = self.buf[self.pos : self.pos + _MAX_FIELD_BYTES]
+            text = window.decode("utf-8", errors="replace")
+            try:
+                obj, end = _decoder.raw_decode(text)
+            except json.JSONDecodeError:
+                obj, end = None, -1
+            # Only accept a value once the byte after it is a delimiter: "12." could still become "12.5"
+            if end >= 0 and end < len(text) and text[end] in _DELIMS:
+                self.pos += len(text[:end].encode("utf-8"))
+                return obj
+            if len(self.buf) - self.pos > _MAX_FIELD_BYTES:
+                raise ValueError("JSON field too large")
+            if not await self.more():
+                # End of body: only a value running up to the very end can still be accepted
+                if end >= 0 and end == len(text) and self.pos + len(window) == len(self.buf):
+                    self.pos = len(self.buf)
+                    return obj
+                raise ValueError("Invalid JSON value")
+
+
+def _parse_numbers(seg: bytes) -> np.ndarray:
+    seg = seg.strip(_WS)
+    if not seg:
+        raise ValueError("Empty value in weight list")
+    try:
+        arr = np.fromstring(seg, dtype=np.float32, sep=",")
+    except ValueError:
+        arr = None
+    if arr is None or arr.size != seg.count(b",") + 1:
+        raise ValueError("Weight lists must contain only numbers")
+    if not np.isfinite(arr).all():
+        raise ValueError("Weight lists must contain only finite numbers")
+    return arr
+
+
+async def _parse_layer(r: _Reader, index: int, expected: Optional[int]) -> np.ndarray:
+    await r.expect(b"[")
+    out = np.empty(expected, dtype=np.float32) if expected is not None else None
+    parts: List[np.ndarray] = []
+    filled = 0
+    while True:
+        close = r.buf.find(b"]", r.pos)
+        if close >= 0:
+            seg, r.pos, final = r.buf[r.pos : close], close + 1, True
+        else:
+            cut = r.buf.rfind(b",", r.pos)
+            if cut < 0:
+                if not await r.more():
+                    raise ValueError("Unexpected end of JSON body")
+                continue
+            seg, r.pos, final = r.buf[r.pos : cut], cut + 1, False
+        if final and filled == 0 and not seg.strip(_WS):
+            break  # empty layer
+        arr = _parse_numbers(seg)
+        if out is not None:
+            if filled + arr.size > expected:
+                raise ValueError(f"Layer {index} has more than the expected {expected} values")
+            out[filled : filled + arr.size] = arr
+        else:
+            parts.append(arr)
+        filled += arr.size
+        if final:
+            break
+    if out is None:
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+    if filled != expected:
+        raise ValueError(f"Layer {index} has {filled} values, expected {expected}")
+    return out
+
+
+async def _parse_weights(r: _Reader, expected_sizes: Optional[Sequence[int]]) -> Optional[List[np.ndarray]]:
+    if await r.peek() == b"n":
+        if await r.value() is not None:
+            raise ValueError("Invalid 'weights' value")
+        return None
+    await r.expect(b"[")
+    layers: List[np.ndarray] = []
+    if await r.peek() == b"]":
+        r.pos += 1
+        return layers
+    while True:
+        expected = None
+        if expected_sizes is not None:
+            if len(layers) >= len(expected_sizes):
+                raise ValueError(f"Update has more than the expected {len(expected_sizes)} layers")
+            expected = int(expected_sizes[len(layers)])
+        layers.append(await _parse_layer(r, len(layers), expected))
+        c = await r.peek()
+        r.pos += 1
+        if c == b"]":
+            break
+        if c != b",":
+            raise ValueError("Expected ',' or ']' in 'weights'")
+    if expected_sizes is not None and len(layers) != len(expected_sizes):
+        raise ValueError(f"Update has {len(layers)} layers, expected {len(expected_sizes)}")
+    return layers
+
+
+async def parse_update_json(
+    chunks: AsyncIterator[bytes], expected_sizes: Optional[Sequence[int]] = None
+) -> Tuple[Dict[str, Any], Optional[List[np.ndarray]]]:
+    """Parse an update body into (other fields, float32 weight layers or None).
+
+    Raises ValueError on malformed JSON or, when ``expected_sizes`` is given, on a
+    layer count or layer size that does not match.
+    """
+    r = _Reader(chunks)
+    fields: Dict[str, Any] = {}
+    weights: Optional[List[np.ndarray]] = None
+    await r.expect(b"{")
+    if await r.peek() == b"}":
+        r.pos += 1
+    else:
+        while True:
+            if await r.peek() != b'"':
+                raise ValueError("Expected a field name in JSON body")
+            key = await r.value()
+            await r.expect(b":")
+            if key == "weights":
+                weights = await _parse_weights(r, expected_sizes)
+            else:
+                fields[key] = await r.value()
+            c = await r.peek()
+            r.pos += 1
+            if c == b"}":
+                break
+            if c != b",":
+                raise ValueError("Expected ',' or '}' in JSON body")
+    while await r.more() or r.pos < len(r.buf):
+        if r.buf[r.pos :].strip(_WS):
+            raise ValueError("Trailing data after JSON body")
+        r.pos = len(r.buf)
+    return fields, weights
@@ -0,0 +1,110 @@
+"""Deltas between two published versions of a job's global model (``?since=`` downloads).
+
+A delta is a tensor document with one entry per layer in ``__metadata__["layers"]``,
+encoded in whichever of three modes is smallest for that layer:
+
+``replace``  indices and new values of the entries whose float32 bits changed (exact;
+             wins when few entries moved, e.g. frozen layers)
+``q8``       the difference ``new - old`` as int8 codes with a per-layer scale and
+             zero point; the patched value is within ``scale / 2`` of the new one
+``dense``    the new values in full (a layer whose difference does not quantize
+             within ``MODEL_DELTA_MAX_ERROR``)
+
+FedAvg moves nearly every weight a little each round, so most layers go ``q8`` and
+the delta is about a quarter of the model. The metadata carries the largest
+per-entry error (``max_error``) and the float64 sum of every new layer; workers
+check the patched model against those sums and track the error accumulated over
+successive deltas, fetching the full model once it exceeds their tolerance. When
+the delta would not be smaller than the model, callers serve the full model.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..config import settings
+from . import model_store
+from .tensor_codec import encode_tensors
+
+DELTA_KIND = "layers"
+
+_cache: "OrderedDict[Tuple[str, str], Optional[bytes]]" = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _index_dtype(n: int) -> type:
+    return np.uint32 if n <= np.iinfo(np.uint32).max else np.int64
+
+
+def _diff_layer(o: np.ndarray, n: np.ndarray, max_error: float) -> Tuple[List[np.ndarray], Dict[str, Any]]:
+    """Smallest encoding of one layer's change: (arrays, layer metadata)."""
+    # Compare bit patterns so -0.0/0.0 and NaN payloads count as changes
+    idx = np.flatnonzero(o.view(np.uint32) != n.view(np.uint32))
+    if idx.size * 8 <= n.size:
+        idx = idx.astype(_index_dtype(n.size))
+        return [idx, n[idx]], {"mode": "replace", "max_error": 0.0}
+    d = n.astype(np.float64) - o
+    lo, hi = float(d.min()), float(d.max())
+    scale = (hi - lo) / 254.0
+    if np.isfinite(scale) and scale / 2 <= max_error:
+        zero = (hi + lo) / 2.0
+        codes = np.rint((d - zero) / scale) if scale > 0 else np.zeros(n.size)
+        return [np.clip(codes, -127, 127).astype(np.int8)], {"mode": "q8", "scale": scale, "zero": zero, "max_error": scale / 2}
+    return [n], {"mode": "dense", "max_error": 0.0}
+
+
+def diff_layers(
+    old: Sequence[np.ndarray], new: Sequence[np.ndarray], max_error: Optional[float] = None
+) -> Optional[Tuple[List[np.ndarray], Dict[str, Any]]]:
+    """(arrays, metadata) of the delta from ``old`` to ``new``, or None if not worth it."""
+    if len(old) != len(new) or any(o.size != n.size for o, n in zip(old, new)):
+        return None
+    max_error = settings.model_delta_max_error if max_error is None else max_error
+    arrays: List[np.ndarray] = []
+    layers: List[Dict[str, Any]] = []
+    nbytes = 0
+    dense_nbytes = 0
+    for o, n in zip(old, new):
+        o = np.ascontiguousarray(o, dtype=np.float32).reshape(-1)
+        n = np.ascontiguousarray(n, dtype=np.float32).reshape(-1)
+        layer_arrays, meta = _diff_layer(o, n, max_error)
+        meta["size"] = int(n.size)
+        meta["sum"] = float(n.sum(dtype=np.float64))
+        arrays += layer_arrays
+        layers.append(meta)
+        nbytes += sum(a.nbytes for a in layer_arrays)
+        dense_nbytes += n.nbytes
+    if nbytes >= dense_nbytes:
+        return None
+    return arrays, {"delta": DELTA_KIND, "layers": layers, "max_error": max((m["max_error"] for m in layers), default=0.0)}
+
+
+def delta_document(old_digest: str, new_digest: str) -> Optional[bytes]:
+    """Encoded delta between two stored model blobs; every worker on the same version shares it.
+
+    Documents are kept in an LRU bounded to ``MODEL_DELTA_CACHE_MB``.
+    """
+    global _cache_bytes
+    key = (old_digest, new_digest)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    diff = diff_layers(model_store.load_blob_layers(old_digest), model_store.load_blob_layers(new_digest))
+    doc = None
+    if diff is not None:
+        arrays, meta = diff
+        doc = encode_tensors(arrays, metadata={**meta, "base_digest": old_digest, "digest": new_digest})
+    budget = settings.model_delta_cache_mb * 1024 * 1024
+    size = len(doc) if doc is not None else 0
+    if size <= budget:
+        with _cache_lock:
+            if key not in _cache:
+                _cache[key] = doc
+                _cache_bytes += size
+            while _cache_bytes > budget and _cache:
+                _, old = _cache.popitem(last=False)
+                _cache_bytes -= len(old) if old is not None else 0
+    return doc
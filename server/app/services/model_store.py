@@ -0,0 +1,135 @@
+"""Storage API for model weights of ``ModelArtifact`` and ``Update`` rows.
+
+Weights are written once as float32 tensor documents (see tensor_codec) into the
+content-addressed blob store; rows only keep the digest, layer shapes, dtype and
+byte size. Rows written before the blob store existed still carry their weights
+in the legacy ``weights`` JSON column and are read transparently.
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import ModelArtifact, ModelVersion, Update
+from .blob_store import get_blob_store
+from .tensor_codec import as_float32_layers, decode_tensors, iter_encoded
+from .update_codec import CODEC_DTYPES, EncodedUpdate, from_layers, from_tensors
+
+WEIGHTS_DTYPE = "F32"
+
+
+class BaseModelUnavailable(LookupError):
+    """A delta-coded update references a base model blob that is no longer stored."""
+
+
+def put_weights(row, layers: Iterable) -> None:
+    """Store ``layers`` as a blob and point ``row`` (ModelArtifact or Update) at it."""
+    arrays = as_float32_layers(layers)
+    digest, size = get_blob_store().put(iter_encoded(arrays))
+    row.weights_digest = digest
+    row.weights_shapes = [list(a.shape) for a in arrays]
+    row.weights_dtype = WEIGHTS_DTYPE
+    row.weights_nbytes = size
+    row.weights = None
+
+
+def has_weights(row) -> bool:
+    if row is None:
+        return False
+    if row.weights_digest:
+        return bool(row.weights_shapes)
+    return bool(row.weights)
+
+
+def load_weights(row) -> List[np.ndarray]:
+    """Return the row's layers as flat float32 arrays (read-only views when blob-backed)."""
+    if row is None:
+        return []
+    if row.weights_digest:
+        arrays, _ = decode_tensors(get_blob_store().open_mmap(row.weights_digest))
+        return [a.reshape(-1) for a in arrays]
+    return as_float32_layers(row.weights or [])
+
+
+def load_blob_layers(digest: str) -> List[np.ndarray]:
+    """Flat float32 layers of a stored model blob, e.g. the base of a delta-coded update."""
+    try:
+        mm = get_blob_store().open_mmap(digest)
+    except (FileNotFoundError, ValueError):
+        raise BaseModelUnavailable(digest)
+    arrays, _ = decode_tensors(mm)
+    return [a.reshape(-1) for a in arrays]
+
+
+def put_update(update: Update, encoded: EncodedUpdate, raw: Optional[Union[bytes, memoryview]] = None) -> None:
+    """Store an update in its wire codec. ``raw`` is the already-encoded request body, if any."""
+    if raw is None:
+        if encoded.codec != "fp32":
+            raise ValueError("Encoded updates other than fp32 must be stored from their raw body")
+        put_weights(update, encoded.layers)
+        return
+    digest, size = get_blob_store().put(raw)
+    attach_update_blob(update, encoded, digest, size)
+
+
+def attach_update_blob(update: Update, encoded: EncodedUpdate, digest: str, size: int) -> None:
+    """Point an update at an already stored blob holding its encoded body."""
+    update.weights_digest = digest
+    update.weights_shapes = [list(s) for s in encoded.shapes]
+    update.weights_dtype = CODEC_DTYPES[encoded.codec]
+    update.weights_nbytes = size
+    update.base_digest = encoded.base_digest if encoded.is_delta else None
+    update.weights = None
+
+
+def load_update(update: Update) -> EncodedUpdate:
+    """Return a stored update in the codec it was submitted with."""
+    if update.weights_digest:
+        arrays, meta = decode_tensors(get_blob_store().open_mmap(update.weights_digest))
+        return from_tensors(arrays, meta)
+    return from_layers(as_float32_layers(update.weights or []))
+
+
+def blob_path(row) -> Optional[str]:
+    if row is None or not row.weights_digest:
+        return None
+    return get_blob_store().path(row.weights_digest)
+
+
+def get_artifact(session: Session, job_id: int, for_update: bool = False) -> Optional[ModelArtifact]:
+    stmt = select(ModelArtifact).where(ModelArtifact.job_id == job_id)
+    if for_update:
+        stmt = stmt.with_for_update()
+    return session.execute(stmt).scalar_one_or_none()
+
+
+def save_artifact(session: Session, job_id: int, layers: Optional[Iterable], artifact: Optional[ModelArtifact] = None) -> ModelArtifact:
+    """Upsert the job's global model, bumping its version when weights are written."""
+    if artifact is None:
+        artifact = get_artifact(session, job_id)
+    if artifact is None:
+        artifact = ModelArtifact(job_id=job_id, version=0)
+        session.add(artifact)
+    if layers is not None:
+        put_weights(artifact, layers)
+        artifact.version = (artifact.version or 0) + 1
+        artifact.updated_at = datetime.utcnow()
+        _record_version(session, job_id, artifact.version, artifact.weights_digest)
+    return artifact
+
+
+def _record_version(session: Session, job_id: int, version: int, digest: str) -> None:
+    """Append to the job's ring of recent versions, dropping the oldest beyond its size."""
+    session.add(ModelVersion(job_id=job_id, version=version, weights_digest=digest))
+    ring = max(1, settings.model_version_ring)
+    session.execute(delete(ModelVersion).where(ModelVersion.job_id == job_id, ModelVersion.version <= version - ring))
+
+
+def version_digest(session: Session, job_id: int, version: int) -> Optional[str]:
+    """Blob digest of a recent version of the job's model, or None once it left the ring."""
+    return session.execute(
+        select(ModelVersion.weights_digest).where(ModelVersion.job_id == job_id, ModelVersion.version == version).limit(1)
+    ).scalar_one_or_none()
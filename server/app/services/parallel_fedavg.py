@@ -0,0 +1,327 @@
+"""Layer-parallel FedAvg across a process pool.
+
+For large models a single fold or average is a few passes over hundreds of MB on
+one core. ``ParallelFedAvgEngine`` keeps its float64 accumulator in a
+``multiprocessing.shared_memory`` segment and splits every dense pass into
+contiguous ranges of the stacked buffer, one per pool process. A client update is
+copied once into a shared staging segment in its wire dtype (fp32, fp16 or int8
+codes); workers attach to the segments by name and fold their range in place, so
+only segment names, offsets and scalars cross the process boundary, never arrays.
+
+Sparse (top-k) folds are O(k) and stay in the calling process.
+
+Daemonic processes (the Flower server workers) cannot start the pool; there, and
+whenever the pool fails to start, ``create_engine`` returns the serial engine.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..config import settings
+from .fedavg import FedAvgEngine, LayerLayout
+
+logger = logging.getLogger("quackmesh.fedavg")
+
+_BLOCK = 1 << 20  # elements per worker-side scratch block
+_ALIGN = 4096  # range boundaries, in elements
+
+
+# ---------------------------------------------------------------------------
+# Worker side (runs in pool processes)
+# ---------------------------------------------------------------------------
+
+_attached: "OrderedDict[str, SharedMemory]" = OrderedDict()
+_MAX_ATTACHED = 16
+
+
+def _view(name: str, dtype: str, count: int) -> np.ndarray:
+    shm = _attached.get(name)
+    if shm is None:
+        shm = SharedMemory(name=name)
+        _attached[name] = shm
+        while len(_attached) > _MAX_ATTACHED:
+            # Segments of finished engines are unlinked by their owner; drop our mapping too
+            _, old = _attached.popitem(last=False)
+            old.close()
+    else:
+        _attached.move_to_end(name)
+    return np.ndarray((count,), dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _fold_range(
+    acc_name: str,
+    src_name: str,
+    src_dtype: str,
+    size: int,
+    start: int,
+    end: int,
+    weight: float,
+    affine: Optional[Sequence[Tuple[int, int, float, float]]],
+) -> None:
+    """``acc[start:end] += weight * src[start:end]``; ``affine`` dequantizes int8 codes per layer."""
+    acc = _view(acc_name, "f8", size)
+    src = _view(src_name, src_dtype, size)
+    scratch = np.empty(min(_BLOCK, end - start), dtype=np.float64)
+    if affine is None:
+        spans = [(start, end, 1.0, 0.0)]
+    else:
+        spans = [(max(s, start), min(e, end), sc, z) for s, e, sc, z in affine if s < end and e > start]
+    for s, e, scale, zero in spans:
+        for b in range(s, e, _BLOCK):
+            be = min(b + _BLOCK, e)
+            buf = scratch[: be - b]
+            if affine is None:
+                np.multiply(src[b:be], weight, out=buf)
+            else:
+                np.multiply(src[b:be], scale, out=buf)
+                np.add(buf, zero, out=buf)
+                if weight != 1.0:
+                    np.multiply(buf, weight, out=buf)
+            np.add(acc[b:be], buf, out=acc[b:be])
+
+
+def _average_range(
+    acc_name: str,
+    out_name: str,
+    bases: Sequence[Tuple[str, float]],
+    size: int,
+    start: int,
+    end: int,
+    total_weight: float,
+) -> None:
+    """``out[start:end] = (acc + sum(weight * base)) / total_weight`` as float32."""
+    acc = _view(acc_name, "f8", size)
+    out = _view(out_name, "f4", size)
+    base_views = [(_view(name, "f4", size), w) for name, w in bases]
+    scratch = np.empty(min(_BLOCK, end - start), dtype=np.float64)
+    tmp = np.empty_like(scratch) if base_views else None
+    for b in range(start, end, _BLOCK):
+        be = min(b + _BLOCK, end)
+        buf = scratch[: be - b]
+        np.copyto(buf, acc[b:be])
+        for base, w in base_views:
+            t = tmp[: be - b]
+            np.multiply(base[b:be], w, out=t)
+            np.add(buf, t, out=buf)
+        np.divide(buf, total_weight, out=out[b:be], casting="same_kind")
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pool_failed = False
+
+
+class PoolUnavailable(RuntimeError):
+    pass
+
+
+def pool_size() -> int:
+    return settings.fedavg_processes or os.cpu_count() or 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_failed
+    with _pool_lock:
+        if _pool_failed:
+            raise PoolUnavailable("FedAvg process pool could not be started")
+        if _pool is None:
+            # spawn: the orchestrator is multi-threaded, forking it is not safe
+            pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=get_context("spawn"))
+            try:
+                # Workers start on the first submit: do it now, so a failure surfaces before any fold
+                pool.submit(int).result()
+            except (AssertionError, OSError, BrokenProcessPool) as e:
+                pool.shutdown(wait=False, cancel_futures=True)
+                _pool_failed = True
+                logger.warning("fedavg.pool.unavailable", extra={"error": str(e)})
+                raise PoolUnavailable(f"FedAvg process pool could not be started: {e}")
+            _pool = pool
+            logger.info("fedavg.pool.start", extra={"processes": pool_size()})
+        return _pool
+
+
+def pool_available() -> bool:
+    """Whether dense passes can run on the pool from this process (starts it if needed)."""
+    if multiprocessing.current_process().daemon:
+        return False  # daemonic processes are not allowed to have children
+    try:
+        _get_pool()
+    except PoolUnavailable:
+        return False
+    return True
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def shutdown() -> None:
+    _reset_pool()
+
+
+def _run(fn, tasks: Sequence[tuple]) -> None:
+    try:
+        futures = [_get_pool().submit(fn, *args) for args in tasks]
+        for fut in futures:
+            fut.result()
+    except BrokenProcessPool:
+        _reset_pool()
+        raise RuntimeError("FedAvg worker process died")
+
+
+def _ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    step = -(-size // max(1, parts))
+    step = -(-step // _ALIGN) * _ALIGN
+    return [(s, min(s + step, size)) for s in range(0, size, step)]
+
+
+def _new_segment(nbytes: int) -> SharedMemory:
+    return SharedMemory(create=True, size=max(1, nbytes))
+
+
+def _release(segments: List[SharedMemory]) -> None:
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # a view is still alive; the mapping goes with it
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ParallelFedAvgEngine(FedAvgEngine):
+    """``FedAvgEngine`` whose dense passes run across the process pool.
+
+    The accumulator is a view of a shared segment, so the inherited serial paths
+    (sparse folds) keep working on the same buffer.
+    """
+
+    def __init__(self, layout: LayerLayout, processes: Optional[int] = None):
+        self._segments: List[SharedMemory] = []
+        self._acc = self._segment(layout.size * 8)
+        acc = np.ndarray((layout.size,), dtype=np.float64, buffer=self._acc.buf)
+        acc.fill(0.0)
+        super().__init__(layout, buffer=acc)
+        self._ranges = _ranges(layout.size, processes or pool_size())
+        self._staging: Optional[SharedMemory] = None
+        self._out: Optional[SharedMemory] = None
+        # base key -> staged float32 copy of that base model
+        self._staged_bases: Dict[Any, SharedMemory] = {}
+        self._finalizer = weakref.finalize(self, _release, self._segments)
+
+    def _segment(self, nbytes: int) -> SharedMemory:
+        shm = _new_segment(nbytes)
+        self._segments.append(shm)
+        return shm
+
+    def _stage(self, layers: Sequence[np.ndarray], dtype: np.dtype) -> str:
+        """Copy a client's layers, stacked, into the shared staging segment."""
+        if self._staging is None:
+            self._staging = self._segment(self.layout.size * 4)
+        flat = np.ndarray((self.layout.size,), dtype=dtype, buffer=self._staging.buf)
+        for (start, end), layer in zip(self.layout.slices, layers):
+            flat[start:end] = np.asarray(layer).reshape(-1)
+        return self._staging.name
+
+    def _fold(self, layers: Sequence[np.ndarray], weight: float, affine=None) -> None:
+        dtype = np.result_type(*[np.asarray(layer).dtype for layer in layers]) if layers else np.dtype(np.float32)
+        if affine is None and dtype not in (np.float16, np.float32):
+            dtype = np.dtype(np.float32)
+        name = self._stage(layers, dtype)
+        _run(
+            _fold_range,
+            [(self._acc.name, name, dtype.str, self.layout.size, s, e, float(weight), affine) for s, e in self._ranges],
+        )
+
+    def add(self, layers: Sequence[np.ndarray], weight: float = 1.0) -> None:
+        if not self.layout.matches(layers):
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        self._fold(layers, weight)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def add_flat(self, flat: np.ndarray, weight: float = 1.0) -> None:
+        if np.size(flat) != self.layout.size:
+            raise ValueError("Update shape does not match the aggregation layout")
+        self.add(self.layout.split(np.asarray(flat).reshape(-1)), weight)
+
+    def add_affine(
+        self,
+        codes: Sequence[np.ndarray],
+        scales: Sequence[float],
+        zeros: Sequence[float],
+        weight: float = 1.0,
+        base: Optional[Sequence[np.ndarray]] = None,
+        base_key: Any = None,
+    ) -> None:
+        if not self.layout.matches(codes):
+            raise ValueError("Update shape does not match the aggregation layout")
+        if weight <= 0:
+            raise ValueError("Aggregation weight must be positive")
+        if base is not None:
+            self.tally_base(base, weight, base_key)
+        if any(np.asarray(q).dtype != np.int8 for q in codes):
+            raise ValueError("Affine update must carry int8 codes")
+        affine = [(s, e, float(scales[i]), float(zeros[i])) for i, (s, e) in enumerate(self.layout.slices)]
+        self._fold(codes, weight, affine)
+        self.total_weight += float(weight)
+        self.count += 1
+
+    def _staged_base(self, key: Any, base: Sequence[np.ndarray]) -> str:
+        shm = self._staged_bases.get(key)
+        if shm is None:
+            shm = self._staged_bases[key] = self._segment(self.layout.size * 4)
+            flat = np.ndarray((self.layout.size,), dtype=np.float32, buffer=shm.buf)
+            for (start, end), layer in zip(self.layout.slices, base):
+                flat[start:end] = np.asarray(layer).reshape(-1)
+        return shm.name
+
+    def average(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if self.total_weight <= 0:
+            raise ValueError("No updates aggregated")
+        if self._out is None:
+            self._out = self._segment(self.layout.size * 4)
+        bases = [(self._staged_base(key, base), float(w)) for key, (base, w) in self._bases.items() if w]
+        _run(
+            _average_range,
+            [(self._acc.name, self._out.name, bases, self.layout.size, s, e, float(self.total_weight)) for s, e in self._ranges],
+        )
+        shared = np.ndarray((self.layout.size,), dtype=np.float32, buffer=self._out.buf)
+        if out is None:
+            out = np.empty(self.layout.size, dtype=np.float32)
+        np.copyto(out, shared)
+        return out
+
+    def close(self) -> None:
+        """Release the shared segments now instead of at garbage collection."""
+        self.sum = np.zeros(0)
+        self._finalizer()
+
+
+def create_engine(layout: LayerLayout) -> FedAvgEngine:
+    """FedAvg engine for ``layout``: process-parallel for large models when enabled."""
+    if pool_size() > 1 and layout.size >= settings.fedavg_parallel_min_params and pool_available():
+        return ParallelFedAvgEngine(layout)
+    return FedAvgEngine(layout)
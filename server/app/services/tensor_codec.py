@@ -0,0 +1,174 @@
+"""Binary tensor wire format shared by the orchestrator and workers.
+
+Layout (integers little-endian)::
+
+    8 bytes   header length N (uint64)
+    N bytes   UTF-8 JSON header, space padded so the data section is 64-byte aligned
+    ...       raw tensor bytes, concatenated in header order
+
+The header is a safetensors-style document::
+
+    {"__metadata__": {...}, "tensors": [{"name": "0", "dtype": "F32", "shape": [128], "data_offsets": [0, 512]}, ...]}
+
+Unlike safetensors, tensors are kept as an ordered list because FedAvg weights are positional.
+"""
+import json
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TENSOR_CONTENT_TYPE = "application/x-quackmesh-tensors"
+
+_ALIGN = 64
+_DTYPES: Dict[str, np.dtype] = {
+    "F64": np.dtype("<f8"),
+    "F32": np.dtype("<f4"),
+    "F16": np.dtype("<f2"),
+    "I64": np.dtype("<i8"),
+    "I32": np.dtype("<i4"),
+    "U32": np.dtype("<u4"),
+    "I8": np.dtype("i1"),
+    "U8": np.dtype("u1"),
+}
+_DTYPE_NAMES: Dict[np.dtype, str] = {v: k for k, v in _DTYPES.items()}
+
+
+def dtype_name(dtype: Any) -> str:
+    dt = np.dtype(dtype).newbyteorder("<") if np.dtype(dtype).itemsize > 1 else np.dtype(dtype)
+    try:
+        return _DTYPE_NAMES[dt]
+    except KeyError:
+        raise ValueError(f"Unsupported tensor dtype: {dtype}")
+
+
+def _le_contiguous(arr: np.ndarray) -> np.ndarray:
+    arr = np.asarray(arr)
+    if arr.dtype.itemsize > 1 and arr.dtype.byteorder == ">":
+        arr = arr.astype(arr.dtype.newbyteorder("<"))
+    return np.ascontiguousarray(arr)
+
+
+def _build_header(arrays: Sequence[np.ndarray], names: Optional[Sequence[str]], metadata: Optional[Dict[str, Any]]) -> bytes:
+    if names is not None and len(names) != len(arrays):
+        raise ValueError("names and arrays length mismatch")
+    tensors = []
+    offset = 0
+    for i, arr in enumerate(arrays):
+        nbytes = int(arr.nbytes)
+        tensors.append(
+            {
+                "name": str(names[i]) if names is not None else str(i),
+                "dtype": dtype_name(arr.dtype),
+                "shape": [int(d) for d in arr.shape],
+                "data_offsets": [offset, offset + nbytes],
+            }
+        )
+        offset += nbytes
+    header = json.dumps({"__metadata__": metadata or {}, "tensors": tensors}, separators=(",", ":")).encode("utf-8")
+    pad = (-(8 + len(header))) % _ALIGN
+    return header + b" " * pad
+
+
+def iter_encoded(
+    arrays: Sequence[np.ndarray],
+    names: Optional[Sequence[str]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Iterator[memoryview]:
+    """Yield the encoded document piecewise without joining tensor bytes into one buffer."""
+    arrays = [_le_contiguous(a) for a in arrays]
+    header = _build_header(arrays, names, metadata)
+    yield memoryview(struct.pack("<Q", len(header)) + header)
+    for arr in arrays:
+        if arr.nbytes:
+            yield memoryview(arr.reshape(-1)).cast("B")
+
+
+def encode_tensors(
+    arrays: Sequence[np.ndarray],
+    names: Optional[Sequence[str]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    return b"".join(iter_encoded(arrays, names, metadata))
+
+
+def decode_header(buf: Any) -> Tuple[Dict[str, Any], int]:
+    """Parse the header of an encoded document. Returns (header, data_start)."""
+    mv = memoryview(buf).cast("B")
+    if len(mv) < 8:
+        raise ValueError("Tensor payload too short")
+    (n,) = struct.unpack_from("<Q", mv, 0)
+    if n > len(mv) - 8:
+        raise ValueError("Tensor header length exceeds payload")
+    try:
+        header = json.loads(bytes(mv[8 : 8 + n]).decode("utf-8"))
+    except Exception:
+        raise ValueError("Tensor header is not valid JSON")
+    if not isinstance(header, dict) or not isinstance(header.get("tensors"), list):
+        raise ValueError("Tensor header missing 'tensors'")
+    return header, 8 + n
+
+
+def decode_tensors(buf: Any) -> Tuple[List[np.ndarray], Dict[str, Any]]:
+    """Decode an encoded document into read-only array views over ``buf`` plus its metadata."""
+    mv = memoryview(buf).cast("B")
+    header, start = decode_header(mv)
+    data_len = len(mv) - start
+    arrays: List[np.ndarray] = []
+    for t in header["tensors"]:
+        try:
+            dt = _DTYPES[t["dtype"]]
+            shape = tuple(int(d) for d in t["shape"])
+            begin, end = (int(x) for x in t["data_offsets"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Malformed tensor entry: {t!r}")
+        count = int(np.prod(shape, dtype=np.int64)) if shape else 1
+        if begin < 0 or end > data_len or end - begin != count * dt.itemsize:
+            raise ValueError(f"Tensor {t.get('name')!r} offsets do not match its shape")
+        arr = np.frombuffer(mv, dtype=dt, count=count, offset=start + begin)
+        arrays.append(arr.reshape(shape))
+    return arrays, dict(header.get("__metadata__") or {})
+
+
+def decode_stacked(buf: Any) -> Optional[Tuple[np.ndarray, List[Tuple[int, ...]], Dict[str, Any]]]:
+    """Decode a document whose tensors share one dtype and are laid out back to back.
+
+    Returns (flat, shapes, metadata) where ``flat`` is a single view over all tensor
+    data, or None if the document is not stacked that way.
+    """
+    mv = memoryview(buf).cast("B")
+    header, start = decode_header(mv)
+    tensors = header["tensors"]
+    dtypes = {t.get("dtype") for t in tensors}
+    if len(dtypes) != 1:
+        return None
+    dt = _DTYPES.get(dtypes.pop())
+    if dt is None:
+        return None
+    offset = 0
+    shapes: List[Tuple[int, ...]] = []
+    for t in tensors:
+        shape = tuple(int(d) for d in t["shape"])
+        begin, end = (int(x) for x in t["data_offsets"])
+        count = int(np.prod(shape, dtype=np.int64)) if shape else 1
+        if begin != offset or end - begin != count * dt.itemsize:
+            return None
+        shapes.append(shape)
+        offset = end
+    if start + offset > len(mv):
+        raise ValueError("Tensor data shorter than header offsets")
+    flat = np.frombuffer(mv, dtype=dt, count=offset // dt.itemsize, offset=start)
+    return flat, shapes, dict(header.get("__metadata__") or {})
+
+
+def accepts_tensors(accept: Optional[str]) -> bool:
+    return bool(accept) and TENSOR_CONTENT_TYPE in accept
+
+
+def is_tensor_payload(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() == TENSOR_CONTENT_TYPE
+
+
+def as_float32_layers(layers: Iterable[Any]) -> List[np.ndarray]:
+    """Normalize JSON lists or decoded tensors into flat float32 layers."""
+    return [np.asarray(layer, dtype=np.float32).reshape(-1) for layer in layers]
@@ -0,0 +1,154 @@
+"""Update codecs: how a worker's weight update is represented on the wire.
+
+``fp32``  float32 weights (default)
+``fp16``  float16 weights, half the upload size
+``int8``  per-layer affine int8 delta against the global model the worker downloaded,
+          ``w = base + q * scale + zero``; the base is identified by its blob digest
+``topk``  the largest-magnitude entries of the delta against the downloaded model,
+          as per-layer (index, value) pairs; the worker keeps the rest as a residual
+
+Encoded updates are folded into the FedAvg accumulator without first being
+expanded into float32 copies.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .fedavg import FedAvgEngine
+
+UPDATE_CODECS = ("fp32", "fp16", "int8", "topk")
+CODEC_DTYPES = {"fp32": "F32", "fp16": "F16", "int8": "I8", "topk": "SPARSE_F32"}
+DELTA_CODECS = ("int8", "topk")
+
+
+class EncodedUpdate:
+    def __init__(
+        self,
+        codec: str,
+        layers: Sequence[np.ndarray],
+        scales: Optional[np.ndarray] = None,
+        zeros: Optional[np.ndarray] = None,
+        base_digest: Optional[str] = None,
+        indices: Optional[Sequence[np.ndarray]] = None,
+        shapes: Optional[Sequence[tuple]] = None,
+    ):
+        self.codec = codec
+        self.shapes: List[tuple] = [tuple(s) for s in shapes] if shapes is not None else [np.shape(layer) for layer in layers]
+        self.layers = [np.asarray(layer).reshape(-1) for layer in layers]
+        self.scales = scales
+        self.zeros = zeros
+        self.base_digest = base_digest
+        self.indices = [np.asarray(idx).reshape(-1) for idx in indices] if indices is not None else None
+
+    @property
+    def is_delta(self) -> bool:
+        return self.codec in DELTA_CODECS
+
+    def fold_into(self, engine: FedAvgEngine, weight: float, base: Optional[Sequence[np.ndarray]] = None) -> None:
+        if self.is_delta and base is None:
+            raise ValueError(f"{self.codec} update requires its base model")
+        if self.codec == "int8":
+            engine.add_affine(self.layers, self.scales, self.zeros, weight, base=base, base_key=self.base_digest)
+        elif self.codec == "topk":
+            engine.add_sparse(self.indices, self.layers, weight, base=base, base_key=self.base_digest)
+        else:
+            engine.add(self.layers, weight)
+
+    def fold_delta_into(self, engine: FedAvgEngine, weight: float, base: Optional[Sequence[np.ndarray]] = None, base_key: Any = None) -> None:
+        """Fold ``weight * (update - base)``; delta codecs already carry exactly that."""
+        if self.codec == "int8":
+            engine.add_affine(self.layers, self.scales, self.zeros, weight)
+        elif self.codec == "topk":
+            engine.add_sparse(self.indices, self.layers, weight)
+        else:
+            if base is None:
+                raise ValueError("A dense update needs its base model to form a delta")
+            engine.add(self.layers, weight)
+            engine.tally_base(base, -weight, base_key)
+
+    def delta_norm(self, base: Optional[Sequence[np.ndarray]] = None) -> Optional[float]:
+        """L2 norm of ``update - base``; None for a dense update whose base is unknown."""
+        sq = 0.0
+        if self.codec == "topk":
+            for vals in self.layers:
+                v = vals.astype(np.float64)
+                sq += float(np.dot(v, v))
+        elif self.codec == "int8":
+            for q, s, z in zip(self.layers, self.scales, self.zeros):
+                d = q.astype(np.float64) * float(s) + float(z)
+                sq += float(np.dot(d, d))
+        else:
+            if base is None:
+                return None
+            for layer, b in zip(self.layers, base):
+                d = layer.astype(np.float64) - np.asarray(b, dtype=np.float64).reshape(-1)
+                sq += float(np.dot(d, d))
+        return float(np.sqrt(sq))
+
+    def dense(self, base: Optional[Sequence[np.ndarray]] = None) -> List[np.ndarray]:
+        """Float32 weights of the update (allocates; only for callers that need them)."""
+        if not self.is_delta:
+            return [layer.astype(np.float32) for layer in self.layers]
+        if base is None:
+            raise ValueError(f"{self.codec} update requires its base model")
+        base = [np.asarray(b, dtype=np.float32).reshape(-1) for b in base]
+        if self.codec == "topk":
+            out = [b.copy() for b in base]
+            for layer, idx, vals in zip(out, self.indices, self.layers):
+                layer[idx.astype(np.intp, copy=False)] += vals.astype(np.float32)
+            return out
+        return [
+            (b + q.astype(np.float32) * np.float32(s) + np.float32(z)).astype(np.float32)
+            for q, s, z, b in zip(self.layers, self.scales, self.zeros, base)
+        ]
+
+
+def from_layers(layers: Sequence[Any]) -> EncodedUpdate:
+    return EncodedUpdate("fp32", [np.asarray(layer, dtype=np.float32) for layer in layers])
+
+
+def from_tensors(arrays: Sequence[np.ndarray], meta: Dict[str, Any], implicit_base: bool = False) -> EncodedUpdate:
+    """Interpret decoded tensors according to ``meta["codec"]``; raises ValueError if inconsistent.
+
+    ``implicit_base`` is for transports where the base of a delta is known from context
+    (the parameters of a Flower round) rather than named by digest.
+    """
+    codec = str(meta.get("codec") or "fp32").lower()
+    if codec not in UPDATE_CODECS:
+        raise ValueError(f"Unknown update codec: {codec}")
+    if codec == "fp32":
+        if any(a.dtype != np.float32 for a in arrays):
+            raise ValueError("fp32 update must carry float32 tensors")
+        return EncodedUpdate("fp32", arrays)
+    if codec == "fp16":
+        if any(a.dtype != np.float16 for a in arrays):
+            raise ValueError("fp16 update must carry float16 tensors")
+        return EncodedUpdate("fp16", arrays)
+    base_digest = meta.get("base_digest")
+    if not base_digest and not implicit_base:
+        raise ValueError(f"{codec} update must name the base model digest it was computed against")
+    base_digest = str(base_digest) if base_digest else None
+    if codec == "topk":
+        # Per layer an index tensor followed by its float32 values; dense shapes in the metadata
+        shapes = meta.get("shapes")
+        if not isinstance(shapes, list) or len(arrays) != 2 * len(shapes):
+            raise ValueError("topk update needs one (indices, values) pair per layer in 'shapes'")
+        try:
+            shapes = [tuple(int(d) for d in s) for s in shapes]
+        except (TypeError, ValueError):
+            raise ValueError("topk update has malformed 'shapes'")
+        indices, values = list(arrays[0::2]), list(arrays[1::2])
+        if any(idx.dtype.kind not in "iu" for idx in indices):
+            raise ValueError("topk indices must be integers")
+        if any(v.dtype != np.float32 for v in values):
+            raise ValueError("topk values must be float32")
+        return EncodedUpdate("topk", values, base_digest=base_digest, indices=indices, shapes=shapes)
+    # int8: one int8 tensor per layer followed by per-layer scales and zero points
+    if len(arrays) < 2:
+        raise ValueError("int8 update is missing its scale/zero tensors")
+    codes, scales, zeros = list(arrays[:-2]), arrays[-2].reshape(-1), arrays[-1].reshape(-1)
+    if any(q.dtype != np.int8 for q in codes):
+        raise ValueError("int8 update must carry int8 codes")
+    if scales.dtype != np.float32 or zeros.dtype != np.float32 or scales.size != len(codes) or zeros.size != len(codes):
+        raise ValueError("int8 update needs one float32 scale and zero point per layer")
+    return EncodedUpdate("int8", codes, scales=scales, zeros=zeros, base_digest=base_digest)
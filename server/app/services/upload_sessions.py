@@ -0,0 +1,112 @@
+"""Resumable chunked uploads of large update bodies.
+
+A session pre-allocates a spool file of the declared size. Chunks arrive as
+``Content-Range`` PUTs, each with its SHA-256, and are streamed into place, so the
+orchestrator never holds a whole update in request memory. Received byte ranges
+are recorded on the ``UploadSession`` row, so any process can take the next chunk,
+report what is missing to a resuming client, or commit the upload.
+"""
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import UploadSession
+
+_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def spool_path(upload_id: str) -> str:
+    return os.path.join(settings.upload_spool_dir, f"{upload_id}.part")
+
+
+def create(session: Session, job_id: int, size: int, sha256: Optional[str] = None) -> UploadSession:
+    """Open a session and pre-allocate its spool file."""
+    if size <= 0 or size > settings.upload_max_bytes:
+        raise ValueError(f"Upload size must be between 1 and {settings.upload_max_bytes} bytes")
+    os.makedirs(settings.upload_spool_dir, exist_ok=True)
+    upload = UploadSession(id=uuid.uuid4().hex, job_id=job_id, size=size, sha256=(sha256 or None) and sha256.lower(), received=[])
+    with open(spool_path(upload.id), "wb") as f:
+        f.truncate(size)
+    session.add(upload)
+    return upload
+
+
+def get(session: Session, job_id: int, upload_id: str, for_update: bool = False) -> Optional[UploadSession]:
+    stmt = select(UploadSession).where(UploadSession.id == upload_id, UploadSession.job_id == job_id)
+    if for_update:
+        stmt = stmt.with_for_update()
+    return session.execute(stmt).scalar_one_or_none()
+
+
+def parse_content_range(value: Optional[str], size: int) -> Tuple[int, int]:
+    """``bytes a-b/total`` to a half-open [start, end) range within the upload."""
+    m = _RANGE_RE.match((value or "").strip())
+    if not m:
+        raise ValueError("Content-Range must be 'bytes <start>-<end>/<total>'")
+    start, last, total = (int(g) for g in m.groups())
+    if total != size or start > last or last >= size:
+        raise ValueError("Content-Range is outside the upload")
+    return start, last + 1
+
+
+async def write_range(path: str, start: int, end: int, chunks: AsyncIterator[bytes], sha256: Optional[str]) -> None:
+    """Stream a request body into ``path`` at ``start``; raises ValueError on a length or checksum mismatch."""
+    h = hashlib.sha256()
+    offset = start
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if offset + len(chunk) > end:
+                raise ValueError("Chunk is longer than its Content-Range")
+            h.update(chunk)
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    finally:
+        os.close(fd)
+    if offset != end:
+        raise ValueError("Chunk is shorter than its Content-Range")
+    if sha256 and h.hexdigest() != sha256.lower():
+        raise ValueError("Chunk SHA-256 mismatch")
+
+
+def add_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Merge [start, end) into sorted, non-overlapping ranges."""
+    merged: List[List[int]] = []
+    for s, e in sorted([*[list(r) for r in ranges or []], [start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def is_complete(upload: UploadSession) -> bool:
+    return (upload.received or []) == [[0, upload.size]]
+
+
+def expire(session: Session) -> int:
+    """Drop open sessions untouched for longer than the TTL, with their spool files."""
+    cutoff = datetime.utcnow() - timedelta(hours=settings.upload_session_ttl_hours)
+    stale = session.execute(
+        select(UploadSession).where(UploadSession.status == "open", UploadSession.updated_at < cutoff)
+    ).scalars().all()
+    for upload in stale:
+        discard_spool(upload.id)
+        session.delete(upload)
+    return len(stale)
+
+
+def discard_spool(upload_id: str) -> None:
+    try:
+        os.unlink(spool_path(upload_id))
+    except FileNotFoundError:
+        pass
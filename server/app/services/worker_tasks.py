@@ -0,0 +1,112 @@
+"""Training rounds dispatched to workers as queued tasks.
+
+A worker answers ``POST /task/train`` at once with a task id and runs the round in
+the background, so dispatching never holds a connection open for a whole round.
+Each dispatched task gets a ``WorkerTask`` row; the worker POSTs the task's final
+state to ``/round/{job_id}/tasks/report`` when it finishes, and ``refresh`` polls
+``GET /task/{id}`` for tasks still in flight.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import WorkerTask
+
+logger = logging.getLogger("quackmesh.worker_tasks")
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+def dispatch_train(session: Session, job_id: int, endpoint: str, steps: int, round_no: Optional[int], timeout: float) -> Dict[str, Any]:
+    """Queue a training round on ``endpoint``. Returns the per-endpoint result for the caller."""
+    url = f"http://{endpoint}/task/train"
+    try:
+        r = requests.post(url, json={"job_id": job_id, "steps": steps}, timeout=timeout)
+    except requests.RequestException as e:
+        return {"endpoint": endpoint, "error": str(e)}
+    ok = r.status_code in (200, 202)
+    try:
+        body = r.json()
+    except ValueError:
+        body = r.text
+    result: Dict[str, Any] = {"endpoint": endpoint, "status": r.status_code, "ok": ok, "body": body}
+    task_id = body.get("task_id") if ok and isinstance(body, dict) else None
+    if task_id:
+        row = _find(session, job_id, str(task_id))
+        if row is None:
+            row = WorkerTask(job_id=job_id, task_id=str(task_id), kind="train", status="queued")
+            session.add(row)
+            _apply(row, body)
+        # else: a fast task already reported back; keep its final state
+        row.endpoint, row.round = endpoint, round_no
+        result["task_id"] = task_id
+    return result
+
+
+def _find(session: Session, job_id: int, task_id: str) -> Optional[WorkerTask]:
+    return session.execute(
+        select(WorkerTask).where(WorkerTask.job_id == job_id, WorkerTask.task_id == task_id)
+    ).scalars().first()
+
+
+def _apply(row: WorkerTask, state: Dict[str, Any]) -> None:
+    row.status = str(state.get("status") or row.status)
+    if state.get("progress") is not None:
+        row.progress = state["progress"]
+    if state.get("result") is not None:
+        row.result = state["result"]
+    row.error = state.get("error")
+    row.updated_at = datetime.utcnow()
+    if row.status in FINISHED and row.finished_at is None:
+        row.finished_at = row.updated_at
+
+
+def record_report(session: Session, job_id: int, state: Dict[str, Any]) -> WorkerTask:
+    """Apply a worker's callback.
+
+    A task can finish before its dispatch is committed (or be started by another
+    replica), so an unknown task gets its row here; dispatch fills in the endpoint.
+    """
+    row = _find(session, job_id, str(state.get("task_id")))
+    if row is None:
+        row = WorkerTask(job_id=job_id, task_id=str(state.get("task_id")), endpoint="", kind=str(state.get("kind") or "train"))
+        session.add(row)
+    _apply(row, state)
+    session.flush()
+    logger.info("worker_task.report", extra={"job_id": job_id, "task_id": row.task_id, "status": row.status})
+    return row
+
+
+def list_tasks(session: Session, job_id: int, round_no: Optional[int] = None) -> List[WorkerTask]:
+    stmt = select(WorkerTask).where(WorkerTask.job_id == job_id).order_by(WorkerTask.id.desc())
+    if round_no is not None:
+        stmt = stmt.where(WorkerTask.round == round_no)
+    return session.execute(stmt).scalars().all()
+
+
+def refresh(session: Session, rows: List[WorkerTask], timeout: float = 5) -> None:
+    """Poll the workers for tasks that have not reported completion (lost callbacks, progress)."""
+    for row in rows:
+        if row.status in FINISHED or not row.endpoint:
+            continue
+        try:
+            r = requests.get(f"http://{row.endpoint}/task/{row.task_id}", timeout=timeout)
+        except requests.RequestException:
+            continue
+        if r.status_code == 200:
+            _apply(row, r.json())
+        elif r.status_code == 404:
+            # The worker restarted (its task history is in memory) or expired the task
+            _apply(row, {"status": "failed", "error": "task unknown to worker"})
+
+
+def cancel(row: WorkerTask, timeout: float = 5) -> Dict[str, Any]:
+    r = requests.post(f"http://{row.endpoint}/task/{row.task_id}/cancel", timeout=timeout)
+    r.raise_for_status()
+    state = r.json()
+    _apply(row, state)
+    return state
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from app.services.json_stream import parse_update_json
+
+
+def _parse(body: bytes, chunk: int = 7):
+    async def chunks():
+        for i in range(0, len(body), chunk):
+            yield body[i : i + chunk]
+
+    return asyncio.run(asyncio.wait_for(parse_update_json(chunks()), 3))
+
+
+def test_parses_fields_and_weights():
+    fields, weights = _parse(b'{"val_accuracy": 0.5, "weights": [[1, 2.5], []], "contributor": "a"}')
+    assert fields == {"val_accuracy": 0.5, "contributor": "a"}
+    assert [w.tolist() for w in weights] == [[1.0, 2.5], []]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"val_accuracy": 12.',
+        b'{"val_accuracy": 12',
+        b'{"val_accuracy": 0.5x}',
+        b'{"val_accuracy": 0.5, "contributor": "a"b}',
+        b'{"val_accuracy": NaN}',
+        b'{"weights": [[1, Infinity]]}',
+    ],
+)
+def test_rejects_truncated_or_trailing_garbage(body):
+    for chunk in (1, 7, len(body)):
+        with pytest.raises(ValueError):
+            _parse(body, chunk)